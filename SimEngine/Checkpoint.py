@@ -0,0 +1,152 @@
+#!/usr/bin/python
+'''
+\brief Checkpoint and restore of a running simulation.
+
+A checkpoint holds the SimEngine state (event queue included), the motes and
+topology, the Propagation state and the state of the random module, taken at
+a given ASN. The file contains two pickles: a small header with the settings
+(see readHeader), then the state itself.
+
+The singletons (SimEngine, SimSettings, Propagation, SimStats) are not part
+of the state, references to them are pickled by name and resolved to the
+singletons of the restoring process. Motes are pickled by id too, their
+states are stored side by side, which keeps the pickle shallow whatever the
+size of the network. Callbacks in the event queue are bound methods, pickled
+as (object, method name).
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('Checkpoint')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import os
+import types
+import random
+import cPickle
+import copy_reg
+
+import SimEngine
+import SimSettings
+import Propagation
+import SimStats
+import Mote
+
+#============================ defines =========================================
+
+VERSION           = 2
+
+# SimEngine/Propagation attributes which are not simulation state
+ENGINE_RESOURCES  = ['dataLock','pauseSem','settings','propagation','runNum','restoredAsn','checkpointAsn','checkpointFile','completed','dispatchProfiler']
+PROPAGATION_RESOURCES = ['dataLock','settings','engine']
+
+#============================ helpers =========================================
+
+def _singletons():
+    return [
+        ('SimEngine',   SimEngine.SimEngine),
+        ('SimSettings', SimSettings.SimSettings),
+        ('Propagation', Propagation.Propagation),
+        ('SimStats',    SimStats.SimStats),
+    ]
+
+def _persistentId(obj):
+    if isinstance(obj,Mote.Mote):
+        return ('Mote',obj.id)
+    for (name,cls) in _singletons():
+        if obj is cls._instance:
+            return name
+    return None
+
+def _persistentLoad(name):
+    for (singletonName,cls) in _singletons():
+        if singletonName==name:
+            # the singleton of this process, initialized or not yet
+            return cls.__new__(cls)
+    raise cPickle.UnpicklingError('unknown singleton {0}'.format(name))
+
+def _reduceMethod(method):
+    return (getattr,(method.im_self,method.im_func.__name__))
+
+copy_reg.pickle(types.MethodType,_reduceMethod)
+
+def _getState(obj,resources):
+    return dict([(k,v) for (k,v) in obj.__dict__.items() if k not in resources and not k.startswith('_')])
+
+#============================ public ==========================================
+
+def save(filename):
+    '''
+    write the state of the running simulation to filename.
+    '''
+    engine      = SimEngine.SimEngine()
+    settings    = SimSettings.SimSettings()
+
+    header      = {
+        'version':     VERSION,
+        'asn':         engine.asn,
+        'runNum':      engine.runNum,
+        'settings':    _getState(settings,[]),
+    }
+    state       = {
+        'random':      random.getstate(),
+        'engine':      _getState(engine,ENGINE_RESOURCES),
+        'propagation': _getState(engine.propagation,PROPAGATION_RESOURCES),
+        'motes':       dict([(mote.id,mote.__reduce__()[2]) for mote in engine.motes]),
+    }
+
+    # write-then-rename, so a crash never leaves a truncated checkpoint
+    tempname    = '{0}.tmp'.format(filename)
+    with open(tempname,'wb') as f:
+        cPickle.dump(header,f,cPickle.HIGHEST_PROTOCOL)
+        pickler = cPickle.Pickler(f,cPickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = _persistentId
+        pickler.dump(state)
+    os.rename(tempname,filename)
+
+def readHeader(filename):
+    '''
+    header of a checkpoint: version, asn, runNum and settings.
+    '''
+    with open(filename,'rb') as f:
+        header = cPickle.load(f)
+    if header['version']!=VERSION:
+        raise ValueError('{0}: checkpoint version {1}, expected {2}'.format(filename,header['version'],VERSION))
+    return header
+
+def restore(engine,filename):
+    '''
+    load a checkpoint into engine, which was initialized without motes.
+    '''
+    motes           = {} # indexed by id
+
+    def persistentLoad(pid):
+        if isinstance(pid,tuple) and pid[0]=='Mote':
+            if pid[1] not in motes:
+                motes[pid[1]] = Mote._unpickleMote(pid[1])
+            return motes[pid[1]]
+        return _persistentLoad(pid)
+
+    with open(filename,'rb') as f:
+        header      = cPickle.load(f)
+        if header['version']!=VERSION:
+            raise ValueError('{0}: checkpoint version {1}, expected {2}'.format(filename,header['version'],VERSION))
+        unpickler   = cPickle.Unpickler(f)
+        unpickler.persistent_load = persistentLoad
+        state       = unpickler.load()
+
+    for (id,moteState) in state['motes'].items():
+        persistentLoad(('Mote',id)).__setstate__(moteState)
+
+    engine.__dict__.update(state['engine'])
+    engine.propagation.__dict__.update(state['propagation'])
+    random.setstate(state['random'])
+
+    return header['asn']
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+'''
+\brief Wall time spent in the callbacks the engine dispatches, per event kind.
+
+The kind of an event is the name in its uniqueTag (e.g.
+'_tsch_action_activeCell', 'propagation', '_otf_action_housekeeping'), with
+any trailing index dropped, or the name of its callback if it has no tag. The
+length of the event queue is sampled at each ASN which has events, and
+summarized per cycle.
+
+Only used when the run is started with --dispatchProfile, see SimEngine.run.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('DispatchProfiler')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import re
+import time
+
+#============================ defines =========================================
+
+# trailing index of the tags of numbered events
+INDEX_SUFFIX      = re.compile(r'_\d+$')
+
+#============================ body ============================================
+
+class DispatchProfiler(object):
+
+    def __init__(self,slotframeLength):
+
+        # store params
+        self.slotframeLength = slotframeLength
+
+        # local variables
+        self.callStats       = {}    # per tag name, [numCalls,totalTime,maxTime]
+        self.queueStats      = {}    # per cycle, [numSamples,sumLength,maxLength]
+
+    #======================== public ==========================================
+
+    def dispatch(self,cb,uniqueTag):
+        ''' call cb, timing it '''
+        startTime  = time.time()
+        cb()
+        duration   = time.time()-startTime
+
+        name       = uniqueTag[1] if uniqueTag else cb.__name__
+        stats      = self.callStats.get(name)
+        if stats==None:
+            self.callStats[name] = [1,duration,duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            if duration>stats[2]:
+                stats[2] = duration
+
+    def sampleQueue(self,asn,queueLength):
+        cycle      = asn/self.slotframeLength
+        stats      = self.queueStats.get(cycle)
+        if stats==None:
+            self.queueStats[cycle] = [1,queueLength,queueLength]
+        else:
+            stats[0] += 1
+            stats[1] += queueLength
+            if queueLength>stats[2]:
+                stats[2] = queueLength
+
+    def getKindStats(self):
+        '''
+        call statistics per event kind.
+
+        Returns {kind: (numCalls,totalTime,maxTime)}.
+        '''
+        kindStats  = {}
+        for (name,(numCalls,totalTime,maxTime)) in self.callStats.items():
+            kind   = INDEX_SUFFIX.sub('',str(name))
+            if kind in kindStats:
+                (n,t,m)  = kindStats[kind]
+                kindStats[kind] = (n+numCalls,t+totalTime,max(m,maxTime))
+            else:
+                kindStats[kind] = (numCalls,totalTime,maxTime)
+        return kindStats
+
+    def getSummary(self):
+        ''' the per event kind and per cycle tables, as a list of lines '''
+        kindStats  = self.getKindStats()
+        totalTime  = sum([t for (_,t,_) in kindStats.values()])
+        lines      = []
+
+        lines     += ['# event dispatch, by total wall time']
+        lines     += ['# {0:<40} {1:>10} {2:>10} {3:>12} {4:>10} {5:>6}'.format('kind','calls','total (s)','mean (us)','max (ms)','share')]
+        for (kind,(numCalls,t,maxTime)) in sorted(kindStats.items(),key=lambda x: -x[1][1]):
+            lines += ['  {0:<40} {1:>10} {2:>10.3f} {3:>12.1f} {4:>10.3f} {5:>5.1f}%'.format(
+                kind,
+                numCalls,
+                t,
+                1e6*t/numCalls,
+                1e3*maxTime,
+                100*t/totalTime if totalTime else 0,
+            )]
+        lines     += ['  {0:<40} {1:>10} {2:>10.3f}'.format(
+            'total',
+            sum([n for (n,_,_) in kindStats.values()]),
+            totalTime,
+        )]
+
+        lines     += ['']
+        lines     += ['# event queue length, per cycle']
+        lines     += ['# {0:>6} {1:>10} {2:>10}'.format('cycle','mean','max')]
+        for (cycle,(numSamples,sumLength,maxLength)) in sorted(self.queueStats.items()):
+            lines += ['  {0:>6} {1:>10.1f} {2:>10}'.format(
+                cycle,
+                float(sumLength)/numSamples,
+                maxLength,
+            )]
+
+        return lines
+
+    def dump(self,filename):
+        with open(filename,'w') as f:
+            f.write('\n'.join(self.getSummary())+'\n')
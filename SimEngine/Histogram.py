@@ -0,0 +1,80 @@
+#!/usr/bin/python
+'''
+\brief Log-scale histogram of delays, with percentiles.
+
+Values are non-negative integers (delays in slots). Values below
+2^(SUB_BUCKET_BITS+1) have a bucket each; above, each power of 2 is split in
+2^SUB_BUCKET_BITS buckets, so a percentile is off by less than
+1/2^SUB_BUCKET_BITS of its value (it is the upper bound of its bucket). The
+number of buckets only grows with the logarithm of the largest value, and
+histograms are merged by adding their buckets (+=), e.g. those of all motes.
+
+Count, sum and maximum are kept exact.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('Histogram')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ defines =========================================
+
+SUB_BUCKET_BITS   = 4    # 16 buckets per power of 2, i.e. 6.25% precision
+
+#============================ body ============================================
+
+class Histogram(object):
+
+    __slots__ = ['buckets','count','sum','max']
+
+    def __init__(self):
+        self.buckets         = {}    # indexed by lower bound of the bucket, number of values
+        self.count           = 0
+        self.sum             = 0
+        self.max             = 0
+
+    def add(self,value):
+        shift                = max(0,value.bit_length()-SUB_BUCKET_BITS-1)
+        low                  = (value>>shift)<<shift
+        self.buckets[low]    = self.buckets.get(low,0)+1
+        self.count          += 1
+        self.sum            += value
+        if value>self.max:
+            self.max         = value
+
+    def __iadd__(self,other):
+        for (low,num) in other.buckets.items():
+            self.buckets[low] = self.buckets.get(low,0)+num
+        self.count          += other.count
+        self.sum            += other.sum
+        self.max             = max(self.max,other.max)
+        return self
+
+    def getMean(self):
+        return float(self.sum)/float(self.count) if self.count>0 else 0
+
+    def getPercentile(self,p):
+        ''' the value below which p percent of the values are (nearest rank), 0 if empty '''
+        if not self.count:
+            return 0
+        rank                 = max(1,int(-(-p*self.count//100)))  # ceil
+        num                  = 0
+        for low in sorted(self.buckets.keys()):
+            num             += self.buckets[low]
+            if num>=rank:
+                shift        = max(0,low.bit_length()-SUB_BUCKET_BITS-1)
+                return min(low+(1<<shift)-1,self.max)
+        return self.max
+
+    def __repr__(self):
+        return 'Histogram(count={0},p50={1},p99={2},max={3})'.format(
+            self.count,
+            self.getPercentile(50),
+            self.getPercentile(99),
+            self.max,
+        )
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+'''
+\brief Per-hop trace of the packets which reach the DAG root.
+
+Only used when the run is started with --hopTrace. Each packet then carries a
+hop log, a flat list with HOP_LEN integers per hop it was transmitted over:
+- the ASN it was enqueued at the transmitter;
+- the ASN it reached the head of the TX queue (or of its first transmission,
+  when sent behind another packet in the same slot);
+- the ASN of its first transmission;
+- the ASN it was received by the next hop;
+- the number of transmissions which were not acknowledged.
+
+When the DAG root receives the packet, its origin and hop log are appended to
+a flat array of integers, written to a binary file at the end of the run (see
+bin/summarizeHopTrace.py). Each record is:
+
+    srcId, genAsn, deliveryAsn, numHops, numHops*HOP_LEN hop fields
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('HopTrace')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import os
+import array
+
+#============================ defines =========================================
+
+TYPECODE          = 'i'  # 32-bit signed integers, native byte order
+HEADER_LEN        = 4    # srcId, genAsn, deliveryAsn, numHops
+HOP_LEN           = 5    # enqueueAsn, headAsn, firstTxAsn, rxAsn, numRetries
+
+#============================ body ============================================
+
+class HopTrace(object):
+
+    def __init__(self):
+
+        # local variables
+        self.trace           = array.array(TYPECODE)
+        self.numPackets      = 0
+
+    #======================== public ==========================================
+
+    def record(self,packet,asn,hopLog):
+        ''' packet was received by the DAG root at asn, with hopLog '''
+        self.trace.extend((packet.srcId,packet.genAsn,asn,len(hopLog)/HOP_LEN))
+        self.trace.extend(hopLog)
+        self.numPackets     += 1
+
+    def dump(self,filename):
+        with open(filename,'wb') as f:
+            self.trace.tofile(f)
+
+#============================ helpers =========================================
+
+def readTrace(filename):
+    '''
+    the records of a trace file, as (srcId,genAsn,deliveryAsn,hops), hops
+    being a list of (enqueueAsn,headAsn,firstTxAsn,rxAsn,numRetries) from the
+    source to the DAG root.
+    '''
+    trace    = array.array(TYPECODE)
+    with open(filename,'rb') as f:
+        trace.fromfile(f,os.path.getsize(filename)/trace.itemsize)
+
+    i        = 0
+    while i<len(trace):
+        (srcId,genAsn,deliveryAsn,numHops) = trace[i:i+HEADER_LEN]
+        i   += HEADER_LEN
+        hops = [tuple(trace[j:j+HOP_LEN]) for j in range(i,i+numHops*HOP_LEN,HOP_LEN)]
+        i   += numHops*HOP_LEN
+        yield (srcId,genAsn,deliveryAsn,hops)
@@ -27,7 +27,6 @@ log.addHandler(NullHandler())
 #============================ imports =========================================
 
 import copy
-import random
 import threading
 import math
 
@@ -35,9 +34,19 @@ import SimEngine
 import SimSettings
 import Propagation
 import Topology
+import Packet
+import Histogram
 
 #============================ defines =========================================
 
+#============================ helpers =========================================
+
+def _unpickleMote(id):
+    # see Mote.__reduce__ and Checkpoint
+    mote    = Mote.__new__(Mote)
+    mote.id = id
+    return mote
+
 #============================ body ============================================
 
 class Mote(object):
@@ -77,6 +86,8 @@ class Mote(object):
     DEFAULT_DIO_INTERVAL_MIN           = 3 # log2(DIO_INTERVAL_MIN), with DIO_INTERVAL_MIN expressed in ms
     DEFAULT_DIO_INTERVAL_DOUBLINGS     = 20 # maximum number of doublings of DIO_INTERVAL_MIN (DIO_INTERVAL_MAX = 2^(DEFAULT_DIO_INTERVAL_MIN+DEFAULT_DIO_INTERVAL_DOUBLINGS) ms)
     DEFAULT_DIO_REDUNDANCY_CONSTANT    = 10 # number of hearings to suppress next transmission in the current interval
+    DIO_INTERVAL_MIN                   = 2**DEFAULT_DIO_INTERVAL_MIN # ms
+    DIO_INTERVAL_MAX                   = 2**(DEFAULT_DIO_INTERVAL_MIN+DEFAULT_DIO_INTERVAL_DOUBLINGS) # ms
     
     #=== otf
     OTF_TRAFFIC_SMOOTHING              = 0.5
@@ -109,6 +120,13 @@ class Mote(object):
         self.settings                  = SimSettings.SimSettings()
         self.propagation               = Propagation.Propagation()
         
+        # random streams (see RandomStreams)
+        self.appRandom                 = self.engine.randomStreams.get('app',id)
+        self.housekeepingRandom        = self.engine.randomStreams.get('housekeeping',id)
+        self.sixtopRandom              = self.engine.randomStreams.get('sixtop',id)
+        self.channelRandom             = self.engine.randomStreams.get('channel',id)
+        self.rplRandom                 = self.engine.randomStreams.get('rpl',id)
+        
         # app
         self.pkPeriod                  = self.settings.pkPeriod        
         # role
@@ -122,6 +140,15 @@ class Mote(object):
         self.neighborRank              = {}                    # indexed by neighbor
         self.neighborDagRank           = {}                    # indexed by neighbor
         self.trafficPortionPerParent   = {}                    # indexed by parent, portion of outgoing traffic
+        self.rplDirty                  = True                  # [rplIncremental] inputs of _rpl_housekeeping changed since it last ran
+        self.rplHousekeepingAsn        = None                  # [rplIncremental] ASN of the last housekeeping
+        self.rplHousekeepingPending    = False                 # [rplIncremental] _rpl_action_housekeeping scheduled
+        self.rplRankIncreases          = {}                    # [rplIncremental] indexed by neighbor, rank increase at the last housekeeping
+        self.rplDioSenders             = set()                 # [rplIncremental] neighbors whose DIO scheduled the pending housekeeping
+        self.dioInterval               = self.DIO_INTERVAL_MIN # [dioTrickle] Trickle interval I (ms)
+        self.dioIntervalStart          = 0                     # [dioTrickle] ASN the current interval started at
+        self.dioCounter                = 0                     # [dioTrickle] consistent DIOs heard in the current interval
+        self.dioNextAsn                = None                  # [dioTrickle] ASN of the scheduled DIO
         # otf
         self.asnOTFevent               = None
         self.otfHousekeepingPeriod     = self.settings.otfHousekeepingPeriod
@@ -139,19 +166,22 @@ class Mote(object):
         self.sixtopPdrThreshold           = self.settings.sixtopPdrThreshold
         self.sixtopHousekeepingPeriod  = self.settings.sixtopHousekeepingPeriod
         # tsch
-        self.txQueue                   = []
+        self.txQueue                   = Packet.TxQueue()
         self.pktToSend                 = []                 #list of packets to send in one ts (in different channels)
         self.schedule                  = {}                 # indexed by ts and ch  contains info of the all the channels in each ts 
+        self.txStatsPerNeighbor        = {}                 # indexed by neighbor, [numTx,numTxAck] summed over the TX cells to it (see _estimateETX)
         self.scheduleNeigborhood       = {}               # indexed by ts and ch contains the cells used in my neighborhood                    
         
         #self.waitingFor                = None               #not used, using multichannel capabilities
         self.timeCorrectedSlot         = None
+        self.clockOffset               = None               # offset to the DAGroot at clockOffsetAsn, see clock_getOffsetToDagRoot
+        self.clockOffsetAsn            = None
         # radio
         self.txPower                   = 0                     # dBm
         self.antennaGain               = 0                     # dBi
         self.minRssi                   = self.settings.minRssi # dBm
         self.noisepower                = -105                  # dBm
-        self.drift                     = random.uniform(-self.RADIO_MAXDRIFT, self.RADIO_MAXDRIFT)
+        self.drift                     = self.engine.randomStreams.get('drift',id).uniform(-self.RADIO_MAXDRIFT, self.RADIO_MAXDRIFT)
         # wireless
         self.RSSI                      = {}                    # indexed by neighbor
         self.PDR                       = {}                    # indexed by neighbor
@@ -197,8 +227,23 @@ class Mote(object):
         self.numRandomSelections=0          # random selections performed (when no cells are available, or when OTF-sf0 is used)
                         
         #emunicio debug
-        self.DEBUG=False       
-
+        self.DEBUG=False
+
+    def __hash__(self):
+        # motes key many dicts, hash by id so iteration order (hence the
+        # random draws) does not depend on memory layout, see Checkpoint
+        return self.id
+
+    def __reduce__(self):
+        # pickled with its id up front: motes are dict keys (see __hash__),
+        # possibly before their state is restored
+        state = self.__dict__.copy()
+        del state['dataLock']
+        return (_unpickleMote,(self.id,),state)
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.dataLock                  = threading.RLock()
 
     #======================== stack ===========================================
     
@@ -208,7 +253,7 @@ class Mote(object):
         self.dagRoot              = True
         self.rank                 = 0
         self.dagRank              = 0
-        self.packetLatencies      = [] # in slots
+        self._stats_resetLatencyStats() # in slots
         self.packetHops           = []
         
     
@@ -222,10 +267,10 @@ class Mote(object):
             if not self.finishMyFlow:
                 if not firstPacket:
                     # compute random delay
-                    delay            = self.pkPeriod*(1+random.uniform(-self.settings.pkPeriodVar,self.settings.pkPeriodVar)) 
+                    delay            = self.pkPeriod*(1+self.appRandom.uniform(-self.settings.pkPeriodVar,self.settings.pkPeriodVar)) 
                 else:
                     # compute initial time within the range of [next asn, next asn+pkPeriod]
-                    delay            = self.settings.slotDuration + (self.settings.slotframeLength/6)*random.random() + (self.settings.slotframeLength/6) 
+                    delay            = self.settings.slotDuration + (self.settings.slotframeLength/6)*self.appRandom.random() + (self.settings.slotframeLength/6) 
                     # max at 16.9 or 33 seconds for a frame length of 101
                          
                 assert delay>0   
@@ -242,22 +287,26 @@ class Mote(object):
                         
     #not used for the moment      
     def _app_schedule_sendPacketBurst(self):
-        ''' create an event that is inserted into the simulator engine to send a data burst'''
+        ''' create the events that are inserted into the simulator engine to send the data bursts'''
 #        print "Preparing packet bursts in "+str(self.id)
-        # schedule numPacketsBurst packets at burstTimestamp
-        for i in xrange(self.settings.numPacketsBurst):
-            self.engine.scheduleIn(
-                delay        = self.settings.burstTimestamp,
-                cb           = self._app_action_enqueueData,
-                uniqueTag    = (self.id, '_app_action_enqueueData_burst1_{}'.format(i)),
-                priority     = 2,
-            )
-            self.engine.scheduleIn(
-                delay        = 3*self.settings.burstTimestamp,
-                cb           = self._app_action_enqueueData,
-                uniqueTag    = (self.id, '_app_action_enqueueData_burst2_{}'.format(i)),
-                priority     = 2,
-            )
+        # schedule the bursts of numPacketsBurst packets at burstTimestamp and 3*burstTimestamp
+        self.engine.scheduleIn(
+            delay        = self.settings.burstTimestamp,
+            cb           = self._app_action_enqueueBurst,
+            uniqueTag    = (self.id, '_app_action_enqueueBurst1'),
+            priority     = 2,
+        )
+        self.engine.scheduleIn(
+            delay        = 3*self.settings.burstTimestamp,
+            cb           = self._app_action_enqueueBurst,
+            uniqueTag    = (self.id, '_app_action_enqueueBurst2'),
+            priority     = 2,
+        )
+    
+    def _app_action_enqueueBurst(self):
+        ''' enqueue the numPacketsBurst data packets of a burst '''
+        for _ in xrange(self.settings.numPacketsBurst):
+            self._app_action_enqueueData()
             
     def _app_action_sendSinglePacket(self):
         ''' actual send data function. Evaluates queue length too '''
@@ -285,12 +334,14 @@ class Mote(object):
 
         # only start sending data if I have some TX cells
         # if self.getTxCells():
-        newPacket = {
-            'asn':            self.engine.getAsn(),
-            'type':           self.APP_TYPE_MYTRAFFIC,
-            'payload':        [self.id,self.engine.getAsn(),1], # the payload is used for latency and number of hops calculation
-            'retriesLeft':    self.TSCH_MAXTXRETRIES
-        }
+        newPacket = Packet.Packet(
+            type          = self.APP_TYPE_MYTRAFFIC,
+            srcId         = self.id,
+            genAsn        = self.engine.getAsn(), # for the latency
+            asn           = self.engine.getAsn(),
+            retriesLeft   = self.TSCH_MAXTXRETRIES,
+            hopLog        = [] if self.settings.hopTrace else None,
+        )
             
                         
                       
@@ -324,11 +375,15 @@ class Mote(object):
             asn    = self.engine.getAsn()
             ts     = asn%self.settings.slotframeLength
             
-            if not firstDIO:
-                
-                cycle = int(math.ceil(self.settings.dioPeriod/(self.settings.slotframeLength*self.settings.slotDuration)))
+            if self.settings.dioTrickle:
+                nextAsn = self._rpl_trickle_nextInterval(restart=firstDIO)
             else:
-                cycle = 1 
+                if not firstDIO:
+                    
+                    cycle = int(math.ceil(self.settings.dioPeriod/(self.settings.slotframeLength*self.settings.slotDuration)))
+                else:
+                    cycle = 1 
+                nextAsn = asn-ts+cycle*self.settings.slotframeLength
             
 
             if self.preferredParent != None:                
@@ -337,19 +392,72 @@ class Mote(object):
                     self._otf_schedule_housekeeping(firstOtf=True)
                     self.otfTriggered=True
                                                 
-            # schedule at start of next cycle
+            # schedule at start of a next cycle
             self.engine.scheduleAtAsn(
-                asn         = asn-ts+cycle*self.settings.slotframeLength,
+                asn         = nextAsn,
                 cb          = self._rpl_action_sendDIO,
                 uniqueTag   = (self.id,'_rpl_action_sendDIO'),
                 priority    = 3,
             )
     
+    def _rpl_trickle_nextInterval(self,restart=False):
+        '''
+        [dioTrickle] start the next Trickle interval (RFC 6206): double the
+        interval, up to DIO_INTERVAL_MAX, or restart at DIO_INTERVAL_MIN now.
+        
+        Returns the ASN of its DIO, at a random time in its second half. DIOs
+        are sent at the start of a cycle, as the periodic ones, so the time is
+        rounded up to the start of a next cycle.
+        '''
+        asn    = self.engine.getAsn()
+        if restart:
+            self.dioInterval      = self.DIO_INTERVAL_MIN
+            self.dioIntervalStart = asn
+        else:
+            self.dioIntervalStart = self.dioIntervalStart+self._rpl_trickle_msToSlots(self.dioInterval)
+            self.dioInterval      = min(2*self.dioInterval,self.DIO_INTERVAL_MAX)
+        self.dioCounter           = 0
+        
+        t      = self.rplRandom.uniform(self.dioInterval/2.0,self.dioInterval)
+        cycle  = int(math.ceil((self.dioIntervalStart+self._rpl_trickle_msToSlots(t))/float(self.settings.slotframeLength)))
+        self.dioNextAsn           = max(
+            cycle*self.settings.slotframeLength,
+            asn-asn%self.settings.slotframeLength+self.settings.slotframeLength,
+        )
+        return self.dioNextAsn
+    
+    def _rpl_trickle_msToSlots(self,ms):
+        return ms/1000.0/self.settings.slotDuration
+    
+    def _rpl_trickle_reset(self):
+        '''
+        [dioTrickle] restart the Trickle timer on an inconsistency, i.e. a
+        new preferred parent or DAGrank; nothing to do at DIO_INTERVAL_MIN.
+        '''
+        if self.dioInterval==self.DIO_INTERVAL_MIN:
+            return
+        oldNextAsn = self.dioNextAsn
+        nextAsn    = self._rpl_trickle_nextInterval(restart=True)
+        if nextAsn<oldNextAsn:
+            self.engine.removeEvent(uniqueTag=(self.id,'_rpl_action_sendDIO'))
+            self.engine.scheduleAtAsn(
+                asn         = nextAsn,
+                cb          = self._rpl_action_sendDIO,
+                uniqueTag   = (self.id,'_rpl_action_sendDIO'),
+                priority    = 3,
+            )
+        else:
+            # the DIO scheduled in this ASN is sooner
+            self.dioNextAsn = oldNextAsn
+    
     def _rpl_action_sendDIO(self):
         
         with self.dataLock:
          
-            if self.rank!=None and self.dagRank!=0 or self.dagRoot==True:
+            # [dioTrickle] suppressed after enough consistent DIOs in this interval
+            suppressed = self.settings.dioTrickle and self.dioCounter>=self.DEFAULT_DIO_REDUNDANCY_CONSTANT
+            
+            if (self.rank!=None and self.dagRank!=0 or self.dagRoot==True) and not suppressed:
 
                 # update mote stats
                 self._stats_incrementMoteStats('rplTxDIO')
@@ -370,6 +478,8 @@ class Mote(object):
                         continue
                        
                     # in neighbor, update my rank/DAGrank
+                    if neighbor.neighborRank.get(self)!=self.rank:
+                        neighbor.rplDirty             = True
                     neighbor.neighborDagRank[self]    = self.dagRank
                     neighbor.neighborRank[self]       = self.rank
                     
@@ -381,10 +491,20 @@ class Mote(object):
                     # update my mote stats
                     self._stats_incrementMoteStats('rplRxDIO') # TODO: TX DIO?
                     
+                    (oldPreferredParent,oldDagRank) = (neighbor.preferredParent,neighbor.dagRank)
+                    
                     # skip useless housekeeping
                     if not neighbor.rank or self.rank<neighbor.rank:
                         # in neighbor, do RPL housekeeping
-                        neighbor._rpl_housekeeping()                        
+                        if self.settings.rplIncremental:
+                            neighbor._rpl_incremental_housekeeping(self)
+                        else:
+                            neighbor._rpl_housekeeping()
+                    
+                    # [dioTrickle] in neighbor, count a consistent DIO, i.e. one which did not change its parent or DAGrank
+                    if self.settings.dioTrickle and (neighbor.preferredParent,neighbor.dagRank)==(oldPreferredParent,oldDagRank):
+                        if self.engine.getAsn()>=neighbor.dioIntervalStart:
+                            neighbor.dioCounter      += 1
                     
                     # update time correction
                    
@@ -397,9 +517,69 @@ class Mote(object):
             # schedule to send the next DIO
             self._rpl_schedule_sendDIO()
     
+    def _rpl_incremental_housekeeping(self,dioSender):
+        '''
+        [rplIncremental] run _rpl_housekeeping on the DIO of dioSender, only
+        if its inputs changed. The first run in an ASN is immediate, as are
+        the runs while I have no parent, so the DODAG forms within the ASN of
+        the DIOs; the DIOs changing them again in that ASN are handled by a
+        single run in the next ASN, with the priority of DIOs, i.e. after the
+        cells of that ASN, as it can remove cells.
+        '''
+        if not self.rplDirty:
+            return
+        if self.preferredParent==None or self.rplHousekeepingAsn!=self.engine.getAsn():
+            self.rplHousekeepingAsn     = self.engine.getAsn()
+            self._rpl_housekeeping()
+        elif self.rplHousekeepingPending:
+            self.rplDioSenders.add(dioSender)
+        else:
+            self.rplHousekeepingPending = True
+            self.rplDioSenders          = set([dioSender])
+            self.engine.scheduleAtAsn(
+                asn         = self.engine.getAsn()+1,
+                cb          = self._rpl_action_housekeeping,
+                uniqueTag   = (self.id,'_rpl_action_housekeeping'),
+                priority    = 3,
+            )
+    
+    def _rpl_action_housekeeping(self):
+        with self.dataLock:
+            self.rplHousekeepingPending = False
+            if self.rplDirty:
+                self.rplHousekeepingAsn = self.engine.getAsn()
+                oldPreferredParent = self.preferredParent
+                self._rpl_housekeeping()
+                
+                # time correction on the DIO of a new parent, as in _rpl_action_sendDIO
+                if self.preferredParent!=oldPreferredParent and self.preferredParent in self.rplDioSenders:
+                    self.timeCorrectedSlot = self.engine.getAsn()-1
+            self.rplDioSenders = set()
+    
+    def _rpl_parentChanged(self,oldPreferredParent):
+        '''
+        [rplIncremental] update the DODAG index. The loop check of the old
+        and new ancestors of this mote may now give another result.
+        '''
+        if oldPreferredParent:
+            ancestors = set([oldPreferredParent])|self.engine.getRplAncestors(oldPreferredParent)
+        else:
+            ancestors = set()
+        self.engine.rplParentChanged(self,oldPreferredParent)
+        ancestors    |= self.engine.getRplAncestors(self)
+        for mote in ancestors:
+            mote.rplDirty = True
+    
+    def _rpl_rankIncreaseChanged(self,neighbor):
+        ''' [rplIncremental] mark dirty if the ETX to neighbor changes its rank increase '''
+        if neighbor in self.rplRankIncreases and self._rpl_calcRankIncrease(neighbor)!=self.rplRankIncreases[neighbor]:
+            self.rplDirty = True
+    
     def _rpl_housekeeping(self):
         with self.dataLock:
             
+            self.rplDirty = False
+            
             #===
             # refresh the following parameters:
             # - self.preferredParent
@@ -413,23 +593,29 @@ class Mote(object):
             for (neighbor,neighborRank) in self.neighborRank.items():
                 # calculate the rank increase to that neighbor
                 rankIncrease = self._rpl_calcRankIncrease(neighbor)
+                if self.settings.rplIncremental:
+                    self.rplRankIncreases[neighbor] = rankIncrease
 
                 if rankIncrease!=None and rankIncrease<=min([self.RPL_MAX_RANK_INCREASE, self.RPL_MAX_TOTAL_RANK-neighborRank]): 
 
                     #check if there is a loop and if exists, skip the neighbor         
-                    rootReached=False
-                    skipNeighbor=False
-                    inode=neighbor
-                    while rootReached==False:
-                        if inode.preferredParent!=None:
-                            if inode.preferredParent.id==self.id:
-                                skipNeighbor=True
-                            if inode.preferredParent.id==0:
-                                rootReached=True
+                    if self.settings.rplIncremental:
+                        # I am on its path to the root
+                        skipNeighbor=self in self.engine.getRplAncestors(neighbor)
+                    else:
+                        rootReached=False
+                        skipNeighbor=False
+                        inode=neighbor
+                        while rootReached==False:
+                            if inode.preferredParent!=None:
+                                if inode.preferredParent.id==self.id:
+                                    skipNeighbor=True
+                                if inode.preferredParent.id==0:
+                                    rootReached=True
+                                else:
+                                    inode=inode.preferredParent
                             else:
-                                inode=inode.preferredParent
-                        else:
-                            rootReached=True
+                                rootReached=True
                     if skipNeighbor==True:
                         continue
   
@@ -492,10 +678,21 @@ class Mote(object):
                     )
 
                 # store new preferred parent and rank
+                oldPreferredParent = self.preferredParent
                 (self.preferredParent,self.rank) = (newPreferredParent,newrank)
+                if self.preferredParent!=oldPreferredParent:
+                    if self.settings.rplIncremental:
+                        self._rpl_parentChanged(oldPreferredParent)
+                    else:
+                        self.engine.rplParentChanged(self,oldPreferredParent)
                 
                 # calculate DAGrank
+                oldDagRank   = self.dagRank
                 self.dagRank = int(self.rank/self.RPL_MIN_HOP_RANK_INCREASE)
+                
+                # [dioTrickle] advertise a new parent or DAGrank quickly
+                if self.settings.dioTrickle and (self.preferredParent!=oldPreferredParent or self.dagRank!=oldDagRank):
+                    self._rpl_trickle_reset()
 
                 # pick my parent set
                 self.parentSet = [n for (n,_) in sorted_potentialRanks if self.neighborRank[n]<self.rank][:int(self.settings.parents)]
@@ -551,9 +748,9 @@ class Mote(object):
     def _otf_schedule_housekeeping(self,firstOtf=False):
         
         if firstOtf:
-            delay= (self.otfHousekeepingPeriod*(0.5+random.random()))
+            delay= (self.otfHousekeepingPeriod*(0.5+self.housekeepingRandom.random()))
         else:
-            delay=self.otfHousekeepingPeriod*(0.9+0.2*random.random())
+            delay=self.otfHousekeepingPeriod*(0.9+0.2*self.housekeepingRandom.random())
                   
         
         
@@ -854,7 +1051,7 @@ class Mote(object):
     def _sixtop_schedule_housekeeping(self):
         
         self.engine.scheduleIn(
-            delay       = self.sixtopHousekeepingPeriod*(0.9+0.2*random.random()),
+            delay       = self.sixtopHousekeepingPeriod*(0.9+0.2*self.housekeepingRandom.random()),
             cb          = self._sixtop_action_housekeeping,
             uniqueTag   = (self.id,'_sixtop_action_housekeeping'),
             priority    = 5,
@@ -1195,14 +1392,14 @@ class Mote(object):
 
             selectedCells={}
             if len(availableCells) > 0:
-                random.shuffle(availableCells)
+                self.sixtopRandom.shuffle(availableCells)
 
                
                 #if they request more cells than I have, I try to give them the maxium available
                 while len(availableCells) < numCells:
                     numCells=numCells-1 
                 
-                ranChosen=random.sample(range(0, len(availableCells)), numCells)
+                ranChosen=self.sixtopRandom.sample(range(0, len(availableCells)), numCells)
                 
                 #these are my selected cells
                 for i in range(numCells):
@@ -1267,13 +1464,13 @@ class Mote(object):
 
             selectedCells={}
             if len(availableCells) > 0:
-                random.shuffle(availableCells)
+                self.sixtopRandom.shuffle(availableCells)
                                
                 #if they request more cells than I have, I try to give them the maxium available
                 while len(availableCells) < numCells:
                     numCells=numCells-1 
                 
-                ranChosen=random.sample(range(0, len(availableCells)), numCells)
+                ranChosen=self.sixtopRandom.sample(range(0, len(availableCells)), numCells)
                 
                 #these are my selected cells
                 for i in range(numCells):
@@ -1356,13 +1553,13 @@ class Mote(object):
             #if I have cells, I try to assign them
             selectedCells={}
             if len(availableCells) > 0:
-                random.shuffle(availableCells)
+                self.sixtopRandom.shuffle(availableCells)
                                
                 #if they request more cells than I have, I try to give them the maxium available
                 while len(availableCells) < numCells:
                     numCells=numCells-1 
                 
-                ranChosen=random.sample(range(0, len(availableCells)), numCells)
+                ranChosen=self.sixtopRandom.sample(range(0, len(availableCells)), numCells)
                 
                 #these are my selected cells
                 for i in range(numCells):
@@ -1452,14 +1649,14 @@ class Mote(object):
             #if I have cells, I try to assign them
             selectedCells={}
             if len(availableCells) > 0:
-                random.shuffle(availableCells)
+                self.sixtopRandom.shuffle(availableCells)
                 
                
                 #if they request more cells than I have, I try to give them the maxium available
                 while len(availableCells) < numCells:
                     numCells=numCells-1 
                 
-                ranChosen=random.sample(range(0, len(availableCells)), numCells)
+                ranChosen=self.sixtopRandom.sample(range(0, len(availableCells)), numCells)
                 
                 #these are my selected cells
                 for i in range(numCells):
@@ -1538,7 +1735,7 @@ class Mote(object):
                 scheduleList     += [(ts,ch,cell['numTxAck'],cell['numTx'],cellPDR)]
 
         # introduce randomness in the cell list order
-        random.shuffle(scheduleList)
+        self.sixtopRandom.shuffle(scheduleList)
                
         if not self.settings.sixtopNoRemoveWorstCell:
             # triggered only when worst cell selection is due
@@ -1591,8 +1788,8 @@ class Mote(object):
 
         #    return False
         
-        elif len(self.txQueue)==self.settings.buffer:
-            # my TX queue is full
+        elif len(self.txQueue)>=self.settings.buffer:
+            # my TX queue is full (or over a buffer lowered by runSimBranches)
             # update mote stats
             self._stats_incrementMoteStats('droppedQueueFull')
 
@@ -1601,10 +1798,18 @@ class Mote(object):
         else:
             # all is good           
             # enqueue packet
-            self.txQueue    += [packet]
+            self.txQueue.append(packet)
+            self._tsch_traceHead(self.engine.getAsn())
 
             return True
     
+    def _tsch_traceHead(self,asn):
+        ''' with --hopTrace, the packet at the head of the TX queue is there since asn, unless already '''
+        if self.settings.hopTrace and self.txQueue:
+            packet = self.txQueue[0]
+            if packet.headAsn==None:
+                packet.headAsn = asn
+    
     def _tsch_schedule_activeCell(self):
         
         asn        = self.engine.getAsn()
@@ -1735,15 +1940,26 @@ class Mote(object):
                             if bool(self.pktToSend) == True:
                                 if len(self.pktToSend) >= (numberPacketSentInThisTs+1):                                      
                                         cell['numTx'] += 1
+                                        self.txStatsPerNeighbor[cell['neighbor']][0] += 1
+                                        if self.settings.rplIncremental:
+                                            self._rpl_rankIncreaseChanged(cell['neighbor'])
                                         self.numTransmissions += 1
                                         self.schedule[(ts,i_ch)]['waitingfor']=self.DIR_TX                                     
                                         
+                                        # hop trace
+                                        packet = self.pktToSend[numberPacketSentInThisTs]
+                                        if packet.hopLog!=None and packet.firstTxAsn==None:
+                                            packet.firstTxAsn = asn
+                                            if packet.headAsn==None:
+                                                # sent behind another packet in this slot
+                                                packet.headAsn = asn
+                                        
                                         self.propagation.startTx(
                                             channel   = cell['ch'],
-                                            type      = self.pktToSend[numberPacketSentInThisTs]['type'],
+                                            type      = self.pktToSend[numberPacketSentInThisTs].type,
                                             smac      = self,
                                             dmac      = cell['neighbor'],
-                                            payload   = self.pktToSend[numberPacketSentInThisTs]['payload'],
+                                            payload   = self.pktToSend[numberPacketSentInThisTs],
                                         )
                     
                                         # indicate that we're waiting for the TX operation to finish
@@ -1762,6 +1978,13 @@ class Mote(object):
                 
                 assert cell
                 
+                if (cell[0],cell[1]) in self.schedule:
+                    self._tsch_discountTxStats(self.schedule[(cell[0],cell[1])])
+                if cell[2]==self.DIR_TX:
+                    self.rplDirty = True
+                    if neighbor not in self.txStatsPerNeighbor:
+                        self.txStatsPerNeighbor[neighbor] = [0,0]
+                
                 self.schedule[(cell[0],cell[1])] = {
                     'ts':                        cell[0],
                     'ch':                        cell[1],
@@ -1791,6 +2014,14 @@ class Mote(object):
             self._tsch_schedule_activeCell()
             
             
+    def _tsch_discountTxStats(self,cell):
+        ''' take the counters of a cell leaving the schedule out of txStatsPerNeighbor '''
+        if cell['dir']==self.DIR_TX:
+            self.rplDirty = True
+            txStats     = self.txStatsPerNeighbor[cell['neighbor']]
+            txStats[0] -= cell['numTx']
+            txStats[1] -= cell['numTxAck']
+    
     def _tsch_removeCells2(self,neighbor,tsList):
         ''' removes cell(s) from the schedule '''
        
@@ -1806,6 +2037,7 @@ class Mote(object):
 
                 assert (ts,ch) in self.schedule.keys()
                 assert self.schedule[(ts,ch)]['dir']!=self.DIR_SHARED
+                self._tsch_discountTxStats(self.schedule[(ts,ch)])
                 del self.schedule[(ts,ch)]
                 
             self._tsch_schedule_activeCell()
@@ -1835,20 +2067,23 @@ class Mote(object):
 
                             # update schedule stats
                             self.schedule[(ts,i_ch)]['numTxAck'] += 1
+                            self.txStatsPerNeighbor[self.schedule[(ts,i_ch)]['neighbor']][1] += 1
+                            if self.settings.rplIncremental:
+                                self._rpl_rankIncreaseChanged(self.schedule[(ts,i_ch)]['neighbor'])
                             
                             # update history
                             self.schedule[(ts,i_ch)]['history'] += [1]
                             
                             # update queue stats
-                            self._stats_logQueueDelay(asn-self.pktToSend[0]['asn'])
+                            self._stats_logQueueDelay(asn-self.pktToSend[0].asn)
                             
                             # time correction
                             if self.schedule[(ts,i_ch)]['neighbor'] == self.preferredParent:
                                 self.timeCorrectedSlot = asn
                             
                             # remove packet from queue
-                            self.txQueue.remove(self.pktToSend[0])
-                            self.pktToSend.remove(self.pktToSend[0])
+                            self.txQueue.remove(self.pktToSend.pop(0))
+                            self._tsch_traceHead(asn)
                             
 
                         elif isNACKed:  #when fails in enqueue packet
@@ -1856,6 +2091,9 @@ class Mote(object):
                             # NACK received
                             # update schedule stats as if it were successfully transmitted
                             self.schedule[(ts,i_ch)]['numTxAck'] += 1
+                            self.txStatsPerNeighbor[self.schedule[(ts,i_ch)]['neighbor']][1] += 1
+                            if self.settings.rplIncremental:
+                                self._rpl_rankIncreaseChanged(self.schedule[(ts,i_ch)]['neighbor'])
 
                             # update history
                             self.schedule[(ts,i_ch)]['history'] += [1]
@@ -1867,8 +2105,8 @@ class Mote(object):
                             #remove this part because it is considered that a packet received is a good MAC tx even if the queue in the rx node is full
                             
                             # remove packet from queue
-                            self.txQueue.remove(self.pktToSend[0])
-                            self.pktToSend.remove(self.pktToSend[0])
+                            self.txQueue.remove(self.pktToSend.pop(0))
+                            self._tsch_traceHead(asn)
                             
                         else:
                             # neither ACK nor NACK received
@@ -1876,19 +2114,19 @@ class Mote(object):
                             self.schedule[(ts,i_ch)]['history'] += [0]
 
                             # decrement 'retriesLeft' counter associated with that packet
-                            i = self.txQueue.index(self.pktToSend[0])
-                            if self.txQueue[i]['retriesLeft'] > 0:
-                                self.txQueue[i]['retriesLeft'] -= 1
+                            packet = self.pktToSend[0]
+                            if packet.retriesLeft > 0:
+                                packet.retriesLeft -= 1
                             
                             
                             #debug problem with MAC drops                                  
                             # drop packet if retried too many time
-                            if self.txQueue[i]['retriesLeft'] == 0:
+                            if packet.retriesLeft == 0:
                                 self._stats_incrementMoteStats('droppedMacRetries')
                                                                 
                                 # remove packet from queue
-                                self.txQueue.remove(self.pktToSend[0])
-                                self.pktToSend.remove(self.pktToSend[0])
+                                self.txQueue.remove(self.pktToSend.pop(0))
+                                self._tsch_traceHead(asn)
 
                         self.schedule[(ts,i_ch)]['waitingfor']=None
                         return
@@ -1964,10 +2202,14 @@ class Mote(object):
                                         self.probeNumPacketReceived=self.probeNumPacketReceived+1
                                     
                                     # calculate end-to-end latency
-                                    self._stats_logLatencyStat(asn-payload[1])
+                                    self._stats_logLatencyStat(asn-payload.genAsn)
                                     
                                     # log the number of hops
-                                    self._stats_logHopsStat(payload[2])
+                                    self._stats_logHopsStat(payload.hops)
+                                    
+                                    # log the hops
+                                    if self.engine.hopTrace:
+                                        self.engine.hopTrace.record(payload,asn,payload.getHopLog(asn,self.TSCH_MAXTXRETRIES))
                                     
                                     (isACKed, isNACKed) = (True, False)
    
@@ -1978,17 +2220,8 @@ class Mote(object):
                                     # count incoming traffic for each node
                                     self._otf_incrementIncomingTraffic(smac)
                                     
-                                    # update the number of hops
-                                    newPayload     = copy.deepcopy(payload)
-                                    newPayload[2] += 1
-                                    
-                                    # create packet
-                                    relayPacket = {
-                                        'asn':         asn,
-                                        'type':        type,
-                                        'payload':     newPayload,
-                                        'retriesLeft': self.TSCH_MAXTXRETRIES
-                                    }
+                                    # create packet, one hop further
+                                    relayPacket = payload.relay(asn,self.TSCH_MAXTXRETRIES)
                                     
                                     # enqueue packet in TSCH queue
                                     isEnqueued = self._tsch_enqueue(relayPacket)
@@ -2006,7 +2239,7 @@ class Mote(object):
 
                                         self._stats_incrementMoteStats('droppedAppFailedEnqueue')
                                         (isACKed, isNACKed) = (False, True)
-                                        #if relayPacket['payload'][0]==24:
+                                        #if relayPacket.srcId==24:
                                             #print "Sending NACK"
                                         self.schedule[(ts,i_ch)]['waitingfor']=None
                                         return isACKed, isNACKed
@@ -2067,10 +2300,10 @@ class Mote(object):
             numTx                 = self.NUM_SUFFICIENT_TX
             numTxAck              = math.floor(pdr*numTx)
             
-            for (_,cell) in self.schedule.items():
-                if (cell['neighbor'] == neighbor) and (cell['dir'] == self.DIR_TX):  #ok shared cell broadcast is not taken in account
-                    numTx        += cell['numTx']
-                    numTxAck     += cell['numTxAck']
+            # add the counters of the TX cells to that neighbor (shared broadcast cells are not taken into account)
+            if neighbor in self.txStatsPerNeighbor:
+                numTx            += self.txStatsPerNeighbor[neighbor][0]
+                numTxAck         += self.txStatsPerNeighbor[neighbor][1]
             
             # abort if about to divide by 0
             if not numTxAck:
@@ -2094,44 +2327,34 @@ class Mote(object):
     #===== clock
     
     def clock_getOffsetToDagRoot(self):
-        ''' calculate time offset compared to the DAGroot '''
+        '''
+        calculate time offset compared to the DAGroot
+        
+        It is the offset to my parent plus the offset of my parent, which is
+        computed once per ASN and shared by all its descendants.
+        '''
         
         asn                  = self.engine.getAsn()
-        offset               = 0.0
-        child                = self
-        parent               = self.preferredParent
-            
-        while True:
-            secSinceSync     = (asn-child.timeCorrectedSlot)*self.settings.slotDuration  # sec
+        
+        if self.clockOffsetAsn!=asn:
+            parent           = self.preferredParent
+            secSinceSync     = (asn-self.timeCorrectedSlot)*self.settings.slotDuration  # sec
             # FIXME: for ppm, should we not /10^6?
-            relDrift         = child.drift - parent.drift                                # ppm
-            offset          += relDrift * secSinceSync                                     # us
-
-            if parent.dagRoot:
-                break
-            else:
-                child        = parent
-                parent       = child.preferredParent
-
-        return offset
+            relDrift         = self.drift - parent.drift                                  # ppm
+            offset           = relDrift * secSinceSync                                    # us
+            if not parent.dagRoot:
+                offset      += parent.clock_getOffsetToDagRoot()
+            self.clockOffset    = offset
+            self.clockOffsetAsn = asn
+        
+        return self.clockOffset
         
     #emunicio  
      
     def recalculateNumHopsToRoot(self):
-        ''' calculate time offset compared to the DAGroot '''
-        child                = self
-        parent               = self.preferredParent
-        i=0
-        while True:
-            i=i+1
-            if i>30:
-                assert False # more than hops 30 is not allowed
-            if parent.dagRoot:
-                break
-            else:
-                child        = parent
-                parent       = child.preferredParent
-             
+        ''' calculate the number of hops to the DAGroot, from the DODAG index of the engine '''
+        i=len(self.engine.getRplAncestors(self))
+        assert i<=30 # more than hops 30 is not allowed
         return i
     #===== location
     
@@ -2151,7 +2374,9 @@ class Mote(object):
         
         # app
         if not self.dagRoot:
-            if self.settings.numPacketsBurst!=None and self.settings.burstTimestamp!=None:
+            if self.engine.trafficSource:
+                self.engine.trafficSource.addMote(self)
+            elif self.settings.numPacketsBurst!=None and self.settings.burstTimestamp!=None:
                 self._app_schedule_sendPacketBurst()
             else:
                 self._app_schedule_sendSinglePacket(firstPacket=True)
@@ -2180,25 +2405,12 @@ class Mote(object):
     
     def getChildrens(self,node):
         with self.dataLock:
-            children=[]                                           
-            for mote in self.engine.motes:
-                if mote.preferredParent == node:
-                    children.append(mote)  
-            return children   
+            return self.engine.getRplChildren(node)
     
     #not used when OTF is present
     def getMyMaxCellDemand(self):
         with self.dataLock:
-            alcanzables=[]
-
-            alcanzables=self.getChildrens(self) 
-            cellTh=len(alcanzables)+1  #+1 because I have to bear in mind my own traffic
-            while len(alcanzables)!=0:
-                hijo=alcanzables[0]
-                alcanzables.remove(hijo)
-                for hijodehijo in self.getChildrens(hijo):
-                    cellTh+=1
-                    alcanzables.append(hijodehijo)    
+            cellTh=self.engine.getRplNumDescendants(self)+1  #+1 because I have to bear in mind my own traffic
             cellTh=int((((1-self.getPDR(self.preferredParent))+1)*cellTh)+1)     
             return cellTh
     
@@ -2228,6 +2440,8 @@ class Mote(object):
             returnVal['numRxCells']         = len(self.getRxCells())
             returnVal['aveQueueDelay']      = self._stats_getAveQueueDelay()
             returnVal['aveLatency']         = self._stats_getAveLatency()
+            returnVal['queueDelayHistogram']= self.queuestats['delay']    # merged, not a column, see SimStats
+            returnVal['latencyHistogram']   = self.latencyHistogram
             returnVal['aveHopsPackets']     = self.hopsToRoot
             returnVal['aveHops']            = self._stats_getAveHops()
             returnVal['probableCollisions'] = self._stats_getRadioStats('probableCollisions')            
@@ -2312,32 +2526,30 @@ class Mote(object):
     
     def _stats_logQueueDelay(self,delay):
         with self.dataLock:
-            self.queuestats['delay'] += [delay]
+            self.queuestats['delay'].add(delay)
     
     def _stats_getAveQueueDelay(self):
-        d = self.queuestats['delay']
-        return float(sum(d))/len(d) if len(d)>0 else 0
+        return self.queuestats['delay'].getMean()
     
     def _stats_resetQueueStats(self):
         with self.dataLock:
             self.queuestats = {
-                'delay':               [],
+                'delay':               Histogram.Histogram(),
             }
     
     # latency stats
     
     def _stats_logLatencyStat(self,latency):
         with self.dataLock:
-            self.packetLatencies += [latency]
+            self.latencyHistogram.add(latency)
     
     def _stats_getAveLatency(self):
         with self.dataLock:
-            d = self.packetLatencies
-            return float(sum(d))/float(len(d)) if len(d)>0 else 0
+            return self.latencyHistogram.getMean()
     
     def _stats_resetLatencyStats(self):
         with self.dataLock:
-            self.packetLatencies = []
+            self.latencyHistogram = Histogram.Histogram()
     
     # hops stats
     
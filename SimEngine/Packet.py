@@ -0,0 +1,119 @@
+#!/usr/bin/python
+'''
+\brief Data packets and the TSCH transmit queue.
+
+A Packet carries its origin (type, source mote id, generation ASN), which is
+fixed at creation, and per-hop fields (enqueue ASN, hop count, retries left).
+Relaying creates a new Packet sharing the origin, one hop further. With
+--hopTrace, it also carries the log of the hops it went over (see HopTrace).
+
+A TxQueue is a FIFO of packets which also removes any queued packet in O(1):
+a removed packet is only marked as such, and dropped from the underlying deque
+once it reaches the head.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('Packet')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import collections
+
+#============================ body ============================================
+
+class Packet(object):
+
+    __slots__ = ['_type','_srcId','_genAsn','asn','hops','retriesLeft','queued','headAsn','firstTxAsn','hopLog']
+
+    def __init__(self,type,srcId,genAsn,asn,retriesLeft,hops=1,hopLog=None):
+
+        # origin, read-only
+        self._type           = type
+        self._srcId          = srcId
+        self._genAsn         = genAsn
+
+        # this hop
+        self.asn             = asn    # when enqueued, for the queue delay
+        self.hops            = hops
+        self.retriesLeft     = retriesLeft
+        self.queued          = False  # in a TxQueue
+
+        # hop trace, None when not traced
+        self.headAsn         = None   # when at the head of the TxQueue
+        self.firstTxAsn      = None   # when first transmitted
+        self.hopLog          = hopLog # previous hops, HopTrace.HOP_LEN fields each
+
+    type   = property(lambda self: self._type)
+    srcId  = property(lambda self: self._srcId)
+    genAsn = property(lambda self: self._genAsn)
+
+    def relay(self,asn,retriesLeft):
+        ''' copy of this packet for the next hop, enqueued at asn '''
+        return Packet(self._type,self._srcId,self._genAsn,asn,retriesLeft,self.hops+1,self.getHopLog(asn,retriesLeft))
+
+    def getHopLog(self,asn,maxRetries):
+        ''' the hop log with this hop, received at asn, None when not traced '''
+        if self.hopLog==None:
+            return None
+        return self.hopLog+[self.asn,self.headAsn,self.firstTxAsn,asn,maxRetries-self.retriesLeft]
+
+    def __repr__(self):
+        return 'Packet({0},src={1},genAsn={2},asn={3},hops={4},retriesLeft={5})'.format(
+            self._type,
+            self._srcId,
+            self._genAsn,
+            self.asn,
+            self.hops,
+            self.retriesLeft,
+        )
+
+class TxQueue(object):
+
+    def __init__(self):
+        self.packets         = collections.deque() # queued and removed packets, in order
+        self.length          = 0                   # queued packets
+
+    def __len__(self):
+        return self.length
+
+    def __nonzero__(self):
+        return self.length>0
+
+    def __iter__(self):
+        for packet in self.packets:
+            if packet.queued:
+                yield packet
+
+    def __getitem__(self,i):
+        ''' the i-th queued packet, O(i) '''
+        if i<0:
+            i += self.length
+        if 0<=i<self.length:
+            for packet in self.packets:
+                if packet.queued:
+                    if i==0:
+                        return packet
+                    i -= 1
+        raise IndexError('TxQueue index out of range')
+
+    def append(self,packet):
+        assert not packet.queued
+        packet.queued        = True
+        self.packets.append(packet)
+        self.length         += 1
+
+    def remove(self,packet):
+        ''' remove a queued packet, amortized O(1) '''
+        if not packet.queued:
+            raise ValueError('{0} not in TxQueue'.format(packet))
+        packet.queued        = False
+        self.length         -= 1
+        while self.packets and not self.packets[0].queued:
+            self.packets.popleft()
@@ -21,7 +21,6 @@ log.addHandler(NullHandler())
 #============================ imports =========================================
 
 import threading
-import random
 import math
 #emunicio
 import operator
@@ -155,7 +154,7 @@ class Propagation(object):
                                                                                                  
                                 
                                 # pick a random number
-                                failure = random.random() 
+                                failure = self.receivers[i]['mote'].channelRandom.random() 
 
                                 if pdr>=failure:
         
@@ -223,7 +222,7 @@ class Propagation(object):
                                         pdr   = self._computePdrFromSINR(sinr, transmission['dmac'])
 
                                         # pick a random number
-                                        failure = random.random() 
+                                        failure = transmission['dmac'].channelRandom.random() 
 
                                         if pdr>=failure:
                                            
@@ -264,7 +263,7 @@ class Propagation(object):
                                         pseudo_pdr   = self._computePdrFromSINR(pseudo_sinr, transmission['dmac'])
                                         
                                         # pick a random number
-                                        failure = random.random()
+                                        failure = transmission['dmac'].channelRandom.random()
                                         if pseudo_pdr>=failure:
                                             # success to receive the interference and realize collision
                                             
@@ -314,7 +313,7 @@ class Propagation(object):
                         pseudo_pdr   = self._computePdrFromSINR(pseudo_sinr,r['mote'])
                         
                         # pick a random number
-                        failure = random.random()
+                        failure = r['mote'].channelRandom.random()
 
                         if pseudo_pdr>=failure:
                             for cell in lockOn.schedule.keys():
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+'''
+\brief Independent, reproducible random number streams.
+
+Each (subsystem, mote) pair draws from its own random.Random, seeded from a
+hash of the master seed, the CPU id, the run number, the variant (parameter
+combination), the subsystem and the mote id. Draws in one subsystem thus
+never shift the draws of another, and a run is reproduced from its master
+seed (recorded in the .dat header).
+
+In a paired sweep, the PAIRED_SUBSYSTEMS streams leave the variant out: run
+N of every variant has the same topology, traffic arrivals and channel
+draws (common random numbers), so variants are compared run by run.
+
+Subsystems in use:
+- 'topology'     mote positions and RSSI of its links, per placed mote
+- 'drift'        clock drift, per mote
+- 'app'          packet generation jitter, per mote (its seed also seeds the
+                 NumPy draws of TrafficSource)
+- 'housekeeping' OTF and 6top housekeeping jitter, per mote
+- 'sixtop'       cell selection, per mote
+- 'channel'      reception failure draws, per receiving mote
+- 'rpl'          Trickle DIO times (--dioTrickle), per mote
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('RandomStreams')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import json
+import random
+import hashlib
+
+#============================ defines =========================================
+
+MAX_SEED          = 2**31-1
+
+# streams shared by all variants of a paired sweep
+PAIRED_SUBSYSTEMS = ['topology','drift','app','channel']
+
+#============================ helpers =========================================
+
+def newMasterSeed():
+    ''' a fresh master seed, for runs which were not given one '''
+    return random.SystemRandom().randint(0,MAX_SEED)
+
+#============================ body ============================================
+
+class RandomStreams(object):
+
+    def __init__(self,masterSeed,runNum,cpuID=None,variant=None,paired=False):
+
+        # store params
+        self.masterSeed      = masterSeed
+        self.runNum          = runNum
+        self.cpuID           = cpuID
+        self.variant         = variant
+        self.paired          = paired
+
+        # local variables
+        self.streams         = {}    # indexed by (subsystem,moteId)
+
+    #======================== public ==========================================
+
+    def get(self,subsystem,moteId=None):
+        ''' the random.Random of subsystem (of mote moteId) '''
+        key = (subsystem,moteId)
+        if key not in self.streams:
+            self.streams[key] = random.Random(self.getSeed(subsystem,moteId))
+        return self.streams[key]
+
+    def getSeed(self,subsystem,moteId=None):
+        if self.paired and subsystem in PAIRED_SUBSYSTEMS:
+            variant = None
+        else:
+            variant = self.variant
+        return int(hashlib.sha1(json.dumps([self.masterSeed,self.cpuID,self.runNum,variant,subsystem,moteId])).hexdigest()[:16],16)
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+'''
+\brief Registry of finished simulation runs, used to resume interrupted batches.
+
+Each finished run leaves an entry under <simDataDir>/.registry, named after a
+hash of its normalized settings, its master seed and its run number. A batch
+runner restarted with the same parameters skips the runs whose entry (and
+output) already exists.
+
+The master seed of the batches run without --seed is kept in the registry too,
+so that a restarted batch draws the same runs again.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('RunRegistry')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import os
+import time
+import json
+import hashlib
+
+import SimStats
+import SimSettings
+
+#============================ defines =========================================
+
+REGISTRY_DIR     = '.registry' # under simDataDir
+MASTER_SEED_FILE = 'masterSeed'
+
+# settings which do not change what a run computes
+IGNORED_SETTINGS = [
+    'gui',
+    'seed',                        # part of the run key, see getRunKey()
+    'noResume',
+    'numRuns',
+    'simDataDir',
+    'startTime',
+    'combinationKeys',
+    'binaryStats',
+    'checkpointAt',
+    'restoreFrom',
+    'dispatchProfile',
+    'profile',
+    'hopTrace',
+]
+
+#============================ body ============================================
+
+class RunRegistry(object):
+
+    def __init__(self,simDataDir):
+
+        # store params
+        self.dirname         = os.path.join(simDataDir,REGISTRY_DIR)
+
+    #======================== public ==========================================
+
+    def getMasterSeed(self,newSeed):
+        '''
+        master seed of the runs in simDataDir: the one recorded by an earlier
+        invocation, or newSeed, recorded for the next ones.
+        '''
+        self._makeDir()
+        filename = os.path.join(self.dirname,MASTER_SEED_FILE)
+        if not os.path.exists(filename):
+            # link fails if another worker recorded its seed first
+            tempname = '{0}.{1}.tmp'.format(filename,os.getpid())
+            with open(tempname,'w') as f:
+                f.write('{0}\n'.format(newSeed))
+            try:
+                os.link(tempname,filename)
+            except OSError:
+                pass
+            os.remove(tempname)
+        with open(filename,'r') as f:
+            return int(f.read())
+
+    def getRunKey(self,settings,runNum):
+        '''
+        hash identifying a run: its settings, normalized so that the same
+        parameters given as e.g. 100, 100.0 or '100' give the same key, and
+        the (masterSeed,runNum) its random streams are drawn from.
+        '''
+        normalized = dict([
+            (k,self._normalize(v)) for (k,v) in settings.items()
+            if k not in IGNORED_SETTINGS and not k.startswith('_')
+        ])
+        return hashlib.sha1(json.dumps([normalized,[settings['seed'],runNum]],sort_keys=True)).hexdigest()
+
+    def get(self,key,settings=None):
+        '''
+        registry entry of a finished run, or None if the run is not finished
+        or its output has disappeared since.
+        
+        With the settings of the run about to be skipped, the run is also not
+        finished when one of the SimSettings.RUN_FILES its settings ask for
+        (e.g. the .pstats of --profile) is missing, as they are not part of
+        its key.
+        '''
+        try:
+            with open(self._entryFile(key),'r') as f:
+                entry = json.load(f)
+        except (IOError,ValueError):
+            return None
+        for outputFile in entry['outputs'].keys()+entry.get('columns',{}).keys():
+            if not os.path.exists(outputFile):
+                return None
+        for setting in SimSettings.RUN_FILES:
+            if settings and settings.get(setting):
+                for outputFile in entry['outputs']:
+                    if not os.path.exists(SimSettings.getRunFile(outputFile,setting,entry.get('runNum'))):
+                        return None
+        return entry
+
+    def isDone(self,key,settings=None):
+        return self.get(key,settings)!=None
+
+    def markDone(self,key,settings,runNum,outputFile,duration,results=None):
+        '''
+        record a finished run. outputFile is the .dat file it wrote to, its
+        current size marks the end of this run's data in it, as the number of
+        rows of its .columns directory (with binaryStats) does there. results
+        holds optional per-run metrics, returned as-is by get().
+        '''
+        entry = {
+            'settings':  dict([(k,v) for (k,v) in settings.items() if not k.startswith('_')]),
+            'seed':      settings['seed'],
+            'runNum':    runNum,
+            'outputs':   {outputFile: os.path.getsize(outputFile)},
+            'duration':  duration,
+            'endTime':   time.time(),
+            'results':   results,
+        }
+        columnsDir = SimSettings.getRunFile(outputFile,'binaryStats')
+        if os.path.exists(columnsDir):
+            entry['columns'] = {columnsDir: SimStats.StatsColumnWriter.getNumRows(columnsDir)}
+
+        self._makeDir()
+
+        # write-then-rename, so a crash never leaves a half-written entry
+        tempname = '{0}.{1}.tmp'.format(self._entryFile(key),os.getpid())
+        with open(tempname,'w') as f:
+            json.dump(entry,f,indent=4,sort_keys=True,default=str)
+        os.rename(tempname,self._entryFile(key))
+
+    #======================== private =========================================
+
+    def _makeDir(self):
+        if not os.path.exists(self.dirname):
+            try:
+                os.makedirs(self.dirname)
+            except OSError:
+                pass # created concurrently by another worker
+
+    def _entryFile(self,key):
+        return os.path.join(self.dirname,'{0}.json'.format(key))
+
+    def _normalize(self,value):
+        if isinstance(value,(list,tuple)):
+            return [self._normalize(v) for v in value]
+        if isinstance(value,bool) or value is None:
+            return value
+        try:
+            return float(value)
+        except (TypeError,ValueError):
+            return str(value)
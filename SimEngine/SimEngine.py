@@ -26,6 +26,11 @@ import Propagation
 import Topology
 import Mote
 import SimSettings
+import Checkpoint
+import RandomStreams
+import DispatchProfiler
+import TrafficSource
+import HopTrace
 import inspect
 
 #============================ defines =========================================
@@ -44,7 +49,7 @@ class SimEngine(threading.Thread):
         return cls._instance
     #===== end singleton
     
-    def __init__(self,runNum=None,failIfNotInit=False):
+    def __init__(self,runNum=None,failIfNotInit=False,restoreFrom=None):
         
         if failIfNotInit and not self._init:
             raise EnvironmentError('SimEngine singleton not initialized.')
@@ -64,18 +69,51 @@ class SimEngine(threading.Thread):
         self.simPaused                      = False
         self.goOn                           = True
         self.asn                            = 0
+        self.numEventsDispatched            = 0
         self.startCb                        = []
         self.endCb                          = []
         self.events                         = []
         self.settings                       = SimSettings.SimSettings()
         self.propagation                    = Propagation.Propagation()
-        self.motes                          = [Mote.Mote(id) for id in range(self.settings.numMotes)]
-        self.topology                       = Topology.Topology(self.motes)
-        self.topology.createTopology()
+        self.restoredAsn                    = None
+        self.checkpointAsn                  = None
+        self.checkpointFile                 = None
+        self.completed                      = False # set when run() went through all events and end callbacks
+        self.rplAncestors                   = {}    # indexed by mote, see getRplAncestors
+        self.rplChildren                    = {}    # indexed by mote, the motes which have it as preferredParent
+        self.rplNumDescendants              = {}    # indexed by mote, number of motes in its sub-DODAG
+        self.runHistograms                  = {}    # indexed by name, histograms of the run so far, see SimStats
+        if self.settings.dispatchProfile:
+            self.dispatchProfiler           = DispatchProfiler.DispatchProfiler(self.settings.slotframeLength)
+        else:
+            self.dispatchProfiler           = None
+        self.randomStreams                  = RandomStreams.RandomStreams(
+            masterSeed = self.settings.seed,
+            runNum     = runNum,
+            cpuID      = self.settings.cpuID,
+            variant    = [(k,getattr(self.settings,k)) for k in self.settings.combinationKeys],
+            paired     = self.settings.paired,
+        )
+        if self.settings.trafficSource!='events':
+            self.trafficSource              = TrafficSource.TrafficSource()
+        else:
+            self.trafficSource              = None
+        if self.settings.hopTrace:
+            self.hopTrace                   = HopTrace.HopTrace()
+        else:
+            self.hopTrace                   = None
+        if restoreFrom:
+            # motes, topology and events come from the checkpoint (see end)
+            self.motes                      = []
+            self.topology                   = None
+        else:
+            self.motes                      = [Mote.Mote(id) for id in range(self.settings.numMotes)]
+            self.topology                   = Topology.Topology(self.motes)
+            self.topology.createTopology()
 
-        # boot all motes
-        for i in range(len(self.motes)):
-            self.motes[i].boot()
+            # boot all motes
+            for i in range(len(self.motes)):
+                self.motes[i].boot()
         
         self.initTimeStampTraffic          = 0
         self.endTimeStampTraffic           = 0       
@@ -103,6 +141,10 @@ class SimEngine(threading.Thread):
         # emunicio settings
         self.numBroadcastCell=self.settings.numBroadcastCells
         
+        # restore last, it overwrites the state initialized above
+        if restoreFrom:
+            self.restoredAsn                = Checkpoint.restore(self,restoreFrom)
+        
         
                       
     
@@ -133,16 +175,21 @@ class SimEngine(threading.Thread):
         # log
         log.info("thread {0} starting".format(self.name))
         #print "Simulating nodes: "+str(self.settings.numMotes)
-        # schedule the endOfSimulation event
-        self.scheduleAtAsn(
-            asn         = self.settings.slotframeLength*self.settings.numCyclesPerRun,
-            cb          = self._actionEndSim,
-            uniqueTag   = (None,'_actionEndSim'),
-        )
+        # a restored simulation already went through this, before its checkpoint
+        if self.restoredAsn==None:
+            # schedule the endOfSimulation event
+            self.scheduleAtAsn(
+                asn         = self.settings.slotframeLength*self.settings.numCyclesPerRun,
+                cb          = self._actionEndSim,
+                uniqueTag   = (None,'_actionEndSim'),
+            )
+            
+            # call the start callbacks
+            for cb in self.startCb:
+                cb()
         
-        # call the start callbacks
-        for cb in self.startCb:
-            cb()
+        # None unless profiling, tested once per event to keep the loop cheap
+        dispatchProfiler = self.dispatchProfiler
         
         # consume events until self.goOn is False
         while self.goOn:
@@ -165,18 +212,28 @@ class SimEngine(threading.Thread):
                 # update the current ASN
                 self.asn = self.events[0][0]
                 
+                if dispatchProfiler:
+                    dispatchProfiler.sampleQueue(self.asn,len(self.events))
+                
                 # call callbacks at this ASN
                 while True:
                         
                     if self.events[0][0]!=self.asn:
                         break
-                    (_,_,cb,_) = self.events.pop(0)
-                    cb()
+                    (_,_,cb,uniqueTag) = self.events.pop(0)
+                    self.numEventsDispatched += 1
+                    if dispatchProfiler:
+                        dispatchProfiler.dispatch(cb,uniqueTag)
+                    else:
+                        cb()
         
         # call the end callbacks
         for cb in self.endCb:
             cb()
         
+        # not reached when a callback raised, see runSimOneCPU.runOneRun
+        self.completed = True
+        
         # log
         log.info("thread {0} ends".format(self.name))
     
@@ -236,6 +293,19 @@ class SimEngine(threading.Thread):
         with self.dataLock:
             self.endCb      += [cb]
     
+    #=== checkpoint
+    
+    def checkpointAtAsn(self,asn,filename):
+        ''' save the simulation state to filename once all events at asn ran '''
+        self.checkpointAsn  = asn
+        self.checkpointFile = filename
+        self.scheduleAtAsn(
+            asn         = asn,
+            cb          = self._actionCheckpoint,
+            uniqueTag   = ('SimEngine','_actionCheckpoint'),
+            priority    = 1000,
+        )
+    
     #=== play/pause
     
     def play(self):
@@ -250,6 +320,70 @@ class SimEngine(threading.Thread):
                 uniqueTag   = ('SimEngine','_actionPauseSim'),
             )
     
+    #=== RPL DODAG index
+    
+    def rplParentChanged(self,mote,oldPreferredParent):
+        '''
+        mote changed preferred parent: move its sub-DODAG from the old parent
+        to the new one, and invalidate the ancestors of the motes in it.
+        '''
+        size     = 1+self.rplNumDescendants.get(mote,0)
+        if oldPreferredParent!=None:
+            self.rplChildren[oldPreferredParent].discard(mote)
+            self._rplAddDescendants(mote,oldPreferredParent,-size)
+        if mote.preferredParent!=None:
+            self.rplChildren.setdefault(mote.preferredParent,set()).add(mote)
+            self._rplAddDescendants(mote,mote.preferredParent,size)
+        self._rplInvalidateAncestors(mote)
+    
+    def getRplChildren(self,mote):
+        ''' the motes which have mote as preferredParent, by id '''
+        return sorted(self.rplChildren.get(mote,()),key=lambda m: m.id)
+    
+    def getRplNumDescendants(self,mote):
+        ''' the number of motes in the sub-DODAG of mote '''
+        return self.rplNumDescendants.get(mote,0)
+    
+    def getRplAncestors(self,mote):
+        '''
+        the motes on the preferredParent chain of mote, up to the DAG root
+        (frozenset), cached until a mote on that chain changes parent.
+        
+        Its length is the number of hops of mote to the root.
+        '''
+        ancestors = self.rplAncestors.get(mote)
+        if ancestors==None:
+            chain      = set()  # O(1) loop check
+            parent     = mote.preferredParent
+            while parent!=None and parent not in chain:
+                chain.add(parent)
+                if parent.dagRoot:
+                    break
+                parent = parent.preferredParent
+            ancestors  = frozenset(chain)
+            self.rplAncestors[mote] = ancestors
+        return ancestors
+    
+    def _rplInvalidateAncestors(self,mote):
+        ''' drop the cached ancestors of mote and of its sub-DODAG, whose chains go through it '''
+        visited  = set()    # a parent change may close a loop
+        stack    = [mote]
+        while stack:
+            m    = stack.pop()
+            if m in visited:
+                continue
+            visited.add(m)
+            self.rplAncestors.pop(m,None)
+            stack += self.rplChildren.get(m,())
+    
+    def _rplAddDescendants(self,mote,parent,num):
+        ''' add num descendants to parent and its ancestors, up to the root or mote (loop) '''
+        while parent!=None and parent!=mote:
+            self.rplNumDescendants[parent] = self.rplNumDescendants.get(parent,0)+num
+            if parent.dagRoot:
+                break
+            parent = parent.preferredParent
+    
     #=== getters/setters
     
     def getAsn(self):
@@ -257,6 +391,14 @@ class SimEngine(threading.Thread):
         
     #======================== private =========================================
     
+    def _actionCheckpoint(self):
+        Checkpoint.save(self.checkpointFile)
+        # continue from the checkpointed copy of the state, so that this run
+        # and any run restored from the checkpoint go on identically (dict
+        # ordering depends on their history, which pickling does not keep)
+        Checkpoint.restore(self,self.checkpointFile)
+        print 'Checkpoint at ASN {0} written to {1}'.format(self.asn,self.checkpointFile)
+    
     def _actionPauseSim(self):
         if not self.simPaused:
             self.simPaused = True
@@ -274,4 +416,14 @@ class SimEngine(threading.Thread):
             	    
             for mote in self.motes:
                 mote._log_printEndResults()
+            
+            if self.dispatchProfiler:
+                profileFile = self.settings.getDispatchProfileFile(self.runNum)
+                self.dispatchProfiler.dump(profileFile)
+                print 'Event dispatch profile written to {0}'.format(profileFile)
+            
+            if self.hopTrace:
+                traceFile = self.settings.getHopTraceFile(self.runNum)
+                self.hopTrace.dump(traceFile)
+                print 'Hop trace of {0} packets written to {1}'.format(self.hopTrace.numPackets,traceFile)
 
@@ -24,6 +24,20 @@ import os
 
 #============================ defines =========================================
 
+# files written next to the output file when the setting is on
+RUN_FILES = {
+    'binaryStats':         '{base}.columns',
+    'profile':             '{base}_run{runNum}.pstats',
+    'dispatchProfile':     '{base}_run{runNum}.dispatch.txt',
+    'hopTrace':            '{base}_run{runNum}.hoptrace',
+}
+
+#============================ helpers =========================================
+
+def getRunFile(outputFile,setting,runNum=None):
+    ''' the RUN_FILES file of setting for run runNum, written next to outputFile '''
+    return RUN_FILES[setting].format(base=os.path.splitext(outputFile)[0],runNum=runNum)
+
 #============================ body ============================================
 
 class SimSettings(object):
@@ -75,6 +89,26 @@ class SimSettings(object):
         
         return datafilename
     
+    def getColumnsDir(self):
+        # directory with the columnar copy of getOutputFile()
+        return getRunFile(self.getOutputFile(),'binaryStats')
+    
+    def getCheckpointFile(self,runNum,asn):
+        # checkpoint of run runNum at asn, next to getOutputFile()
+        return '{0}_run{1}_asn{2}.checkpoint'.format(os.path.splitext(self.getOutputFile())[0],runNum,asn)
+    
+    def getProfileFile(self,runNum):
+        # cProfile statistics of run runNum, next to getOutputFile()
+        return getRunFile(self.getOutputFile(),'profile',runNum)
+    
+    def getDispatchProfileFile(self,runNum):
+        # event dispatch profile of run runNum, next to getOutputFile()
+        return getRunFile(self.getOutputFile(),'dispatchProfile',runNum)
+    
+    def getHopTraceFile(self,runNum):
+        # hop trace of run runNum, next to getOutputFile()
+        return getRunFile(self.getOutputFile(),'hopTrace',runNum)
+    
     def destroy(self):
         self._instance       = None
         self._init           = False
@@ -20,13 +20,285 @@ log.addHandler(NullHandler())
 
 #============================ imports =========================================
 
+import os
+import time
+import shutil
+import json
+import atexit
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # only needed for binaryStats
+
 import SimEngine
 import SimSettings
+import Histogram
 
 #============================ defines =========================================
 
+# percentile columns (e.g. p95Latency) of the histograms of getMoteStats
+PERCENTILES        = [50,95,99]
+HISTOGRAMS         = [
+    ('Latency',        'latencyHistogram'),
+    ('QueueDelay',     'queueDelayHistogram'),
+]
+
+# writers with data not yet on disk, flushed at interpreter exit
+_openWriters       = []
+_openWritersLock   = threading.Lock()
+
 #============================ body ============================================
 
+class StatsFileWriter(object):
+    '''
+    Buffered writer for a single output file.
+    
+    Keeps one file handle open for the whole run and accumulates lines in
+    memory; they are written out when FLUSH_BYTES have accumulated, when
+    FLUSH_PERIOD seconds have passed since the last flush, and on close().
+    Writers still open at interpreter exit are flushed by _closeAllWriters().
+    '''
+    
+    FLUSH_BYTES        = 64*1024 # bytes
+    FLUSH_PERIOD       = 5.0     # s
+    
+    def __init__(self,filename,mode='a'):
+        
+        # store params
+        self.filename                       = filename
+        
+        # local variables
+        self.dataLock                       = threading.RLock()
+        self.pending                        = []
+        self.pendingBytes                   = 0
+        self.lastFlush                      = time.time()
+        self.rowFormat                      = None
+        self.rowColumns                     = None
+        self.f                              = open(filename,mode)
+        
+        with _openWritersLock:
+            _openWriters.append(self)
+    
+    #======================== public ==========================================
+    
+    def write(self,output):
+        with self.dataLock:
+            self.pending      += [output]
+            self.pendingBytes += len(output)
+            if self.pendingBytes>=self.FLUSH_BYTES or time.time()-self.lastFlush>=self.FLUSH_PERIOD:
+                self.flush()
+    
+    def setColumns(self,columnNames):
+        '''
+        Build the data line formatter once; columns are right-aligned to the
+        width of their name, floats are written with 3 decimals.
+        '''
+        with self.dataLock:
+            self.rowColumns = list(columnNames)
+            self.rowFormat  = '  '+' '.join(['{{{0}:>{1}}}'.format(i,len(k)) for (i,k) in enumerate(self.rowColumns)])+'\n'
+    
+    def formatRow(self,stats):
+        vals = []
+        for k in self.rowColumns:
+            v = stats[k]
+            if type(v)==float:
+                vals += ['{0:.3f}'.format(v)]
+            else:
+                vals += [v]
+        return self.rowFormat.format(*vals)
+    
+    def flush(self):
+        with self.dataLock:
+            if self.f is None:
+                return
+            if self.pending:
+                self.f.write(''.join(self.pending))
+                self.pending      = []
+                self.pendingBytes = 0
+            self.f.flush()
+            self.lastFlush = time.time()
+    
+    def close(self):
+        with self.dataLock:
+            if self.f is None:
+                return
+            self.flush()
+            self.f.close()
+            self.f = None
+        with _openWritersLock:
+            if self in _openWriters:
+                _openWriters.remove(self)
+    
+    def abandon(self):
+        '''
+        Close without writing the pending lines, e.g. in a forked child which
+        leaves them to its parent.
+        '''
+        with self.dataLock:
+            self.pending      = []
+            self.pendingBytes = 0
+        self.close()
+
+class StatsColumnWriter(object):
+    '''
+    Columnar binary copy of the per-cycle statistics.
+    
+    The rows of a run are kept in memory and appended, at the end of the run,
+    to one raw file of DTYPE values per column in dirname, so adding a run
+    only writes that run's rows. header.json in the same directory holds the
+    settings, the column names, DTYPE and the rows of each run, so a reader
+    can numpy.memmap(...) the one column it needs. It also holds the size of
+    the .dat file after each run: a reader only uses the copy when the last
+    one is the current size of the .dat, i.e. no run was appended to the .dat
+    without binaryStats since, and the copy is not partial, i.e. it was not
+    started after runs already in the .dat.
+    '''
+    
+    HEADER_FILE        = 'header.json'
+    DTYPE              = '<f8'   # as the text output, which is parsed as floats
+    
+    def __init__(self,dirname,datFile,settings,newFile):
+        
+        assert numpy, 'binaryStats requires numpy'
+        
+        # store params
+        self.dirname                        = dirname
+        self.datFile                        = datFile
+        
+        # local variables
+        self.dataLock                       = threading.RLock()
+        self.rows                           = []
+        self.closed                         = False
+        
+        if not os.path.exists(self.dirname):
+            os.makedirs(self.dirname)
+        
+        self.header                         = None
+        if not newFile:
+            try:
+                self.header = self.readHeader(self.dirname)
+            except (IOError,ValueError):
+                pass
+            if self.header and self.header.get('datSizes',[])[-1:]!=[os.path.getsize(self.datFile)]:
+                self.header = None
+            if self.header==None:
+                # the .dat has runs this copy does not, e.g. written without
+                # binaryStats: start over, never to be read (see partial)
+                print '{0} lacks the earlier runs of {1}, it will not be read'.format(self.dirname,self.datFile)
+        if self.header==None:
+            for filename in os.listdir(self.dirname):
+                if filename.endswith('.bin'):
+                    os.remove(os.path.join(self.dirname,filename))
+            self.header = {
+                'settings':    settings,
+                'columns':     [],
+                'dtype':       self.DTYPE,
+                'runs':        [],
+                'datSizes':    [],
+                'partial':     not newFile,
+            }
+        
+        with _openWritersLock:
+            _openWriters.append(self)
+    
+    #======================== public ==========================================
+    
+    @classmethod
+    def readHeader(cls,dirname):
+        with open(os.path.join(dirname,cls.HEADER_FILE),'r') as f:
+            return json.load(f)
+    
+    @classmethod
+    def writeHeader(cls,dirname,header):
+        # write-then-rename, the column files are only valid with their header
+        tempname = '{0}.{1}.tmp'.format(os.path.join(dirname,cls.HEADER_FILE),os.getpid())
+        with open(tempname,'w') as f:
+            json.dump(header,f,indent=4,default=str)
+        os.rename(tempname,os.path.join(dirname,cls.HEADER_FILE))
+    
+    @classmethod
+    def columnFile(cls,dirname,columnName):
+        return os.path.join(dirname,'{0}.bin'.format(columnName))
+    
+    @classmethod
+    def getNumRows(cls,dirname):
+        ''' number of rows of all the runs written to dirname '''
+        return sum([numRows for (_,_,numRows) in cls.readHeader(dirname)['runs']])
+    
+    @classmethod
+    def truncate(cls,dirname,numRows):
+        '''
+        drop the rows after the first numRows, e.g. those of an interrupted
+        run, and the runs they belong to.
+        '''
+        header          = cls.readHeader(dirname)
+        itemsize        = numpy.dtype(header['dtype']).itemsize
+        header['runs']  = [(runNum,firstRow,n) for (runNum,firstRow,n) in header['runs'] if firstRow+n<=numRows]
+        header['datSizes'] = header['datSizes'][:len(header['runs'])]
+        for k in header['columns']:
+            with open(cls.columnFile(dirname,k),'r+b') as f:
+                f.truncate(numRows*itemsize)
+        cls.writeHeader(dirname,header)
+    
+    def append(self,stats):
+        with self.dataLock:
+            self.rows += [stats]
+    
+    def close(self):
+        with self.dataLock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.rows:
+                self._writeRows()
+        with _openWritersLock:
+            if self in _openWriters:
+                _openWriters.remove(self)
+    
+    def abandon(self):
+        '''
+        Close without writing the rows of the current run.
+        '''
+        with self.dataLock:
+            self.rows = []
+        self.close()
+    
+    #======================== private =========================================
+    
+    def _writeRows(self):
+        columnNames = sorted(self.rows[0].keys())
+        if not self.header['columns']:
+            self.header['columns'] = columnNames
+        assert columnNames==self.header['columns']
+        
+        firstRow = sum([numRows for (_,_,numRows) in self.header['runs']])
+        
+        for k in columnNames:
+            vals     = numpy.array([row[k] for row in self.rows],dtype=self.header['dtype'])
+            filename = self.columnFile(self.dirname,k)
+            with open(filename,'r+b' if os.path.exists(filename) else 'wb') as f:
+                # after the rows in the header, whatever a crash left past them
+                f.seek(firstRow*vals.itemsize)
+                f.truncate()
+                f.write(vals.tobytes())
+        
+        self.header['runs'] += [(self.rows[0]['runNum'],firstRow,len(self.rows))]
+        self.header['datSizes'] += [os.path.getsize(self.datFile)] # its text is flushed, see SimStats._actionEnd
+        self.writeHeader(self.dirname,self.header)
+        
+        self.rows = []
+
+def _closeAllWriters():
+    for writer in list(_openWriters):
+        try:
+            writer.close()
+        except Exception as err:
+            log.error('could not flush {0}: {1}'.format(writer,err))
+
+atexit.register(_closeAllWriters)
+
 class SimStats(object):
     
     #===== start singleton
@@ -39,7 +311,7 @@ class SimStats(object):
         return cls._instance
     #===== end singleton
     
-    def __init__(self,runNum):
+    def __init__(self,runNum,newFile=None):
         
         #===== start singleton
         if self._init:
@@ -49,6 +321,8 @@ class SimStats(object):
         
         # store params
         self.runNum                         = runNum
+        if newFile is None:
+            newFile                         = (runNum==0)
         
         # local variables
         self.engine                         = SimEngine.SimEngine()
@@ -57,27 +331,54 @@ class SimStats(object):
         # stats
         self.stats                          = {}
         self.columnNames                    = []
+        self.runStats                       = [] # rows written by this run
         
-        # start file
-        if self.runNum==0:
-            self._fileWriteHeader()
+        # run histograms live in the engine, so that a checkpoint carries them
+        for (name,_) in HISTOGRAMS:
+            self.engine.runHistograms.setdefault(name,Histogram.Histogram())
         
-        # schedule actions
-        self.engine.scheduleAtStart(
-            cb          = self._actionStart,
-        )
-        self.engine.scheduleAtAsn(
-            asn         = self.engine.getAsn()+self.settings.slotframeLength-1,
-            cb          = self._actionEndCycle,
-            uniqueTag   = (None,'_actionEndCycle'),
-            priority    = 10,
-        )
-        self.engine.scheduleAtEnd(
-            cb          = self._actionEnd,
-        )
+        # start file (one buffered handle for the whole run)
+        self._startFiles(newFile)
+        
+        # schedule actions (a restored engine has them in its checkpoint)
+        if self.engine.restoredAsn==None:
+            self.engine.scheduleAtStart(
+                cb          = self._actionStart,
+            )
+            self.engine.scheduleAtAsn(
+                asn         = self.engine.getAsn()+self.settings.slotframeLength-1,
+                cb          = self._actionEndCycle,
+                uniqueTag   = (None,'_actionEndCycle'),
+                priority    = 10,
+            )
+            self.engine.scheduleAtEnd(
+                cb          = self._actionEnd,
+            )
         
     
+    def branch(self,newFile):
+        '''
+        Continue this run in the output file of the current settings, after a
+        forked child changed them. The rows written so far go to the new file
+        too, the parent writes them to the original one.
+        '''
+        self.writer.abandon()
+        if self.columnWriter:
+            self.columnWriter.abandon()
+        
+        self._startFiles(newFile)
+        
+        (runStats,self.runStats) = (self.runStats,[])
+        self.columnNames = []
+        for stats in runStats:
+            self._fileWriteStats(stats)
+    
     def destroy(self):
+        # flush whatever the run produced, also if it ended abnormally
+        self.writer.close()
+        if self.columnWriter:
+            self.columnWriter.close()
+        
         # destroy my own instance
         self._instance                      = None
         self._init                          = False
@@ -107,13 +408,16 @@ class SimStats(object):
             print "Elapsed time: "+str(self.engine.timeElapsedFlow)        
         
         # write statistics to output file
+        moteStats       = self._collectSumMoteStats()
+        percentileStats = self._collectPercentileStats(moteStats)
         self._fileWriteStats(
             dict(
                 {
                     'runNum':              self.runNum,
                     'cycle':               cycle,
                 }.items() +
-                self._collectSumMoteStats().items()  +
+                moteStats.items()  +
+                percentileStats.items() +
                 self._collectScheduleStats().items()
             )
         )
@@ -140,6 +444,9 @@ class SimStats(object):
     def _actionEnd(self):
         '''Called once at end of the simulation.'''
         self._fileWriteTopology()
+        self.writer.flush()
+        if self.columnWriter:
+            self.columnWriter.close()
     
     #=== collecting statistics
     
@@ -155,8 +462,22 @@ class SimStats(object):
                     returnVal[k] += moteStats[k]
         
         return returnVal
-
     
+    def _collectPercentileStats(self,moteStats):
+        '''
+        replace the histograms of moteStats (merged over the motes) by their
+        percentiles and maximum, and add them to those of the run.
+        '''
+        returnVal = {}
+        
+        for (name,histogramName) in HISTOGRAMS:
+            histogram = moteStats.pop(histogramName)
+            for p in PERCENTILES:
+                returnVal['p{0}{1}'.format(p,name)] = histogram.getPercentile(p)
+            returnVal['max{0}'.format(name)]        = histogram.max
+            self.engine.runHistograms[name] += histogram
+        
+        return returnVal
         
     def _collectScheduleStats(self):
         
@@ -208,14 +529,34 @@ class SimStats(object):
     
     #=== writing to file
     
+    def _startFiles(self,newFile):
+        self.writer                         = StatsFileWriter(
+            self.settings.getOutputFile(),
+            'w' if newFile else 'a',
+        )
+        if newFile:
+            self._fileWriteHeader()
+        
+        # columnar binary copy of the per-cycle statistics
+        self.columnWriter                   = None
+        if self.settings.binaryStats:
+            self.columnWriter               = StatsColumnWriter(
+                self.settings.getColumnsDir(),
+                self.settings.getOutputFile(),
+                dict([(k,v) for (k,v) in self.settings.__dict__.items() if not k.startswith('_')]),
+                newFile = newFile,
+            )
+        elif newFile and os.path.exists(self.settings.getColumnsDir()):
+            # copy of an earlier .dat this one replaces
+            shutil.rmtree(self.settings.getColumnsDir())
+    
     def _fileWriteHeader(self):
         output          = []
         output         += ['## {0} = {1}'.format(k,v) for (k,v) in self.settings.__dict__.items() if not k.startswith('_')]
         output         += ['\n']
         output          = '\n'.join(output)
         
-        with open(self.settings.getOutputFile(),'w') as f:
-            f.write(output)
+        self.writer.write(output)
     
     def _fileWriteStats(self,stats):
         output          = []
@@ -223,24 +564,17 @@ class SimStats(object):
         # columnNames
         if not self.columnNames:
             self.columnNames = sorted(stats.keys())
+            self.writer.setColumns(self.columnNames)
             output     += ['\n# '+' '.join(self.columnNames)]
         
         # dataline
-        formatString    = ' '.join(['{{{0}:>{1}}}'.format(i,len(k)) for (i,k) in enumerate(self.columnNames)])
-        formatString   += '\n'
-        
-        vals = []
-        for k in self.columnNames:
-            if type(stats[k])==float:
-                vals += ['{0:.3f}'.format(stats[k])]
-            else:
-                vals += [stats[k]]
-        
-        output += ['  '+formatString.format(*tuple(vals))]
+        output         += [self.writer.formatRow(stats)]
         
         # write to file
-        with open(self.settings.getOutputFile(),'a') as f:
-            f.write('\n'.join(output))
+        self.writer.write('\n'.join(output))
+        if self.columnWriter:
+            self.columnWriter.append(stats)
+        self.runStats  += [stats]
     
     def _fileWriteTopology(self):
         output  = []
@@ -274,6 +608,17 @@ class SimStats(object):
             )
         ]
 
+        percentiles = []
+        for (name,_) in HISTOGRAMS:
+            histogram    = self.engine.runHistograms[name]
+            percentiles += ['p{0}{1} {2}'.format(p,name,histogram.getPercentile(p)) for p in PERCENTILES]
+            percentiles += ['max{0} {1}'.format(name,histogram.max)]
+        output += [
+            '#percentiles runNum={0} {1}'.format(
+                self.runNum,
+                ' '.join(percentiles),
+            )
+        ]
         output += [
             '#aveChargePerCycle runNum={0} {1}'.format(
                 self.runNum,
@@ -286,5 +631,4 @@ class SimStats(object):
 	       
         output  = '\n'.join(output)
         
-        with open(self.settings.getOutputFile(),'a') as f:
-            f.write(output)
+        self.writer.write(output)
@@ -20,10 +20,10 @@ log.addHandler(NullHandler())
 
 #============================ imports =========================================
 
-import random
 import math
 
 import SimSettings
+import SimEngine
 
 #============================ defines =========================================
 
@@ -45,6 +45,7 @@ class Topology(object):
         
         # local variables
         self.settings        = SimSettings.SimSettings()
+        self.engine          = SimEngine.SimEngine()
 
 	self.starTopology=False
         
@@ -78,11 +79,12 @@ class Topology(object):
             if mote in connectedMotes:
                 continue
             connected = False
+            moteRandom = self.engine.randomStreams.get('topology',mote.id)
             while not connected:
                 # pick a random location
                 mote.setLocation(
-                    x = self.settings.squareSide*random.random(),
-                    y = self.settings.squareSide*random.random()
+                    x = self.settings.squareSide*moteRandom.random(),
+                    y = self.settings.squareSide*moteRandom.random()
                 )
                 
                 numStableNeighbors = 0
@@ -168,7 +170,7 @@ class Topology(object):
         mu = pr-self.PISTER_HACK_LOWER_SHIFT/2 #chosing the "mean" value
     
         # the receiver will receive the packet with an rssi uniformly distributed between friis and friis -40
-        rssi = mu + random.uniform(-self.PISTER_HACK_LOWER_SHIFT/2, self.PISTER_HACK_LOWER_SHIFT/2)
+        rssi = mu + self.engine.randomStreams.get('topology',mote.id).uniform(-self.PISTER_HACK_LOWER_SHIFT/2, self.PISTER_HACK_LOWER_SHIFT/2)
         #print "RSSI "+str(rssi)
         return rssi
     
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+'''
+\brief Precomputed application traffic, merged into a single engine event.
+
+Without it (--trafficSource events), each mote schedules its next packet from
+the previous one, i.e. one scheduleIn (and the removeEvent scan of its
+uniqueTag) per packet. With it, each mote has an ArrivalStream, which draws
+the ASNs of its packets in chunks of CHUNK_SIZE with NumPy:
+- 'periodic': pkPeriod, jittered by +/- pkPeriodVar, as the events;
+- 'poisson':  exponential inter-arrival times of mean pkPeriod;
+- a burst of numPacketsBurst packets at burstTimestamp and at 3 times
+  burstTimestamp, when both are set, as _app_schedule_sendPacketBurst.
+
+The TrafficSource keeps a heap with the next arrival of each mote, and a
+single engine event at the earliest one, which enqueues the packets of all
+motes arriving at that ASN (by mote id) through _app_action_enqueueData.
+'''
+
+#============================ logging =========================================
+
+import logging
+class NullHandler(logging.Handler):
+    def emit(self, record):
+        pass
+log = logging.getLogger('TrafficSource')
+log.setLevel(logging.ERROR)
+log.addHandler(NullHandler())
+
+#============================ imports =========================================
+
+import heapq
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # only needed for --trafficSource periodic/poisson
+
+import SimEngine
+import SimSettings
+
+#============================ defines =========================================
+
+CHUNK_SIZE        = 64   # arrivals drawn at once, per mote
+LAST_CYCLE        = 96   # no arrival after the first one past this cycle, as _app_schedule_sendSinglePacket
+
+#============================ body ============================================
+
+class ArrivalStream(object):
+    '''
+    the arrival ASNs of the packets of one mote.
+    '''
+
+    def __init__(self,mote,startAsn):
+
+        self.engine          = SimEngine.SimEngine()
+        self.settings        = SimSettings.SimSettings()
+
+        # draws seeded as the 'app' stream of the mote (see RandomStreams)
+        seed                 = self.engine.randomStreams.getSeed('app',mote.id)
+        self.random          = numpy.random.RandomState([seed>>32,seed&0xffffffff])
+
+        # local variables
+        self.pkPeriod        = mote.pkPeriod
+        self.lastAsn         = startAsn
+        self.arrivals        = []    # next arrival ASNs, in order
+        self.index           = 0     # of the next arrival in self.arrivals
+        self.stopAsn         = LAST_CYCLE*self.settings.slotframeLength
+
+        if self.settings.numPacketsBurst!=None and self.settings.burstTimestamp!=None:
+            # as the events of _app_schedule_sendPacketBurst
+            self.arrivals    = []
+            for delay in [self.settings.burstTimestamp,3*self.settings.burstTimestamp]:
+                self.arrivals += [startAsn+int(delay/self.settings.slotDuration)]*self.settings.numPacketsBurst
+            self.stopAsn     = None
+        else:
+            # first packet within [next asn, next asn+pkPeriod], as _app_schedule_sendSinglePacket
+            delay            = self.settings.slotDuration + (self.settings.slotframeLength/6)*self.random.random_sample() + (self.settings.slotframeLength/6)
+            self.arrivals    = [startAsn+int(delay/self.settings.slotDuration)]
+
+    def next(self):
+        '''
+        the ASN of the next arrival, None when the stream is over.
+        '''
+        if self.stopAsn!=None and self.lastAsn>=self.stopAsn:
+            return None
+        if self.index==len(self.arrivals):
+            if self.stopAsn==None:
+                return None
+            self._drawChunk()
+        asn                  = self.arrivals[self.index]
+        self.index          += 1
+        self.lastAsn         = asn
+        return asn
+
+    def _drawChunk(self):
+        if self.settings.trafficSource=='poisson':
+            delays           = self.random.exponential(self.pkPeriod,CHUNK_SIZE)
+        else:
+            delays           = self.pkPeriod*(1+self.random.uniform(-self.settings.pkPeriodVar,self.settings.pkPeriodVar,CHUNK_SIZE))
+        # in slots, truncated as scheduleIn, and at least one slot apart
+        slots                = numpy.maximum((delays/self.settings.slotDuration).astype(int),1)
+        self.arrivals        = (self.lastAsn+numpy.cumsum(slots)).tolist()
+        self.index           = 0
+
+class TrafficSource(object):
+
+    def __init__(self):
+
+        assert numpy, '--trafficSource {0} requires numpy'.format(SimSettings.SimSettings().trafficSource)
+
+        self.engine          = SimEngine.SimEngine()
+
+        # local variables
+        self.streams         = {}    # indexed by mote id
+        self.motes           = {}    # indexed by mote id
+        self.arrivals        = []    # heap of (asn,mote id), the next arrival of each mote
+        self.nextAsn         = None  # of the scheduled _action_arrivals
+
+    #======================== public ==========================================
+
+    def addMote(self,mote):
+        ''' start the arrivals of mote, at boot '''
+        self.streams[mote.id] = ArrivalStream(mote,self.engine.getAsn())
+        self.motes[mote.id]   = mote
+        self._push(mote.id)
+        self._schedule()
+
+    #======================== private =========================================
+
+    def _push(self,moteId):
+        asn = self.streams[moteId].next()
+        if asn==None:
+            del self.streams[moteId]
+        else:
+            heapq.heappush(self.arrivals,(asn,moteId))
+
+    def _schedule(self):
+        if self.arrivals and self.arrivals[0][0]!=self.nextAsn:
+            self.nextAsn = self.arrivals[0][0]
+            self.engine.scheduleAtAsn(
+                asn         = self.nextAsn,
+                cb          = self._action_arrivals,
+                uniqueTag   = ('TrafficSource','_action_arrivals'),
+                priority    = 2,
+            )
+
+    def _action_arrivals(self):
+        ''' enqueue the packets arriving at this ASN, and schedule the next arrivals '''
+        asn          = self.engine.getAsn()
+        self.nextAsn = None
+        while self.arrivals and self.arrivals[0][0]==asn:
+            (_,moteId) = heapq.heappop(self.arrivals)
+            mote       = self.motes[moteId]
+            if mote.finishMyFlow:
+                del self.streams[moteId]
+                continue
+            mote._app_action_enqueueData()
+            self._push(moteId)
+        self._schedule()
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+'''
+\brief Simulation fixtures for the benchmarks.
+
+A fixture is a simulation of numMotes motes, built with the default
+runSimOneCPU settings and a fixed seed, run in this thread for a few
+warm-up cycles. Its state is saved with Checkpoint, so each benchmark starts
+from the same state (see reset()).
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+here = os.path.dirname(os.path.abspath(__file__))
+for path in [os.path.join(here,'..'),os.path.join(here,'..','bin')]:
+    if path not in sys.path:
+        sys.path.insert(0,path)
+
+#============================ imports =========================================
+
+import time
+import contextlib
+
+import runSimOneCPU
+from SimEngine     import SimEngine,   \
+                          SimSettings, \
+                          SimStats,    \
+                          Checkpoint
+
+#============================ defines =========================================
+
+SEED               = 1234
+NUM_CYCLES         = 10000 # never reached, fixtures are advanced by hand
+
+#============================ helpers =========================================
+
+@contextlib.contextmanager
+def quiet():
+    ''' silence the prints of the simulator '''
+    stdout     = sys.stdout
+    sys.stdout = open(os.devnull,'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+class _Stopper(object):
+    # bound method callback, so the event queue stays picklable
+    def stop(self):
+        SimEngine.SimEngine().goOn = False
+
+#============================ body ============================================
+
+class Fixture(object):
+
+    def __init__(self,numMotes,workDir,warmupCycles=0,**settings):
+
+        # store params
+        self.numMotes        = numMotes
+        self.workDir         = workDir
+        self.warmupCycles    = warmupCycles
+
+        # local variables
+        self.checkpointFile  = os.path.join(workDir,'fixture_{0}.checkpoint'.format(numMotes))
+
+        # build
+        simParam             = self.getSimParam(**settings)
+        destroy()
+        startTime            = time.time()
+        with quiet():
+            simSettings      = SimSettings.SimSettings(**simParam)
+            simSettings.setStartTime(startTime)
+            simSettings.setCombinationKeys([])
+            SimEngine.SimEngine(0)
+            self.simStats    = SimStats.SimStats(0,newFile=True)
+        self.buildTime       = time.time()-startTime
+
+        # warm up
+        startTime            = time.time()
+        self.advance(warmupCycles*simParam['slotframeLength'])
+        self.warmupTime      = time.time()-startTime
+
+        Checkpoint.save(self.checkpointFile)
+
+    #======================== public ==========================================
+
+    def getSimParam(self,**settings):
+        '''
+        default runSimOneCPU settings, with a fixed seed and settings applied.
+        '''
+        options  = runSimOneCPU.parseCliOptions([
+            '--simDataDir', self.workDir,
+            '--seed',       str(SEED),
+            '--numRuns',    '1',
+        ])
+        (_,simParams)  = runSimOneCPU.getSimParams(options)
+        simParam = simParams[0]
+        simParam.update({
+            'numMotes':         self.numMotes,
+            'numCyclesPerRun':  NUM_CYCLES,
+        })
+        simParam.update(settings)
+        return simParam
+
+    def reset(self):
+        ''' back to the state right after warm-up '''
+        Checkpoint.restore(SimEngine.SimEngine(),self.checkpointFile)
+
+    def advance(self,numSlots):
+        '''
+        run the engine for numSlots in this thread, without the start and end
+        callbacks of a full run.
+        '''
+        engine             = SimEngine.SimEngine()
+        if numSlots<=0:
+            return
+        (startCb,endCb)    = (engine.startCb,engine.endCb)
+        (engine.startCb,engine.endCb) = ([],[])
+        engine.scheduleAtAsn(
+            asn         = engine.asn+numSlots,
+            cb          = _Stopper().stop,
+            uniqueTag   = ('fixtures','stop'),
+            priority    = 1000,
+        )
+        engine.goOn        = True
+        try:
+            with quiet():
+                engine.run()
+        finally:
+            (engine.startCb,engine.endCb) = (startCb,endCb)
+
+def destroy():
+    ''' destroy the simulation singletons, if any '''
+    with quiet():
+        if SimStats.SimStats._instance and SimStats.SimStats._instance._init:
+            SimStats.SimStats._instance.destroy()
+        if SimEngine.SimEngine._instance and SimEngine.SimEngine._instance._init:
+            SimEngine.SimEngine._instance.destroy()
+        if SimSettings.SimSettings._instance and SimSettings.SimSettings._instance._init:
+            SimSettings.SimSettings._instance.destroy()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+'''
+\brief End-to-end benchmark of complete simulation runs.
+
+Runs a fixed matrix of runSimOneCPU scenarios (a base scenario, and variations
+of one setting at a time) with a fixed seed, each in its own process. For each
+scenario, it reports the wall time of the run, the simulated ASNs and the
+events dispatched per wall second, the peak memory of the process and the
+size of the output. The results are written as JSON and optionally compared
+to a baseline results file; the exit status is non-zero on a regression, e.g.
+
+    python bench/macrobench.py --output release-1.json
+    python bench/macrobench.py --baseline release-1.json
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+if __name__=='__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import traceback
+import multiprocessing
+
+from bench         import fixtures,    \
+                          results
+from SimEngine     import SimEngine
+
+import runSimOneCPU
+
+#============================ defines =========================================
+
+SEED               = fixtures.SEED
+NUM_CYCLES         = 100
+
+BASE_SCENARIO      = {
+    'numMotes':        50,
+    'pkPeriod':        1,
+    'numChans':        16,
+    'scheduler':       'none',
+    'algorithm':       'otf',
+}
+
+# (setting,values) varied one at a time around BASE_SCENARIO
+VARIATIONS         = [
+    ('numMotes',       [25,100]),
+    ('pkPeriod',       [4,0.5]),
+    ('numChans',       [8]),
+    ('scheduler',      ['deBras','opt2']),
+    ('algorithm',      ['local_voting']),
+]
+
+# name, unit and higherIsBetter of the metrics of each scenario
+METRICS            = [
+    ('wallTime',        's',        False),
+    ('asnPerSecond',    'ASN/s',    True),
+    ('eventsPerSecond', 'events/s', True),
+    ('peakRss',         'MB',       False),
+    ('outputSize',      'kB',       False),
+]
+
+#============================ helpers =========================================
+
+def getScenarios():
+    '''
+    the scenario matrix, as a list of (name,settings).
+    '''
+    scenarios = [('base',dict(BASE_SCENARIO))]
+    for (k,values) in VARIATIONS:
+        for v in values:
+            scenario    = dict(BASE_SCENARIO)
+            scenario[k] = v
+            scenarios  += [('{0}={1}'.format(k,v),scenario)]
+    return scenarios
+
+def getSimParams(scenario,simDataDir):
+    '''
+    default runSimOneCPU settings, with a fixed seed and the scenario settings
+    applied.
+
+    Returns (combinationKeys,simParams), as runSimOneCPU.getSimParams.
+    '''
+    options  = runSimOneCPU.parseCliOptions([
+        '--simDataDir',      simDataDir,
+        '--seed',            str(SEED),
+        '--numRuns',         '1',
+        '--numCyclesPerRun', str(NUM_CYCLES),
+    ])
+    options.update(scenario)
+    return runSimOneCPU.getSimParams(options)
+
+def getPeakRss():
+    ''' peak resident memory of this process, in MB '''
+    maxrss   = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform=='darwin':
+        return maxrss/1024.0/1024.0  # bytes
+    return maxrss/1024.0             # kB
+
+def getDirSize(path):
+    size     = 0
+    for (dirpath,_,filenames) in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath,filename))
+    return size
+
+def runScenario(scenario,simDataDir,queue):
+    '''
+    run scenario in this (fresh) process, put its metrics in queue.
+    '''
+    try:
+        (combinationKeys,simParams) = getSimParams(scenario,simDataDir)
+        startTime    = time.time()
+        with fixtures.quiet():
+            runSimOneCPU.runOneRun(simParams[0],combinationKeys,0,startTime,newFile=True)
+        wallTime     = time.time()-startTime
+
+        # the destroyed engine singleton keeps its counters
+        engine       = SimEngine.SimEngine._instance
+        queue.put({
+            'wallTime':        wallTime,
+            'asnPerSecond':    engine.asn/wallTime,
+            'eventsPerSecond': engine.numEventsDispatched/wallTime,
+            'peakRss':         getPeakRss(),
+            'outputSize':      getDirSize(simDataDir)/1024.0,
+        })
+    except:
+        traceback.print_exc()
+        queue.put(None)
+
+def measureScenario(scenario,workDir):
+    '''
+    run scenario in a child process, so its peak memory is its own.
+
+    Returns the metrics of the run.
+    '''
+    simDataDir   = tempfile.mkdtemp(dir=workDir)
+    queue        = multiprocessing.Queue()
+    process      = multiprocessing.Process(target=runScenario,args=(scenario,simDataDir,queue))
+    process.start()
+    metrics      = queue.get()
+    process.join()
+    shutil.rmtree(simDataDir)
+    if metrics==None:
+        raise RuntimeError('scenario {0} failed'.format(scenario))
+    return metrics
+
+#============================ main ============================================
+
+def parseCliOptions():
+
+    scenarioNames  = [name for (name,_) in getScenarios()]
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument( '--scenarios',
+        dest       = 'scenarios',
+        nargs      = '+',
+        type       = str,
+        default    = scenarioNames,
+        help       = 'Scenarios to run, among {0}.'.format(', '.join(scenarioNames)),
+    )
+    parser.add_argument( '--repeat',
+        dest       = 'repeat',
+        type       = int,
+        default    = 1,
+        help       = 'Runs of each scenario, the results are their median.',
+    )
+    parser.add_argument( '--output',
+        dest       = 'output',
+        type       = str,
+        default    = 'macrobench.json',
+        help       = 'Results file (JSON).',
+    )
+    parser.add_argument( '--baseline',
+        dest       = 'baseline',
+        type       = str,
+        default    = None,
+        help       = 'Results file to compare with, regressions fail the run.',
+    )
+    parser.add_argument( '--threshold',
+        dest       = 'threshold',
+        type       = float,
+        default    = 0.2,
+        help       = 'Relative degradation flagged as a regression in the comparison.',
+    )
+
+    options        = parser.parse_args()
+
+    for name in options.scenarios:
+        if name not in scenarioNames:
+            parser.error('unknown scenario {0}'.format(name))
+
+    return options.__dict__
+
+def main():
+
+    options    = parseCliOptions()
+
+    allResults = {}
+    workDir    = tempfile.mkdtemp(prefix='macrobench')
+    try:
+        for (name,scenario) in getScenarios():
+            if name not in options['scenarios']:
+                continue
+
+            runs = [measureScenario(scenario,workDir) for _ in range(options['repeat'])]
+
+            for (metric,unit,higherIsBetter) in METRICS:
+                result = results.summarize([run[metric] for run in runs],unit,higherIsBetter)
+                result['scenario'] = scenario
+                allResults['{0}/{1}'.format(name,metric)] = result
+
+            print '{0:<25} {1:>8.1f}s {2:>10.0f} ASN/s {3:>10.0f} events/s {4:>8.1f} MB {5:>8.0f} kB'.format(
+                name,
+                *[allResults['{0}/{1}'.format(name,metric)]['value'] for (metric,_,_) in METRICS]
+            )
+    finally:
+        shutil.rmtree(workDir)
+
+    results.writeResults(options['output'],allResults)
+    print 'results written to {0}'.format(options['output'])
+
+    if options['baseline']:
+        (lines,regressions) = results.compareResults(
+            results.readResults(options['baseline']),
+            results.readResults(options['output']),
+            options['threshold'],
+        )
+        print '\n'.join(lines)
+        print '{0} regression(s) beyond {1:.0f}%'.format(len(regressions),100*options['threshold'])
+        if regressions:
+            sys.exit(1)
+
+if __name__=='__main__':
+    main()
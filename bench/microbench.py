@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+'''
+\brief Micro-benchmarks of the simulator hot paths.
+
+Each benchmark times single calls of one hot path on a fixture (see
+fixtures.Fixture) of each network size, reset to its warmed-up state before
+each pass. The results (median wall time per call) are written as JSON and
+optionally compared to a baseline results file; the exit status is non-zero
+on a regression, e.g.
+
+    python bench/microbench.py --output before.json
+    (optimize)
+    python bench/microbench.py --baseline before.json
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+if __name__=='__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from bench         import fixtures,    \
+                          results
+from SimEngine     import SimEngine,   \
+                          SimSettings, \
+                          Propagation, \
+                          Topology,    \
+                          Mote
+
+#============================ defines =========================================
+
+SCHEDULERS         = ['none','cen','opt2','deBras']
+EVENTS_PER_MOTE    = 10   # synthetic events per mote in the engine benchmarks
+T_BUCKETS          = [(0,0),(1,1),(2,3),(4,7),(8,None)] # concurrent transmissions
+MAX_MOTES_PER_PASS = 100  # motes timed per pass in the per-mote benchmarks
+
+#============================ helpers =========================================
+
+class _Noop(object):
+    # bound method callback, as the engine expects
+    def call(self):
+        pass
+
+def timeCall(durations,func,*args):
+    startTime  = time.time()
+    func(*args)
+    durations += [time.time()-startTime]
+
+def sampleMotes(motes):
+    ''' at most MAX_MOTES_PER_PASS of motes, evenly spread over their ids '''
+    step = max(1,len(motes)/MAX_MOTES_PER_PASS)
+    return motes[::step][:MAX_MOTES_PER_PASS]
+
+def getTBucket(numTransmissions):
+    for (low,high) in T_BUCKETS:
+        if numTransmissions>=low and (high==None or numTransmissions<=high):
+            if high==None:
+                return 'T={0}+'.format(low)
+            if low==high:
+                return 'T={0}'.format(low)
+            return 'T={0}-{1}'.format(low,high)
+
+#============================ benchmarks ======================================
+
+# each benchmark runs repeat passes on fixture, and returns
+# {name: [duration of each call]}
+
+def bench_engine(fixture,repeat):
+    engine     = SimEngine.SimEngine()
+    numEvents  = EVENTS_PER_MOTE*fixture.numMotes
+    durations  = {
+        'SimEngine.scheduleAtAsn':   [],
+        'SimEngine.removeEvent':     [],
+        'SimEngine.run':             [],
+    }
+    rng        = random.Random(fixtures.SEED)
+    cb         = _Noop().call
+    for _ in range(repeat):
+
+        # schedule then remove numEvents tagged events, in the real event queue
+        fixture.reset()
+        numSlots   = 10*engine.settings.slotframeLength
+        for i in range(numEvents):
+            timeCall(durations['SimEngine.scheduleAtAsn'],engine.scheduleAtAsn,engine.asn+1+rng.randrange(numSlots),cb,('bench',i),rng.randrange(10))
+        for i in range(numEvents):
+            timeCall(durations['SimEngine.removeEvent'],engine.removeEvent,('bench',i))
+
+        # dispatch numEvents no-op events, alone in the queue
+        fixture.reset()
+        engine.events = [(engine.asn+1+i/EVENTS_PER_MOTE,0,cb,('bench','noop')) for i in range(numEvents)]
+        startTime     = time.time()
+        fixture.advance(numEvents/EVENTS_PER_MOTE+1)
+        durations['SimEngine.run'] += [(time.time()-startTime)/numEvents]*numEvents
+
+    return durations
+
+def bench_propagate(fixture,repeat):
+    durations  = {}
+    propagate  = Propagation.Propagation.propagate
+
+    def timedPropagate(self):
+        name = 'Propagation.propagate/{0}'.format(getTBucket(len(self.transmissions)))
+        if name not in durations:
+            durations[name] = []
+        timeCall(durations[name],propagate,self)
+
+    for _ in range(repeat):
+        fixture.reset()
+        Propagation.Propagation.propagate = timedPropagate
+        try:
+            fixture.advance(SimSettings.SimSettings().slotframeLength)
+        finally:
+            Propagation.Propagation.propagate = propagate
+
+    return durations
+
+def bench_topology(fixture,repeat):
+    durations  = {'Topology.createTopology': []}
+    for _ in range(repeat):
+        fixture.reset()
+        motes = [Mote.Mote(id) for id in range(fixture.numMotes)]
+        timeCall(durations['Topology.createTopology'],Topology.Topology(motes).createTopology)
+    fixture.reset()
+    return durations
+
+def bench_housekeeping(fixture,repeat):
+    durations  = {
+        'Mote._lv_action_housekeeping':  [],
+        'Mote._otf_action_housekeeping': [],
+    }
+    for _ in range(repeat):
+        for name in durations.keys():
+            fixture.reset()
+            for mote in sampleMotes([m for m in SimEngine.SimEngine().motes if not m.dagRoot]):
+                with fixtures.quiet():
+                    timeCall(durations[name],getattr(mote,name.split('.')[1]))
+    return durations
+
+def bench_sixtop(fixture,repeat):
+    engine     = SimEngine.SimEngine()
+    settings   = SimSettings.SimSettings()
+    durations  = {}
+    original   = settings.scheduler
+    for scheduler in SCHEDULERS:
+        name   = 'Mote._sixtop_cell_reservation_request/{0}'.format(scheduler)
+        durations[name] = []
+        for _ in range(repeat):
+            fixture.reset()
+            (engine.scheduler,settings.scheduler) = (scheduler,scheduler)
+            for mote in sampleMotes([m for m in engine.motes if m.preferredParent!=None]):
+                with fixtures.quiet():
+                    timeCall(durations[name],mote._sixtop_cell_reservation_request,mote.preferredParent,1)
+    (engine.scheduler,settings.scheduler) = (original,original)
+    return durations
+
+def bench_stats(fixture,repeat):
+    durations  = {'SimStats._actionEndCycle': []}
+    for _ in range(repeat):
+        fixture.reset()
+        timeCall(durations['SimStats._actionEndCycle'],fixture.simStats._actionEndCycle)
+    return durations
+
+BENCHMARKS         = [
+    bench_engine,
+    bench_propagate,
+    bench_topology,
+    bench_housekeeping,
+    bench_sixtop,
+    bench_stats,
+]
+
+#============================ main ============================================
+
+def parseCliOptions():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument( '--numMotes',
+        dest       = 'numMotes',
+        nargs      = '+',
+        type       = int,
+        default    = [50,200,1000],
+        help       = 'Network sizes of the fixtures.',
+    )
+    parser.add_argument( '--warmupCycles',
+        dest       = 'warmupCycles',
+        type       = int,
+        default    = 3,
+        help       = 'Cycles simulated to build each fixture, before timing (about 2 min per cycle at 1000 motes).',
+    )
+    parser.add_argument( '--repeat',
+        dest       = 'repeat',
+        type       = int,
+        default    = 3,
+        help       = 'Passes of each benchmark, each from the warmed-up fixture.',
+    )
+    parser.add_argument( '--bench',
+        dest       = 'bench',
+        nargs      = '+',
+        type       = str,
+        default    = [func.__name__ for func in BENCHMARKS],
+        help       = 'Benchmarks to run, among {0}.'.format(', '.join([func.__name__ for func in BENCHMARKS])),
+    )
+    parser.add_argument( '--output',
+        dest       = 'output',
+        type       = str,
+        default    = 'microbench.json',
+        help       = 'Results file (JSON).',
+    )
+    parser.add_argument( '--baseline',
+        dest       = 'baseline',
+        type       = str,
+        default    = None,
+        help       = 'Results file to compare with.',
+    )
+    parser.add_argument( '--threshold',
+        dest       = 'threshold',
+        type       = float,
+        default    = 0.2,
+        help       = 'Relative slowdown flagged as a regression in the comparison.',
+    )
+
+    options        = parser.parse_args()
+
+    return options.__dict__
+
+def main():
+
+    options    = parseCliOptions()
+    benchmarks = [func for func in BENCHMARKS if func.__name__ in options['bench']]
+
+    allResults = {}
+    workDir    = tempfile.mkdtemp(prefix='microbench')
+    try:
+        for numMotes in options['numMotes']:
+
+            fixture = fixtures.Fixture(numMotes,workDir,warmupCycles=options['warmupCycles'])
+            print 'fixture of {0} motes: built in {1:.1f}s, warmed up in {2:.1f}s'.format(numMotes,fixture.buildTime,fixture.warmupTime)
+
+            for func in benchmarks:
+                for (name,durations) in sorted(func(fixture,options['repeat']).items()):
+                    if not durations:
+                        continue
+                    result = results.summarize(durations)
+                    result['numMotes'] = numMotes
+                    allResults['{0}/numMotes={1}'.format(name,numMotes)] = result
+                    print '   {0:<50} {1:>12.4g} s/call ({2} calls)'.format(name,result['value'],result['numCalls'])
+
+            fixtures.destroy()
+    finally:
+        shutil.rmtree(workDir)
+
+    results.writeResults(options['output'],allResults)
+    print 'results written to {0}'.format(options['output'])
+
+    if options['baseline']:
+        (lines,regressions) = results.compareResults(
+            results.readResults(options['baseline']),
+            results.readResults(options['output']),
+            options['threshold'],
+        )
+        print '\n'.join(lines)
+        print '{0} regression(s) beyond {1:.0f}%'.format(len(regressions),100*options['threshold'])
+        if regressions:
+            sys.exit(1)
+
+if __name__=='__main__':
+    main()
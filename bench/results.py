@@ -0,0 +1,95 @@
+#!/usr/bin/python
+'''
+\brief Machine-readable benchmark results, and their comparison to a baseline.
+
+A results file is JSON:
+{
+    'meta':    {'time': ..., 'python': ..., 'platform': ..., 'commit': ...},
+    'results': {
+        name: {'value': 1.2e-05, 'unit': 's/call', 'higherIsBetter': False, ...},
+    }
+}
+'''
+
+#============================ imports =========================================
+
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+
+#============================ helpers =========================================
+
+def getMeta():
+    ''' where and on what the results were taken '''
+    try:
+        commit = subprocess.check_output(
+            ['git','rev-parse','HEAD'],
+            cwd    = os.path.dirname(os.path.abspath(__file__)),
+            stderr = open(os.devnull,'w'),
+        ).strip()
+    except (OSError,subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time':        time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python':      sys.version.split()[0],
+        'platform':    platform.platform(),
+        'node':        platform.node(),
+        'commit':      commit,
+    }
+
+def summarize(durations,unit='s/call',higherIsBetter=False):
+    ''' result entry of a list of measurements, valued at their median '''
+    durations = sorted(durations)
+    return {
+        'value':           durations[len(durations)/2],
+        'unit':            unit,
+        'higherIsBetter':  higherIsBetter,
+        'numCalls':        len(durations),
+        'min':             durations[0],
+        'max':             durations[-1],
+        'mean':            sum(durations)/len(durations),
+    }
+
+def writeResults(filename,results):
+    with open(filename,'w') as f:
+        json.dump({'meta': getMeta(),'results': results},f,indent=4,sort_keys=True)
+
+def readResults(filename):
+    with open(filename,'r') as f:
+        return json.load(f)
+
+def compareResults(baseline,current,threshold):
+    '''
+    compare the results present in both files.
+
+    A result regresses when it is worse than its baseline by more than
+    threshold (relative, e.g. 0.2 for 20%). Returns (lines,regressions), the
+    comparison table and the names of the results which regressed.
+    '''
+    lines       = []
+    regressions = []
+    for name in sorted(current['results'].keys()):
+        if name not in baseline['results']:
+            continue
+        cur     = current['results'][name]
+        base    = baseline['results'][name]
+        if not base['value']:
+            continue
+        ratio   = float(cur['value'])/base['value']
+        if cur['higherIsBetter']:
+            worse = ratio<1.0/(1+threshold)
+        else:
+            worse = ratio>1+threshold
+        if worse:
+            regressions += [name]
+        lines  += ['{0:<50} {1:>12.4g} {2:>12.4g} {3:>7.2f}x{4}'.format(
+            name,
+            base['value'],
+            cur['value'],
+            ratio,
+            '  REGRESSION' if worse else '',
+        )]
+    return (lines,regressions)
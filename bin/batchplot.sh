@@ -38,7 +38,7 @@ do
  #           topTxRelocatedCells 
  #           txQueueFill 
         )
-        printf "%s\n" "${params[@]}" | parallel python ../plotAveStatsVsCycles.py --statsName
+        python ../plotAveStatsVsCycles.py --statsName "${params[@]}"
 
 
     )
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+'''
+\brief Merge the cProfile statistics of a batch of runs.
+
+Collects the .pstats files written by runSimOneCPU --profile (also through
+runSimAllCPUs.py, one per cpuID, parameter combination and run) under the
+given directories, and writes:
+- a report of the merged statistics, sorted (--sortBy);
+- the merged statistics in collapsed-stack format, one 'f1;f2;f3 time' line
+  per call path, for flamegraph.pl or speedscope.
+
+cProfile only records caller/callee pairs, so the call paths are rebuilt by
+splitting the time of each function among its callers, in proportion to the
+time each caller spent in it.
+'''
+
+#============================ imports =========================================
+
+import os
+import sys
+import pstats
+import argparse
+
+#============================ defines =========================================
+
+MIN_PATH_TIME     = 1e-5 # s, call paths below are left out of the collapsed stacks
+
+#============================ helpers =========================================
+
+def findProfiles(paths):
+    ''' the .pstats files in paths (files or directories, searched recursively) '''
+    profileFiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (dirpath,_,filenames) in os.walk(path):
+                profileFiles += [os.path.join(dirpath,f) for f in filenames if f.endswith('.pstats')]
+        else:
+            profileFiles += [path]
+    return sorted(profileFiles)
+
+def getLabel(func):
+    (filename,lineno,name) = func
+    if filename=='~':
+        # built-in, e.g. "<method 'pop' of 'list' objects>"
+        label = name
+    else:
+        label = '{0} ({1}:{2})'.format(name,os.path.basename(filename),lineno)
+    return label.replace(';',',')
+
+def getCollapsedStacks(stats):
+    '''
+    the call paths of stats, as a list of (labels,selfTime).
+
+    A function reached through a path gets the share of its total time which
+    its caller (on that path) spent in it; its own time and the time of its
+    callees are scaled by that share.
+    '''
+    callees      = {}
+    for (func,(_,_,_,_,callers)) in stats.stats.items():
+        for (caller,(_,_,_,ct)) in callers.items():
+            callees.setdefault(caller,[]).append((func,ct))
+    roots        = [func for (func,(_,_,_,_,callers)) in stats.stats.items() if not callers]
+
+    stacks       = []
+    def walk(func,path,share):
+        tt        = stats.stats[func][2]
+        path      = path+[func]
+        if tt*share>=MIN_PATH_TIME:
+            stacks.append(([getLabel(f) for f in path],tt*share))
+        for (callee,edgeCt) in callees.get(func,[]):
+            # recursion, the callee's time is already counted on this path
+            if callee in path:
+                continue
+            calleeCt  = stats.stats[callee][3]
+            if not calleeCt or edgeCt*share<MIN_PATH_TIME:
+                continue
+            walk(callee,path,share*edgeCt/calleeCt)
+
+    recursionLimit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursionLimit,10000))
+    try:
+        for root in sorted(roots):
+            walk(root,[],1.0)
+    finally:
+        sys.setrecursionlimit(recursionLimit)
+
+    return stacks
+
+def writeReport(stats,profileFiles,sortBy,limit,filename):
+    with open(filename,'w') as f:
+        f.write('merged profile of {0} run(s):\n'.format(len(profileFiles)))
+        for profileFile in profileFiles:
+            f.write('    {0}\n'.format(profileFile))
+        stats.stream = f
+        stats.sort_stats(sortBy).print_stats(limit)
+
+def writeCollapsed(stats,filename):
+    with open(filename,'w') as f:
+        for (labels,selfTime) in getCollapsedStacks(stats):
+            # integer microseconds, as flamegraph.pl expects integer counts
+            f.write('{0} {1}\n'.format(';'.join(labels),int(round(1e6*selfTime))))
+
+#============================ main ============================================
+
+def parseCliOptions():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument( 'paths',
+        nargs      = '*',
+        type       = str,
+        default    = ['simData'],
+        help       = '.pstats files, or directories to search for them.',
+    )
+    parser.add_argument( '--sortBy',
+        dest       = 'sortBy',
+        type       = str,
+        default    = 'cumulative',
+        help       = 'Sort key of the report, as pstats.Stats.sort_stats (e.g. cumulative, tottime, ncalls).',
+    )
+    parser.add_argument( '--limit',
+        dest       = 'limit',
+        type       = int,
+        default    = 50,
+        help       = 'Number of functions in the report.',
+    )
+    parser.add_argument( '--report',
+        dest       = 'report',
+        type       = str,
+        default    = 'profile_report.txt',
+        help       = 'Report file.',
+    )
+    parser.add_argument( '--collapsed',
+        dest       = 'collapsed',
+        type       = str,
+        default    = 'profile.collapsed',
+        help       = 'Collapsed-stack file, for flamegraph.pl.',
+    )
+
+    options        = parser.parse_args()
+
+    return options.__dict__
+
+def main():
+
+    options      = parseCliOptions()
+
+    profileFiles = findProfiles(options['paths'])
+    if not profileFiles:
+        print 'no .pstats file found in {0}'.format(', '.join(options['paths']))
+        sys.exit(1)
+
+    stats        = pstats.Stats(*profileFiles)
+
+    writeReport(stats,profileFiles,options['sortBy'],options['limit'],options['report'])
+    writeCollapsed(stats,options['collapsed'])
+    print 'merged {0} profile(s) into {1} and {2}'.format(len(profileFiles),options['report'],options['collapsed'])
+
+if __name__=='__main__':
+    main()
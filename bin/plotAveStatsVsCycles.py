@@ -35,6 +35,9 @@ import scipy.stats
 import logging.config
 import matplotlib.pyplot
 import argparse
+import multiprocessing
+
+import plotStuff
 
 #============================ defines =========================================
 
@@ -91,6 +94,20 @@ def parseCliOptions():
         help       = 'Name of the statistics to be used as y axis.',
     )
     
+    parser.add_argument( '--numProcs',
+        dest       = 'numProcs',
+        type       = int,
+        default    = multiprocessing.cpu_count(),
+        help       = 'Number of figures rendered in parallel.',
+    )
+    
+    parser.add_argument( '--force',
+        dest       = 'force',
+        action     = 'store_true',
+        default    = False,
+        help       = 'Re-render figures even if their data did not change.',
+    )
+    
     options        = parser.parse_args()
     
     return options.__dict__
@@ -101,7 +118,7 @@ def plot_statsVsCycle(statsName):
     
     dataDirs = []
     for dataDir in os.listdir(os.path.curdir):
-        if os.path.isdir(dataDir):
+        if os.path.isdir(dataDir) and not dataDir.startswith('.'): # skip plotStuff.CACHEDIR
             if (statsName == 'probableCollisions' or statsName == 'effectiveCollidedTxs') and dataDir=='no interference':
                 continue
             dataDirs += [dataDir]
@@ -116,48 +133,36 @@ def plot_statsVsCycle(statsName):
             
         for infilename in glob.glob(os.path.join(dataDir,'*.dat')):
             
+            parsed  = plotStuff.loadDataFile(infilename)
+            columns = parsed['columns']
+            
             # find numCyclesPerRun    
-            with open(infilename,'r') as f:
-                for line in f:
+            for line in parsed['header']:
+                
+                if line.startswith('##'):
                     
-                    if line.startswith('##'):
-                        
-                        # numCyclesPerRun
-                        m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
-                        if m:
-                            numCyclesPerRun    = int(m.group(1))
+                    # numCyclesPerRun
+                    m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
+                    if m:
+                        numCyclesPerRun    = int(m.group(1))
             
-            # find colnumcycle
-            with open(infilename,'r') as f:
-                for line in f:
-                    if line.startswith('# '):
-                        elems                   = re.sub(' +',' ',line[2:]).split()
-                        numcols                 = len(elems)
-                        colnumstatsName         = elems.index(statsName)
-                        colnumcycle             = elems.index('cycle')
-                        colnumrunNum            = elems.index('runNum')                
-                        break
-                
             # parse data
             statsPerFile = {}
             previousCycle  = None
-            with open(infilename,'r') as f:
-                for line in f:
-                    if line.startswith('#') or not line.strip():
-                        continue
-                    m = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-                    stat                = float(m.group(colnumstatsName+1))
-                    cycle               = float(m.group(colnumcycle+1))
-                    runNum              = float(m.group(colnumrunNum+1))
+            for (stat,cycle,runNum) in zip(
+                    numpy.asarray(columns[statsName],dtype=float).tolist(),
+                    numpy.asarray(columns['cycle'],dtype=float).tolist(),
+                    numpy.asarray(columns['runNum'],dtype=float).tolist(),
+                ):
+                
+                if cycle not in statsPerFile:
+                     statsPerFile[cycle] = []
+                statsPerFile[cycle] += [stat]
                     
-                    if cycle not in statsPerFile:
-                         statsPerFile[cycle] = []
-                    statsPerFile[cycle] += [stat]
-                        
-                    if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
-                        print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
-                        
-                    previousCycle = cycle
+                if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
+                    print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
+                    
+                previousCycle = cycle
                         
                                     
             stats[dataDir] = statsPerFile
@@ -197,7 +202,7 @@ def plot_droppedPacketsVsCycle():
     
     dataDirs = []
     for dataDir in os.listdir(os.path.curdir):
-        if os.path.isdir(dataDir):
+        if os.path.isdir(dataDir) and not dataDir.startswith('.'): # skip plotStuff.CACHEDIR
             dataDirs += [dataDir]
     
     stats      = {}
@@ -210,50 +215,37 @@ def plot_droppedPacketsVsCycle():
             
         for infilename in glob.glob(os.path.join(dataDir,'*.dat')):
             
+            parsed  = plotStuff.loadDataFile(infilename)
+            columns = parsed['columns']
+            
             # find numCyclesPerRun    
-            with open(infilename,'r') as f:
-                for line in f:
+            for line in parsed['header']:
+                
+                if line.startswith('##'):
                     
-                    if line.startswith('##'):
-                        
-                        # numCyclesPerRun
-                        m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
-                        if m:
-                            numCyclesPerRun    = int(m.group(1))
+                    # numCyclesPerRun
+                    m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
+                    if m:
+                        numCyclesPerRun    = int(m.group(1))
             
-            # find colnumcycle
-            with open(infilename,'r') as f:
-                for line in f:
-                    if line.startswith('# '):
-                        elems                         = re.sub(' +',' ',line[2:]).split()
-                        numcols                       = len(elems)
-                        colnumdroppedAppFailedEnqueue = elems.index('droppedAppFailedEnqueue')
-                        colnumdroppedMacRetries       = elems.index('droppedMacRetries')
-                        colnumcycle                   = elems.index('cycle')
-                        colnumrunNum                  = elems.index('runNum')                
-                        break
-                
             # parse data
             statsPerFile = {}
             previousCycle  = None
-            with open(infilename,'r') as f:
-                for line in f:
-                    if line.startswith('#') or not line.strip():
-                        continue
-                    m = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-                    droppedAppFailedEnqueue = int(m.group(colnumdroppedAppFailedEnqueue+1))
-                    droppedMacRetries       = int(m.group(colnumdroppedMacRetries+1))
-                    cycle                   = int(m.group(colnumcycle+1))
-                    runNum                  = int(m.group(colnumrunNum+1))
+            for (droppedAppFailedEnqueue,droppedMacRetries,cycle,runNum) in zip(
+                    numpy.asarray(columns['droppedAppFailedEnqueue'],dtype=int).tolist(),
+                    numpy.asarray(columns['droppedMacRetries'],dtype=int).tolist(),
+                    numpy.asarray(columns['cycle'],dtype=int).tolist(),
+                    numpy.asarray(columns['runNum'],dtype=int).tolist(),
+                ):
+                
+                if cycle not in statsPerFile:
+                     statsPerFile[cycle] = []
+                statsPerFile[cycle] += [droppedAppFailedEnqueue+droppedMacRetries]
                     
-                    if cycle not in statsPerFile:
-                         statsPerFile[cycle] = []
-                    statsPerFile[cycle] += [droppedAppFailedEnqueue+droppedMacRetries]
-                        
-                    if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
-                        print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
-                        
-                    previousCycle = cycle
+                if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
+                    print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
+                    
+                previousCycle = cycle
                         
                                     
             stats[dataDir] = statsPerFile
@@ -281,7 +273,7 @@ def plot_topHousekeepingSignalingVsCycle():
     
     dataDirs = []
     for dataDir in os.listdir(os.path.curdir):
-        if os.path.isdir(dataDir):
+        if os.path.isdir(dataDir) and not dataDir.startswith('.'): # skip plotStuff.CACHEDIR
             if dataDir=='no housekeeping' or dataDir=='no interference':
                 continue
             dataDirs += [dataDir]
@@ -296,59 +288,44 @@ def plot_topHousekeepingSignalingVsCycle():
             
         for infilename in glob.glob(os.path.join(dataDir,'*.dat')):
             
+            parsed  = plotStuff.loadDataFile(infilename)
+            columns = parsed['columns']
+            
             # find numCyclesPerRun    
-            with open(infilename,'r') as f:
-                for line in f:
+            for line in parsed['header']:
+                
+                if line.startswith('##'):
                     
-                    if line.startswith('##'):
-                        
-                        # numCyclesPerRun
-                        m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
-                        if m:
-                            numCyclesPerRun    = int(m.group(1))
+                    # numCyclesPerRun
+                    m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
+                    if m:
+                        numCyclesPerRun    = int(m.group(1))
             
-            # find colnumcycle
-            with open(infilename,'r') as f:
-                for line in f:
-                    if line.startswith('# '):
-                        elems                         = re.sub(' +',' ',line[2:]).split()
-                        numcols                       = len(elems)
-                        colnumtopTxRelocatedCells     = elems.index('topTxRelocatedCells')
-                        colnumtopTxRelocatedBundles   = elems.index('topTxRelocatedBundles')
-                        colnumcycle                   = elems.index('cycle')
-                        colnumrunNum                  = elems.index('runNum')                
-                        colnumtopRxRelocatedCells     = None
-                        if 'topRxRelocatedCells' in elems:
-                            colnumtopRxRelocatedCells       = elems.index('topRxRelocatedCells')
-
-                        break
+            # topRxRelocatedCells is missing from older data files
+            if 'topRxRelocatedCells' in columns:
+                topRxRelocatedCellsCol  = numpy.asarray(columns['topRxRelocatedCells'],dtype=int).tolist()
+            else:
+                topRxRelocatedCellsCol  = [0]*len(columns['cycle'])
                 
             # parse data
             statsPerFile = {}
             previousCycle  = None
-            with open(infilename,'r') as f:
-                for line in f:
-                    if line.startswith('#') or not line.strip():
-                        continue
-                    m = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-                    topTxRelocatedCells     = int(m.group(colnumtopTxRelocatedCells+1))
-                    topTxRelocatedBundles   = int(m.group(colnumtopTxRelocatedBundles+1))
-                    
-                    topRxRelocatedCells     = 0
-                    if colnumtopRxRelocatedCells:
-                        topRxRelocatedCells     = int(m.group(colnumtopRxRelocatedCells+1))
+            for (topTxRelocatedCells,topTxRelocatedBundles,topRxRelocatedCells,cycle,runNum) in zip(
+                    numpy.asarray(columns['topTxRelocatedCells'],dtype=int).tolist(),
+                    numpy.asarray(columns['topTxRelocatedBundles'],dtype=int).tolist(),
+                    topRxRelocatedCellsCol,
+                    numpy.asarray(columns['cycle'],dtype=int).tolist(),
+                    numpy.asarray(columns['runNum'],dtype=int).tolist(),
+                ):
+                
+                if cycle not in statsPerFile:
+                     statsPerFile[cycle] = []
+                statsPerFile[cycle] += [PACKETS_PER_SIGNALING*(topTxRelocatedCells+topTxRelocatedBundles+topRxRelocatedCells)]
                     
-                    cycle                   = int(m.group(colnumcycle+1))
-                    runNum                  = int(m.group(colnumrunNum+1))
+                if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
+                    print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
                     
-                    if cycle not in statsPerFile:
-                         statsPerFile[cycle] = []
-                    statsPerFile[cycle] += [PACKETS_PER_SIGNALING*(topTxRelocatedCells+topTxRelocatedBundles+topRxRelocatedCells)]
-                        
-                    if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
-                        print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
-                        
-                    previousCycle = cycle
+                previousCycle = cycle
                         
                                     
             stats[dataDir] = statsPerFile
@@ -459,8 +436,7 @@ def genStatsVsCyclePlots(vals, dirs, outfilename, xlabel, ylabel, xmin=False, xm
     if ymax:
         matplotlib.pyplot.ylim(ymax=ymax)
 
-    matplotlib.pyplot.savefig(outfilename + '.png')
-    matplotlib.pyplot.savefig(outfilename + '.eps')    
+    plotStuff.saveFigure(outfilename)
     matplotlib.pyplot.close('all')
     
     # print
@@ -473,15 +449,29 @@ def main():
     options      = parseCliOptions()
     statsName    = options['statsName']
     
+    # load all data files once, before forking the renderers
+    infilenames  = glob.glob(os.path.join('*','*.dat'))
+    for infilename in infilenames:
+        plotStuff.loadDataFile(infilename)
+    
+    tasks        = []
     for statsName in options['statsName']:
         # stats vs cycle
-        plot_statsVsCycle(statsName)
+        tasks   += [('statsVsCycle_{0}'.format(statsName),plot_statsVsCycle,(statsName,))]
     
     # plot dropped packets vs cycle
-    plot_droppedPacketsVsCycle()
+    tasks       += [('droppedPacketsVsCycle',plot_droppedPacketsVsCycle,())]
     
     # plot singaling for 6top housekeeping vs cycle
-    plot_topHousekeepingSignalingVsCycle()
+    tasks       += [('topHousekeepingSignalingVsCycle',plot_topHousekeepingSignalingVsCycle,())]
+    
+    # the figures also depend on the helpers of plotStuff (source, not .pyc)
+    plotStuff.renderFigures(
+        tasks,
+        infilenames+[__file__,os.path.splitext(plotStuff.__file__)[0]+'.py'],
+        numProcs = options['numProcs'],
+        force    = options['force'],
+    )
     
 if __name__=="__main__":
     main()
@@ -36,6 +36,8 @@ import logging.config
 import matplotlib.pyplot
 import argparse
 
+import plotStuff
+
 #============================ defines =========================================
 
 CONFINT         = 0.95
@@ -69,6 +71,33 @@ ECOLORS= [
    '#ff0000', #'r'
 ]
 
+#============================ helpers =========================================
+
+def readHeaderValue(parsed,regex,convert=float):
+    ''' the value of the last header line of parsed matching regex, None if none '''
+    value = None
+    for line in parsed['header']:
+        m = re.search(regex+'\s+=\s+([\.0-9]+)',line)
+        if m:
+            value = convert(m.group(1))
+    return value
+
+def loadRuns(infilepath,numCyclesPerRun):
+    '''
+    the columns of infilepath (see plotStuff.loadDataFile), and the slices of
+    its complete runs, the incomplete ones being skipped.
+    '''
+    columns = plotStuff.loadDataFile(infilepath)['columns']
+    cycles  = numpy.asarray(columns['cycle'],dtype=int)
+    starts  = numpy.flatnonzero(cycles==0).tolist()
+    runs    = []
+    for (start,end) in zip(starts,starts[1:]+[len(cycles)]):
+        if cycles[end-1]!=numCyclesPerRun-1:
+            print 'runNum({0}) in {1} is incomplete data'.format(int(columns['runNum'][start]),os.path.dirname(infilepath))
+            continue
+        runs += [slice(start,end)]
+    return (columns,runs)
+
 #============================ body ============================================
 
 def parseCliOptions():
@@ -99,7 +128,7 @@ def plot_reliability(elemName):
     
     dataSetDirs = []
     for dataSetDir in os.listdir(os.path.curdir):
-        if os.path.isdir(dataSetDir):
+        if os.path.isdir(dataSetDir) and not dataSetDir.startswith('.'):
             dataSetDirs += [dataSetDir]
     
     reliabilities      = {}
@@ -176,75 +205,27 @@ def plot_reliability(elemName):
 def calcReliability(dir,infilename,elemName):
     
     infilepath     = os.path.join(dir,infilename)
-        
-    # find xAxis, numCyclesPerRun    
-    with open(infilepath,'r') as f:
-        for line in f:
-            
-            if line.startswith('##'):
-                
-                # elem
-                m = re.search(elemName+'\s+=\s+([\.0-9]+)',line)
-                if m:
-                    elem               = float(m.group(1))
-                
-                # numCyclesPerRun
-                m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
-                if m:
-                    numCyclesPerRun    = int(m.group(1))
+    parsed         = plotStuff.loadDataFile(infilepath)
     
-    # find appGenerated, appReachesDagroot, txQueueFill, colnumcycle
-    with open(infilepath,'r') as f:
-        for line in f:
-            if line.startswith('# '):
-                elems                   = re.sub(' +',' ',line[2:]).split()
-                numcols                 = len(elems)
-                colnumappGenerated      = elems.index('appGenerated')
-                colnumappReachesDagroot = elems.index('appReachesDagroot')
-                colnumtxQueueFill       = elems.index('txQueueFill')
-                colnumcycle             = elems.index('cycle')
-                colnumrunNum            = elems.index('runNum')                
-                break
+    # find xAxis, numCyclesPerRun
+    elem           = readHeaderValue(parsed,elemName)
+    numCyclesPerRun = readHeaderValue(parsed,'numCyclesPerRun',int)
         
     assert numCyclesPerRun > START_CYCLE
     
-    # parse data
+    (columns,runs) = loadRuns(infilepath,numCyclesPerRun)
+    
+    # packets generated after START_CYCLE, and still in the queues at its start
     reliabilities  = []
-    totalGenerated = 0
-    totalReaches   = 0
-    previousCycle  = None
-    with open(infilepath,'r') as f:
-        for line in f:
-            if line.startswith('#') or not line.strip():
-                continue
-            m = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-            appGenerated        = int(m.group(colnumappGenerated+1))
-            appReachesDagroot   = int(m.group(colnumappReachesDagroot+1))
-            txQueueFill         = int(m.group(colnumtxQueueFill+1))      
-            cycle               = int(m.group(colnumcycle+1))
-            runNum              = int(m.group(colnumrunNum+1))
-            
-            if cycle==START_CYCLE-1:
-                initTxQueueFill     = txQueueFill
-                
-            if cycle>=START_CYCLE:
-                totalGenerated     += appGenerated
-                totalReaches       += appReachesDagroot
-            
-            if cycle == numCyclesPerRun-1:
-                if START_CYCLE==0:
-                    initTxQueueFill = 0
-                reliabilities  += [float(totalReaches)/float(totalGenerated+initTxQueueFill-txQueueFill)]
-                totalGenerated  = 0
-                totalReaches    = 0
-            
-            if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
-                print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
-                # initialize counters and skip the incomplete data
-                totalGenerated  = appGenerated
-                totalReaches    = appReachesDagroot
-                
-            previousCycle = cycle
+    for run in runs:
+        cycles              = columns['cycle'][run]
+        txQueueFill         = columns['txQueueFill'][run]
+        measured            = cycles>=START_CYCLE
+        totalGenerated      = columns['appGenerated'][run][measured].sum()
+        totalReaches        = columns['appReachesDagroot'][run][measured].sum()
+        initTxQueueFill     = txQueueFill[cycles==START_CYCLE-1].sum() if START_CYCLE else 0
+        reliabilities      += [float(totalReaches)/float(totalGenerated+initTxQueueFill-txQueueFill[-1])]
+    
     return elem, reliabilities
 
 #===== battery life
@@ -253,7 +234,7 @@ def plot_batteryLife(elemName):
 
     dataSetDirs = []
     for dataSetDir in os.listdir(os.path.curdir):
-        if os.path.isdir(dataSetDir):
+        if os.path.isdir(dataSetDir) and not dataSetDir.startswith('.'):
             dataSetDirs += [dataSetDir]
 
     # verify there is some data to plot
@@ -312,26 +293,13 @@ def calcBatteryLife(dir,infilename,elemName):
     CAPACITY = 2200 # in mAh
     
     infilepath     = os.path.join(dir,infilename)
+    parsed         = plotStuff.loadDataFile(infilepath)
 
-    with open(infilepath,'r') as f:
-        for line in f:
-            
-            if line.startswith('##'):
-                # elem
-                m = re.search(elemName+'\s+=\s+([\.0-9]+)',line)
-                if m:
-                    elem               = float(m.group(1))
-
-                # slotDuration
-                m = re.search('slotDuration\s+=\s+([\.0-9]+)',line)
-                if m:
-                    slotDuration       = float(m.group(1))
-
-                # slotframeLength
-                m = re.search('slotframeLength\s+=\s+([\.0-9]+)',line)
-                if m:
-                    slotframeLength    = int(m.group(1))
-        
+    elem           = readHeaderValue(parsed,elemName)
+    slotDuration   = readHeaderValue(parsed,'slotDuration')
+    slotframeLength = readHeaderValue(parsed,'slotframeLength',int)
+    
+    # the per-mote charges are not a column, read them from the text
     minBatteryLives = []
     with open(infilepath,'r') as f:
         for line in f:
@@ -359,7 +327,7 @@ def plot_latency(elemName):
         
     dataSetDirs = []
     for dataSetDir in os.listdir(os.path.curdir):
-        if os.path.isdir(dataSetDir):
+        if os.path.isdir(dataSetDir) and not dataSetDir.startswith('.'):
             dataSetDirs += [dataSetDir]
 
     # verify there is some data to plot
@@ -417,71 +385,22 @@ def plot_latency(elemName):
 def calcLatency(dir,infilename,elemName):
 
     infilepath     = os.path.join(dir,infilename)
+    parsed         = plotStuff.loadDataFile(infilepath)
 
-    with open(infilepath,'r') as f:
-        for line in f:
-            
-            if line.startswith('##'):
-
-                # elem
-                m = re.search(elemName+'\s+=\s+([\.0-9]+)',line)
-                if m:
-                    elem               = float(m.group(1))
-                
-                # numCyclesPerRun
-                m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
-                if m:
-                    numCyclesPerRun    = int(m.group(1))
+    elem           = readHeaderValue(parsed,elemName)
+    numCyclesPerRun = readHeaderValue(parsed,'numCyclesPerRun',int)
 
     assert numCyclesPerRun > START_CYCLE
     
-    # find appReachesDagroot, aveLatency
-    with open(infilepath,'r') as f:
-        for line in f:
-            if line.startswith('# '):
-                elems                   = re.sub(' +',' ',line[2:]).split()
-                numcols                 = len(elems)
-                colnumappReachesDagroot = elems.index('appReachesDagroot')
-                colnumaveLatency        = elems.index('aveLatency')
-                colnumcycle             = elems.index('cycle')
-                colnumrunNum            = elems.index('runNum')                
-                break
-    
-    assert colnumappReachesDagroot
-    assert colnumaveLatency
-    assert colnumcycle
-    
-    # parse data
+    (columns,runs) = loadRuns(infilepath,numCyclesPerRun)
+    
+    # average over the packets reaching the root after START_CYCLE
     latencies              = []
-    sumaveLatency          = 0
-    sumappReachesDagroot   = 0
-    previousCycle          = None
-    with open(infilepath,'r') as f:
-        for line in f:
-            if line.startswith('#') or not line.strip():
-                continue
-            m                          = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-            appReachesDagroot          = int(m.group(colnumappReachesDagroot+1))
-            aveLatency                 = float(m.group(colnumaveLatency+1))      
-            cycle                      = int(m.group(colnumcycle+1))
-            runNum                     = int(m.group(colnumrunNum+1))
-            
-            if cycle>=START_CYCLE:
-                sumappReachesDagroot      += appReachesDagroot
-                sumaveLatency             += aveLatency*appReachesDagroot
-            
-            if cycle == numCyclesPerRun-1:
-                latencies             += [sumaveLatency/sumappReachesDagroot]
-                sumaveLatency          = 0
-                sumappReachesDagroot   = 0
-
-            if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
-                print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
-                # initialize counters and skip incomplete data
-                sumaveLatency          = appReachesDagroot
-                sumappReachesDagroot   = aveLatency*appReachesDagroot
-                
-            previousCycle = cycle
+    for run in runs:
+        measured               = columns['cycle'][run]>=START_CYCLE
+        appReachesDagroot      = columns['appReachesDagroot'][run][measured]
+        aveLatency             = columns['aveLatency'][run][measured]
+        latencies             += [float(numpy.dot(aveLatency,appReachesDagroot))/appReachesDagroot.sum()]
             
     return elem, latencies
 
@@ -491,7 +410,7 @@ def plot_statsOfLastCycle(elemName,statsName):
     
     dataSetDirs = []
     for dataSetDir in os.listdir(os.path.curdir):
-        if os.path.isdir(dataSetDir):
+        if os.path.isdir(dataSetDir) and not dataSetDir.startswith('.'):
             dataSetDirs += [dataSetDir]
     
     stats      = {}
@@ -551,52 +470,16 @@ def plot_statsOfLastCycle(elemName,statsName):
 def calcStatsOfLastCycle(dir,infilename,elemName,statsName):
     
     infilepath     = os.path.join(dir,infilename)
+    parsed         = plotStuff.loadDataFile(infilepath)
     
-    # find xAxis, numCyclesPerRun    
-    with open(infilepath,'r') as f:
-        for line in f:
-            
-            if line.startswith('##'):
-                
-                # elem
-                m = re.search(elemName+'\s+=\s+([\.0-9]+)',line)
-                if m:
-                    elem               = float(m.group(1))
-                
-                # numCyclesPerRun
-                m = re.search('numCyclesPerRun\s+=\s+([\.0-9]+)',line)
-                if m:
-                    numCyclesPerRun    = int(m.group(1))
+    # find xAxis, numCyclesPerRun
+    elem           = readHeaderValue(parsed,elemName)
+    numCyclesPerRun = readHeaderValue(parsed,'numCyclesPerRun',int)
     
-    # find colnumcycle
-    with open(infilepath,'r') as f:
-        for line in f:
-            if line.startswith('# '):
-                elems                   = re.sub(' +',' ',line[2:]).split()
-                numcols                 = len(elems)
-                colnumstatsName         = elems.index(statsName)
-                colnumcycle             = elems.index('cycle')
-                colnumrunNum            = elems.index('runNum')                
-                break
-        
-    # parse data
-    stats = []
-    previousCycle  = None
-    with open(infilepath,'r') as f:
-        for line in f:
-            if line.startswith('#') or not line.strip():
-                continue
-            m = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-            stat                = int(m.group(colnumstatsName+1))
-            cycle               = int(m.group(colnumcycle+1))
-            runNum              = int(m.group(colnumrunNum+1))
-            if cycle == numCyclesPerRun-1:
-                stats += [stat]
-
-            if cycle==0 and previousCycle and previousCycle!=numCyclesPerRun-1:
-                print 'runNum({0}) in {1} is incomplete data'.format(runNum-1,dir)
-                
-            previousCycle = cycle
+    (columns,runs) = loadRuns(infilepath,numCyclesPerRun)
+    
+    # value at the last cycle of each run
+    stats = [int(columns[statsName][run][-1]) for run in runs]
     
     return elem, stats
 
@@ -10,8 +10,13 @@
 
 import os
 import re
+import json
 import glob
 import pprint
+import hashlib
+import cPickle
+import argparse
+import multiprocessing
 
 import numpy
 import scipy
@@ -22,6 +27,9 @@ import matplotlib.pyplot
 #============================ defines =========================================
 
 DATADIR       = '.'
+CACHEDIR      = '.parsedcache' # under DATADIR
+RENDERSTAMPS  = 'rendered.json' # under CACHEDIR
+FORMATS       = ['png','eps']
 CONFINT       = 0.95
 
 COLORS_TH     = {
@@ -95,40 +103,39 @@ def binDataFiles():
 
     dataBins       = {}
     for infilepath in infilepaths:
-        with open(infilepath,'r') as f:
-            for line in f:
-                if not line.startswith('## ') or not line.strip():
-                    continue
-                # otfThreshold
-                m = re.search('otfThreshold\s+=\s+([\.0-9]+)',line)
-                if m:
-                    otfThreshold = int(m.group(1))
-                # pkPeriod
-                m = re.search('pkPeriod\s+=\s+([\.0-9]+)',line)
-                if m:
-                    pkPeriod     = float(m.group(1))
-                else:
-                    pkPeriod     = 'NA'
-                # algorithm
-                m = re.search('algorithm\s+=\s+(.+)',line)
-                if m:
-                    algorithm    = m.group(1)
-                # buffer
-                m = re.search('buffer_([^_]+)',infilepath)
-                if m:
-                    buffer_size  = int(m.group(1))
-                # parents
-                m = re.search('parents_([^_/]+)',infilepath)
-                if m:
-                    parent_size      = int(m.group(1))
-                # numPacketsBurst
-                m = re.search('numPacketsBurst_([^_]+)',infilepath)
-                if m:
-                    numPacketsBurst  = int(m.group(1))
-
-            if (otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst) not in dataBins:
-                dataBins[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = []
-            dataBins[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] += [infilepath]
+        for line in loadDataFile(infilepath)['header']:
+            if not line.startswith('## ') or not line.strip():
+                continue
+            # otfThreshold
+            m = re.search('otfThreshold\s+=\s+([\.0-9]+)',line)
+            if m:
+                otfThreshold = int(m.group(1))
+            # pkPeriod
+            m = re.search('pkPeriod\s+=\s+([\.0-9]+)',line)
+            if m:
+                pkPeriod     = float(m.group(1))
+            else:
+                pkPeriod     = 'NA'
+            # algorithm
+            m = re.search('algorithm\s+=\s+(.+)',line)
+            if m:
+                algorithm    = m.group(1)
+            # buffer
+            m = re.search('buffer_([^_]+)',infilepath)
+            if m:
+                buffer_size  = int(m.group(1))
+            # parents
+            m = re.search('parents_([^_/]+)',infilepath)
+            if m:
+                parent_size      = int(m.group(1))
+            # numPacketsBurst
+            m = re.search('numPacketsBurst_([^_]+)',infilepath)
+            if m:
+                numPacketsBurst  = int(m.group(1))
+
+        if (otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst) not in dataBins:
+            dataBins[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = []
+        dataBins[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] += [infilepath]
 
     output  = []
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),filepaths) in dataBins.items():
@@ -140,111 +147,232 @@ def binDataFiles():
     # print "OUTPUT: %s" % output
     return dataBins
 
-def gatherPerRunData(infilepaths,elemName):
+#===== loading
 
-    valuesPerRun = {}
-    for infilepath in infilepaths:
+def getColumnsDir(infilepath):
+    '''
+    directory holding the columnar copy of a .dat file (written with
+    --binaryStats), or None if there is none, or it does not hold all the
+    runs of the .dat file (see SimStats.StatsColumnWriter).
+    '''
+    dirname = os.path.splitext(infilepath)[0]+'.columns'
+    try:
+        with open(os.path.join(dirname,'header.json'),'r') as f:
+            header = json.load(f)
+    except (IOError,ValueError):
+        return None
+    datSizes = header.get('datSizes')
+    if header.get('partial') or not datSizes or datSizes[-1]!=os.path.getsize(infilepath):
+        return None
+    return dirname
+
+def loadColumns(dirname):
+    '''
+    memory-map all the columns of a columnar results directory.
+
+    Returns a dictionary of format:
+    {
+        elemName: numpy array (one entry per cycle, all runs),
+    }
+    '''
+    with open(os.path.join(dirname,'header.json'),'r') as f:
+        header = json.load(f)
+    numRows = sum([n for (_,_,n) in header['runs']])
+    columns = {}
+    for elemName in header['columns']:
+        if numRows:
+            # the rows listed in the header, the file may go on
+            columns[elemName] = numpy.memmap(os.path.join(dirname,'{0}.bin'.format(elemName)),dtype=header['dtype'],mode='r',shape=(numRows,))
+        else:
+            columns[elemName] = numpy.zeros(0,dtype=header['dtype'])
+    return columns
+
+def parseDataFile(infilepath):
+    '''
+    parse a .dat file in a single pass, all columns at once.
+
+    Returns a dictionary of format:
+    {
+        'header':   ['## key = value', ...],
+        'cpuID':    0,
+        'columns':  {
+            elemName: numpy array (one entry per cycle, all runs),
+        }
+    }
+    '''
+    header      = []
+    elemNames   = None
+    rows        = []
+    with open(infilepath,'r') as f:
+        for line in f:
+            if line.startswith('## '):
+                header  += [line]
+            elif line.startswith('# '):
+                if elemNames is None:
+                    elemNames = line[2:].split()
+            elif line.startswith('#') or not line.strip():
+                continue
+            else:
+                rows    += [line.split()]
+
+    if elemNames is None:
+        elemNames = []
+    data        = numpy.array(rows,dtype=float).reshape(len(rows),len(elemNames)).T.copy()
+
+    return {
+        'header':   header,
+        'cpuID':    None,
+        'columns':  dict([(elemName,data[i]) for (i,elemName) in enumerate(elemNames)]),
+    }
+
+_parsedFiles  = {} # indexed by path, contains ((path,size,mtime),parsed)
+
+def loadDataFile(infilepath):
+    '''
+    load all the columns of a .dat file, parsing it at most once.
+
+    Parsed files are kept in memory and pickled under CACHEDIR, keyed by the
+    file's path, size and mtime, so re-plotting a finished simData directory
+    skips parsing entirely. The columnar copy written with --binaryStats is
+    memory-mapped instead of parsing the text, when it exists.
+    '''
+    stat        = os.stat(infilepath)
+    key         = (os.path.abspath(infilepath),stat.st_size,stat.st_mtime)
 
-        # print
-        print 'Parsing {0} for {1}...'.format(infilepath,elemName),
+    if infilepath in _parsedFiles and _parsedFiles[infilepath][0]==key:
+        return _parsedFiles[infilepath][1]
 
-        # find col_elemName, col_runNum, cpuID
-        col_elemName    = None
-        col_runNum      = None
-        cpuID           = None
+    parsed      = None
+    columnsDir  = getColumnsDir(infilepath)
+    cachefile   = os.path.join(DATADIR,CACHEDIR,'{0}.pickle'.format(hashlib.md5(key[0]).hexdigest()))
+
+    if columnsDir:
+        # the header is only at the top of the .dat file
+        header  = []
         with open(infilepath,'r') as f:
             for line in f:
-                if line.startswith('# '):
-                    # col_elemName, col_runNum
-                    elems        = re.sub(' +',' ',line[2:]).split()
-                    numcols      = len(elems)
-                    col_elemName = elems.index(elemName)
-                    col_runNum   = elems.index('runNum')
+                if line.startswith('## '):
+                    header += [line]
+                elif line.strip():
                     break
+        parsed  = {
+            'header':   header,
+            'cpuID':    None,
+            'columns':  loadColumns(columnsDir),
+        }
+    else:
+        try:
+            with open(cachefile,'rb') as f:
+                (cachedKey,cachedParsed) = cPickle.load(f)
+            if cachedKey==key:
+                parsed = cachedParsed
+        except Exception:
+            pass # no or unreadable cache entry, parse
+
+        if parsed is None:
+            print 'Parsing {0}...'.format(infilepath),
+            parsed = parseDataFile(infilepath)
+            try:
+                if not os.path.exists(os.path.dirname(cachefile)):
+                    os.makedirs(os.path.dirname(cachefile))
+                with open(cachefile,'wb') as f:
+                    cPickle.dump((key,parsed),f,cPickle.HIGHEST_PROTOCOL)
+            except (IOError,OSError) as err:
+                print 'could not cache {0}: {1}'.format(infilepath,err),
+            print 'done.'
+
+    for line in parsed['header']:
+        m = re.search('cpuID\s+=\s+([0-9]+)',line)
+        if m:
+            parsed['cpuID'] = int(m.group(1))
+
+    _parsedFiles[infilepath] = (key,parsed)
+
+    return parsed
+
+def groupBy(keys,vals):
+    '''
+    split the array vals by the value of the array keys, keeping the order of
+    vals within each group.
 
-                if line.startswith('## '):
-                    # cpuID
-                    m = re.search('cpuID\s+=\s+([0-9]+)',line)
-                    if m:
-                        cpuID = int(m.group(1))
-        assert col_elemName!=None
-        assert col_runNum!=None
+    Returns a list of (key,numpy array), by increasing key.
+    '''
+    if not len(keys):
+        return []
+    order   = numpy.argsort(keys,kind='mergesort') # stable
+    keys    = keys[order]
+    bounds  = numpy.flatnonzero(numpy.diff(keys))+1
+    return zip(keys[numpy.r_[0,bounds]].tolist(),numpy.split(vals[order],bounds))
+
+def gatherPerRunData(infilepaths,elemName):
+    '''
+    Returns a dictionary of format:
+    {
+        (cpuID,runNum): numpy array (one entry per cycle),
+    }
+    '''
+
+    valuesPerRun = {}
+    for infilepath in infilepaths:
+
+        parsed  = loadDataFile(infilepath)
+        cpuID   = parsed['cpuID']
         assert cpuID!=None
 
-        # parse data
-        with open(infilepath,'r') as f:
-            for line in f:
-                if line.startswith('#') or not line.strip():
-                    continue
-                m       = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-                runNum  = int(m.group(col_runNum+1))
-                try:
-                    elem         = float(m.group(col_elemName+1))
-                except:
-                    try:
-                        elem     =   int(m.group(col_elemName+1))
-                    except:
-                        elem     =       m.group(col_elemName+1)
-
-                if (cpuID,runNum) not in valuesPerRun:
-                    valuesPerRun[cpuID,runNum] = []
-                valuesPerRun[cpuID,runNum] += [elem]
-
-        # print
-        print 'done.'
-
-    return valuesPerRun
+        runNums = numpy.asarray(parsed['columns']['runNum'],dtype=int)
+        elems   = numpy.asarray(parsed['columns'][elemName],dtype=float)
+        for (runNum,vals) in groupBy(runNums,elems):
+            valuesPerRun.setdefault((cpuID,runNum),[]).append(vals)
+
+    return dict([(k,numpy.concatenate(v)) for (k,v) in valuesPerRun.items()])
 
 def gatherPerCycleData(infilepaths,elemName):
+    '''
+    Returns a dictionary of format:
+    {
+        cycle: numpy array (one entry per run),
+    }
+    '''
 
     valuesPerCycle = {}
     for infilepath in infilepaths:
 
-        # print
-        print 'Parsing {0} for {1}...'.format(infilepath,elemName),
+        parsed  = loadDataFile(infilepath)
 
-        # find colnumelem, colnumcycle
-        with open(infilepath,'r') as f:
-            for line in f:
-                if line.startswith('# '):
-                    elems        = re.sub(' +',' ',line[2:]).split()
-                    numcols      = len(elems)
-                    colnumelem   = elems.index(elemName)
-                    colnumcycle  = elems.index('cycle')
-                    break
+        cycles  = numpy.asarray(parsed['columns']['cycle'],dtype=int)
+        elems   = numpy.asarray(parsed['columns'][elemName],dtype=float)
+        for (cycle,vals) in groupBy(cycles,elems):
+            valuesPerCycle.setdefault(cycle,[]).append(vals)
 
-        assert colnumelem
-        assert colnumcycle
+    return dict([(k,numpy.concatenate(v)) for (k,v) in valuesPerCycle.items()])
 
-        # parse data
+def toRunMatrix(perCycle):
+    '''
+    the output of gatherPerCycleData as a (cycle,run) array, by increasing
+    cycle, 0 for the runs a cycle has no value for.
+    '''
+    cycles  = sorted(perCycle.keys())
+    matrix  = numpy.zeros((len(cycles),max([len(perCycle[c]) for c in cycles] or [0])))
+    for (i,cycle) in enumerate(cycles):
+        matrix[i,:len(perCycle[cycle])] = perCycle[cycle]
+    return matrix
 
-        with open(infilepath,'r') as f:
-            for line in f:
-                if line.startswith('#') or not line.strip():
-                    continue
-                m       = re.search('\s+'.join(['([\.0-9]+)']*numcols),line.strip())
-                cycle   = int(m.group(colnumcycle+1))
-                try:
-                    elem         = float(m.group(colnumelem+1))
-                except:
-                    try:
-                        elem     =   int(m.group(colnumelem+1))
-                    except:
-                        elem     =       m.group(colnumelem+1)
-
-                if cycle not in valuesPerCycle:
-                    valuesPerCycle[cycle] = []
-                valuesPerCycle[cycle] += [elem]
-
-        # print
-        print 'done.'
-
-    return valuesPerCycle
+def toCycleMatrix(perRun):
+    '''
+    the values of the output of gatherPerRunData as a (cycle,run) array, over
+    the cycles all runs have, as zip(*perRun.values()).
+    '''
+    runs      = perRun.values()
+    numCycles = min([len(v) for v in runs] or [0])
+    return numpy.array([v[:numCycles] for v in runs]).reshape(len(runs),numCycles).T
 
 def calcMeanConfInt(vals):
-    assert type(vals)==list
-    for val in vals:
-        assert type(val) in [int,float,numpy.float64]
+    if isinstance(vals,numpy.ndarray):
+        assert vals.ndim==1
+    else:
+        assert type(vals)==list
+        for val in vals:
+            assert type(val) in [int,float,numpy.float64]
 
     a         = 1.0*numpy.array(vals)
     se        = scipy.stats.sem(a)
@@ -253,15 +381,25 @@ def calcMeanConfInt(vals):
 
     return (m,confint)
 
+def calcPairedMeanConfInt(valsA,valsB):
+    '''
+    mean and confidence interval of the run by run difference A-B.
+
+    valsA and valsB are indexed by (cpuID,runNum), only the runs present in
+    both are used. Returns (mean,confint,numPairs).
+    '''
+    pairs     = sorted(set(valsA.keys()) & set(valsB.keys()))
+    (m,confint) = calcMeanConfInt([float(valsA[k]-valsB[k]) for k in pairs])
+    return (m,confint,len(pairs))
+
 def getSlotDuration(dataBins):
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),filepaths) in dataBins.items():
         for filepath in filepaths:
-            with open(filepath,'r') as f:
-                for line in f:
-                    if line.startswith('## '):
-                        m = re.search('slotDuration\s+=\s+([\.0-9]+)',line)
-                        if m:
-                            return float(m.group(1))
+            for line in loadDataFile(filepath)['header']:
+                if line.startswith('## '):
+                    m = re.search('slotDuration\s+=\s+([\.0-9]+)',line)
+                    if m:
+                        return float(m.group(1))
 
 
 def getParentSizes(plotData):
@@ -274,6 +412,87 @@ def getNumPacketsBurst(plotData):
     return set([numPacketsBurst for (otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst) in plotData.keys() ])
     
 
+#============================ rendering =======================================
+
+_savedFigures = [] # files written by the task being rendered
+_renderTasks  = [] # (name,func,args), inherited by the forked renderers
+
+def saveFigure(filepath):
+    '''
+    save the current figure in all FORMATS.
+    '''
+    for ext in FORMATS:
+        outfilepath = '{0}.{1}'.format(filepath,ext)
+        matplotlib.pyplot.savefig(outfilepath)
+        _savedFigures.append(outfilepath)
+
+def saveReport(filepath,lines):
+    '''
+    write a text report, tracked like a figure.
+    '''
+    with open(filepath,'w') as f:
+        f.write('\n'.join(lines)+'\n')
+    _savedFigures.append(filepath)
+
+def _renderTask(index):
+    (name,func,args) = _renderTasks[index]
+    del _savedFigures[:]
+    func(*args)
+    matplotlib.pyplot.close('all')
+    return (name,list(_savedFigures))
+
+def renderFigures(tasks,inputs,numProcs=None,force=False):
+    '''
+    render each (name,func,args) task in its own process.
+
+    The tasks are forked from this process, so data already loaded (see
+    loadDataFile) is shared copy-on-write rather than re-parsed. A task is
+    skipped when none of its inputs (files) changed since it last rendered
+    and all the figures it wrote then still exist.
+    '''
+    stampfile  = os.path.join(DATADIR,CACHEDIR,RENDERSTAMPS)
+    try:
+        with open(stampfile,'r') as f:
+            stamps = json.load(f)
+    except (IOError,ValueError):
+        stamps = {}
+
+    inputsHash = hashlib.md5()
+    for inputfile in sorted(inputs):
+        stat   = os.stat(inputfile)
+        inputsHash.update(repr((os.path.abspath(inputfile),stat.st_size,stat.st_mtime)))
+
+    todo       = []
+    for (index,(name,func,args)) in enumerate(tasks):
+        stamp  = hashlib.md5(inputsHash.hexdigest()+name).hexdigest()
+        if (
+                not force and
+                name in stamps and
+                stamps[name]['inputs']==stamp and
+                all([os.path.exists(f) for f in stamps[name]['outputs']])
+            ):
+            print 'Skipping {0}, inputs unchanged.'.format(name)
+            continue
+        todo  += [(index,stamp)]
+
+    _renderTasks[:] = tasks
+    try:
+        if numProcs==1 or len(todo)<=1:
+            results = (_renderTask(index) for (index,stamp) in todo)
+        else:
+            pool    = multiprocessing.Pool(numProcs)
+            results = pool.imap_unordered(_renderTask,[index for (index,stamp) in todo])
+        newStamps   = dict([(tasks[index][0],stamp) for (index,stamp) in todo])
+        for (name,outputs) in results:
+            stamps[name] = {'inputs': newStamps[name], 'outputs': outputs}
+    finally:
+        if numProcs!=1 and len(todo)>1:
+            pool.terminate()
+        if not os.path.exists(os.path.dirname(stampfile)):
+            os.makedirs(os.path.dirname(stampfile))
+        with open(stampfile,'w') as f:
+            json.dump(stamps,f,indent=4)
+
 #============================ plotters ========================================
 
 def plot_vs_time(plotData,ymin=None,ymax=None,ylabel=None,filename=None,doPlot=True,withError=True):
@@ -417,8 +636,7 @@ def plot_vs_time(plotData,ymin=None,ymax=None,ylabel=None,filename=None,doPlot=T
 
     ax.legend( legendPlots, legendText, loc="best", prop={'size':10})
 
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'{0}.png'.format(filename)))
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'{0}.eps'.format(filename)))
+    saveFigure(os.path.join(DATADIR,filename))
     matplotlib.pyplot.close('all')
 
 def plot_vs_threshold(plotData,ymin,ymax,ylabel,filename,legend='(num of parents, buffer size)'):
@@ -441,11 +659,9 @@ def plot_vs_threshold(plotData,ymin,ymax,ylabel,filename,legend='(num of parents
 
     # collapse all cycles
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size),perCycleData) in plotData.items():
-        temp = []
-        for (k,v) in perCycleData.items():
-            temp += v
+        temp = [numpy.asarray(v,dtype=float) for (k,v) in perCycleData.items()]
 
-        plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size)] = temp
+        plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size)] = numpy.concatenate(temp) if temp else numpy.zeros(0)
 
     # plotData = {
     #     (otfThreshold,pkPeriod) = [
@@ -544,8 +760,7 @@ def plot_vs_threshold(plotData,ymin,ymax,ylabel,filename,legend='(num of parents
 #                label    = '{}, thr={}'.format(algorithm,threshold)
 #            )
 #    matplotlib.pyplot.legend(prop={'size':10})
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'{0}.png'.format(filename)))
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'{0}.eps'.format(filename)))
+    saveFigure(os.path.join(DATADIR,filename))
     matplotlib.pyplot.close('all')
 
 #----- txQueueFill
@@ -574,7 +789,7 @@ def gather_per_cycle_data(dataBins, parameter, factor=1.0):
      # Multiply by factor
     for ((otfThreshold,pkPeriod,algorithm,parent,buffer_size,numPacketsBurst),perCycleData) in plotData.items():
         for cycle in perCycleData.keys():
-            perCycleData[cycle] = [ factor * val for val in perCycleData[cycle] ]
+            perCycleData[cycle] = factor*perCycleData[cycle]
 
     # plotData = {
     #     (otfThreshold,pkPeriod) = {
@@ -685,7 +900,7 @@ def gather_latency_data(dataBins):
     slotDuration = getSlotDuration(dataBins)
     for ((otfThreshold,pkPeriod,algorithm,parent,buffer_size,numPacketsBurst),perCycleData) in plotData.items():
         for cycle in perCycleData.keys():
-            perCycleData[cycle] = [d*slotDuration for d in perCycleData[cycle]]
+            perCycleData[cycle] = slotDuration*perCycleData[cycle]
 
     # plotData = {
     #     (otfThreshold,pkPeriod) = {
@@ -702,12 +917,7 @@ def gather_latency_data(dataBins):
     # filter out 0 values
     for ((otfThreshold,pkPeriod,algorithm,parents,buffer_size,numPacketsBurst),perCycleData) in plotData.items():
         for cycle in perCycleData.keys():
-            i=0
-            while i<len(perCycleData[cycle]):
-                if perCycleData[cycle][i]==0:
-                    del perCycleData[cycle][i]
-                else:
-                    i += 1
+            perCycleData[cycle] = perCycleData[cycle][perCycleData[cycle]!=0]
 
     # plotData = {
     #     (otfThreshold,pkPeriod) = {
@@ -801,17 +1011,10 @@ def gather_max_data(dataBins, label):
     plotData  = {}
     unit_factor = getSlotDuration(dataBins) if label in ['aveLatency', 'aveQueueDelay'] else 1e-5 if label == 'chargeConsumed' else 0.02 if label == 'txQueueFill' else 1
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),filepaths) in dataBins.items():
-        perCycle = gatherPerCycleData(filepaths, label)
-
-        max_values = [ 0 for i in perCycle[0]]
-        # print "file: {}, percyle: {}, {}".format(filepaths,perCycle,(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst))
-        for k,v in perCycle.items():
-            for run,value in enumerate(v):
-                lat = unit_factor * value
-                if lat > max_values[run]:
-                    max_values[run] = lat
-            # print k,len(v)
-        # print "max_{}: {}".format(label,max_values)
+        perCycle = toRunMatrix(gatherPerCycleData(filepaths, label))
+
+        # at least 0, per run
+        max_values = numpy.maximum((unit_factor*perCycle).max(axis=0),0).tolist()
 
         plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = {0: max_values}
 
@@ -821,35 +1024,24 @@ def gather_ave_data(dataBins, label, count_label=None):
     plotData  = {}
     unit_factor = getSlotDuration(dataBins) if label in ['aveLatency', 'aveQueueDelay'] else 0.02 if label == 'txQueueFill' else 1
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),filepaths) in dataBins.items():
-        perCycle = gatherPerCycleData(filepaths, label)
+        perCycleData = gatherPerCycleData(filepaths, label)
+        perCycle     = unit_factor*toRunMatrix(perCycleData)
 
-        perCycle_count = {}
         if count_label:
-            if type(count_label)==list:
-                perCycle_count = [gatherPerCycleData(filepaths, cl) for cl in count_label]
-            else:
-                perCycle_count = [gatherPerCycleData(filepaths, count_label)]
-
-
-#        print "perCyple: {}\n\n, count: {}\n\n".format(perCycle, perCycle_count)
-
-        sum_values = [ 0 for i in perCycle[0]]
-        count_values = [ 0 for i in perCycle[0]]
-
-        for k,v in perCycle.items():
-            for run,value in enumerate(v):
-                lat = unit_factor * value
-                if count_label:
-                    sum_values[run] += sum([ pcc[k][run] * lat for pcc in perCycle_count ])
-                    count_values[run] += sum([ pcc[k][run] for pcc in perCycle_count ])
-                else:
-                    sum_values[run] += lat
-                    count_values[run] += 1
-
-
-#        values += [ perCycle_count[k] * unit_factor * v_i /sum_perCycle_count for v_i in v]
-
-        plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = {0: [ v / count_values[run] for run,v in enumerate(sum_values) ]  }
+            if type(count_label)!=list:
+                count_label = [count_label]
+            # weighted by the sum of the count_label columns, per cycle
+            counts       = sum([toRunMatrix(gatherPerCycleData(filepaths, cl)) for cl in count_label])
+            sum_values   = (counts*perCycle).sum(axis=0)
+            count_values = counts.sum(axis=0)
+        else:
+            sum_values   = perCycle.sum(axis=0)
+            count_values = numpy.bincount(
+                numpy.concatenate([numpy.arange(len(v)) for v in perCycleData.values()]),
+                minlength = perCycle.shape[1],
+            )
+
+        plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = {0: (sum_values/count_values).tolist()}
 
     return plotData
 
@@ -857,16 +1049,11 @@ def gather_sum_data(dataBins, label):
     plotData  = {}
     unit_factor = getSlotDuration(dataBins) if label in ['aveLatency', 'aveQueueDelay']  else 1
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),filepaths) in dataBins.items():
-        perCycle = gatherPerCycleData(filepaths, label)
+        perCycle = toRunMatrix(gatherPerCycleData(filepaths, label))
 
-        sum_values = [ 0 for i in perCycle[0]]
+        sum_values = (unit_factor*perCycle).sum(axis=0)
 
-        for k,v in perCycle.items():
-            for run,value in enumerate(v):
-                lat = unit_factor * value
-                sum_values[run] += lat
-
-        plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = {0: [ v for run,v in enumerate(sum_values) ]  }
+        plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = {0: sum_values.tolist()}
 
     return plotData
 
@@ -952,16 +1139,13 @@ def plot_chargeConsumed_vs_threshold(dataBins):
 def gather_time_all_reached(dataBins):
     plotData  = {}
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),filepaths) in dataBins.items():
-        perCycle = gatherPerCycleData(filepaths,'appReachesDagroot')
+        perCycleData = gatherPerCycleData(filepaths,'appReachesDagroot')
+        cycles       = numpy.array(sorted(perCycleData.keys()))
+        nonzero      = toRunMatrix(perCycleData)!=0
 
-        lastnonzero = [ 1000 for i in perCycle[0]]
-        # print "file: {}, percyle: {}, {}".format(filepaths,perCycle,(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size))
-        for k,v in perCycle.items():
-            for run,value in enumerate(v):
-                if value != 0:
-                    lastnonzero[run] = k
-            # print k,len(v)
-#        print "lastnonzero: {}".format(lastnonzero)
+        # last cycle with a packet reaching the root, 1000 if none
+        lastIndex    = len(cycles)-1-numpy.argmax(nonzero[::-1],axis=0)
+        lastnonzero  = numpy.where(nonzero.any(axis=0),cycles[lastIndex] if len(cycles) else 0,1000).tolist()
 
         plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = {0: lastnonzero}
 
@@ -1198,8 +1382,7 @@ def plot_numCells_otfActivity_vs_time(dataBins):
 
     allaxes += [ax]
 
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'numCells_otfActivity_vs_time.png'))
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'numCells_otfActivity_vs_time.eps'))
+    saveFigure(os.path.join(DATADIR,'numCells_otfActivity_vs_time'))
     matplotlib.pyplot.close('all')
 
 #===== otfActivity
@@ -1378,8 +1561,7 @@ def plot_otfActivity_vs_time(dataBins,doPlot=True):
         prop={'size':8},
     )
 
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'otfActivity_vs_time.png'))
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'otfActivity_vs_time.eps'))
+    saveFigure(os.path.join(DATADIR,'otfActivity_vs_time'))
     matplotlib.pyplot.close('all')
 
 def gather_sumOtfActivity_data(dataBins):
@@ -1416,7 +1598,7 @@ def gather_sumOtfActivity_data(dataBins):
     for otfpk in otfAddData.keys():
         plotData[otfpk] = {}
         for cycle in otfAddData[otfpk].keys():
-            plotData[otfpk][cycle] = [sum(x) for x in zip(otfAddData[otfpk][cycle],otfRemoveData[otfpk][cycle])]
+            plotData[otfpk][cycle] = otfAddData[otfpk][cycle]+otfRemoveData[otfpk][cycle]
 
     # plotData = {
     #     (otfThreshold,pkPeriod) = {
@@ -1458,11 +1640,9 @@ def plot_reliability_vs_time(dataBins):
         # gather raw add/remove data
         plotData    = {}
         for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),filepaths) in dataBins.items():
-            plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = {
-                i: list(k) for i,k in enumerate(
-                    zip(*gatherPerRunData(filepaths, val_str).values())
-                )
-            }
+            plotData[(otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)] = dict(
+                enumerate(toCycleMatrix(gatherPerRunData(filepaths, val_str)))
+            )
 
         for b in getBufferSizes(plotData):
             for p in getParentSizes(plotData):
@@ -1478,12 +1658,10 @@ def plot_reliability_vs_time(dataBins):
 
         plotDataCum = {}
         for ((otfThreshold,pkPeriod,algorith,parent_size,buffer_sizem,numPacketsBurst),filepaths) in dataBins.items():
-            plotDataCum[(otfThreshold,pkPeriod,algorith,parent_size,buffer_sizem,numPacketsBurst)] = {
-                i: list(k) for i,k in enumerate(
-                   zip(*map(numpy.cumsum,
-                            gatherPerRunData(filepaths, val_str).values()))
-                )
-            }
+            perRun = gatherPerRunData(filepaths, val_str)
+            plotDataCum[(otfThreshold,pkPeriod,algorith,parent_size,buffer_sizem,numPacketsBurst)] = dict(
+                enumerate(toCycleMatrix(dict([(k,numpy.cumsum(v)) for (k,v) in perRun.items()])))
+            )
 
         for b in getBufferSizes(plotData):
             for p in getParentSizes(plotData):
@@ -1543,11 +1721,11 @@ def plot_reliability_vs_threshold(dataBins):
     # sum up appGeneratedData
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),perRunData) in appGeneratedData.items():
         for cpuID_runNum in perRunData.keys():
-            perRunData[cpuID_runNum] = sum(perRunData[cpuID_runNum])
+            perRunData[cpuID_runNum] = perRunData[cpuID_runNum].sum()
     # sum up appReachedData
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),perRunData) in appReachedData.items():
         for cpuID_runNum in perRunData.keys():
-            perRunData[cpuID_runNum] = sum(perRunData[cpuID_runNum])
+            perRunData[cpuID_runNum] = perRunData[cpuID_runNum].sum()
     # get last of txQueueFillData
     for ((otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst),perRunData) in txQueueFillData.items():
         for cpuID_runNum in perRunData.keys():
@@ -1710,31 +1888,145 @@ def plot_reliability_vs_threshold(dataBins):
 #           label    = 'packet period {0}s'.format(period)
 #       )
 #    matplotlib.pyplot.legend(prop={'size':10})
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'reliability_vs_threshold_buf_100.png'))
-    matplotlib.pyplot.savefig(os.path.join(DATADIR,'reliability_vs_threshold_buf_100.eps'))
+    saveFigure(os.path.join(DATADIR,'reliability_vs_threshold_buf_100'))
     matplotlib.pyplot.close('all')
 
+def gather_per_run_metric(dataBins,metric):
+    '''
+    per-run 'reliability' (fraction of generated packets reaching the root)
+    or 'latency' (average over the packets reaching the root, in s).
+
+    Returns a dictionary of format:
+    {
+        (otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst): {
+            (cpuID,runNum): value,
+        }
+    }
+    '''
+    slotDuration = getSlotDuration(dataBins)
+    perRunData   = {}
+    for (binKey,filepaths) in dataBins.items():
+        generated = gatherPerRunData(filepaths,'appGenerated')
+        reached   = gatherPerRunData(filepaths,'appReachesDagroot')
+        latency   = gatherPerRunData(filepaths,'aveLatency')
+        perRunData[binKey] = {}
+        for cpuID_runNum in reached:
+            numReached   = reached[cpuID_runNum].sum()
+            if metric=='reliability':
+                numGenerated = generated[cpuID_runNum].sum()
+                if numGenerated>0:
+                    perRunData[binKey][cpuID_runNum] = float(numReached/numGenerated)
+            elif metric=='latency':
+                if numReached>0:
+                    totalLatency = numpy.dot(latency[cpuID_runNum],reached[cpuID_runNum])
+                    perRunData[binKey][cpuID_runNum] = float(slotDuration*totalLatency/numReached)
+            else:
+                raise ValueError('unknown metric {0}'.format(metric))
+    return perRunData
+
+def report_paired_differences(dataBins):
+    '''
+    difference of each variant (algorithm, otfThreshold) of a scenario to the
+    first one, with its paired confidence interval (run N against run N)
+    and, for comparison, the unpaired one. Runs of a paired sweep (--paired)
+    share their random streams, which narrows the paired interval.
+    '''
+    output = []
+    for metric in ['reliability','latency']:
+        perRunData = gather_per_run_metric(dataBins,metric)
+
+        scenarios  = {}
+        for (otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst) in perRunData.keys():
+            scenario = (pkPeriod,parent_size,buffer_size,numPacketsBurst)
+            if scenario not in scenarios:
+                scenarios[scenario] = []
+            scenarios[scenario] += [(algorithm,otfThreshold)]
+
+        for (scenario,variants) in sorted(scenarios.items()):
+            (pkPeriod,parent_size,buffer_size,numPacketsBurst) = scenario
+            variants     = sorted(variants)
+            if len(variants)<2:
+                continue
+            output += ['{0}, pkPeriod={1} parents={2} buffer={3} numPacketsBurst={4}'.format(metric,pkPeriod,parent_size,buffer_size,numPacketsBurst)]
+
+            (refAlgorithm,refThreshold) = variants[0]
+            refBin       = (refThreshold,pkPeriod,refAlgorithm,parent_size,buffer_size,numPacketsBurst)
+            (_,refConfint) = calcMeanConfInt(perRunData[refBin].values())
+            for (algorithm,otfThreshold) in variants[1:]:
+                varBin   = (otfThreshold,pkPeriod,algorithm,parent_size,buffer_size,numPacketsBurst)
+                (m,confint,numPairs) = calcPairedMeanConfInt(perRunData[varBin],perRunData[refBin])
+                (_,varConfint)       = calcMeanConfInt(perRunData[varBin].values())
+                paired   = all([
+                    any([line.startswith('## paired = True') for line in loadDataFile(filepath)['header']])
+                    for filepath in dataBins[varBin]+dataBins[refBin]
+                ])
+                output  += ['   {0} thr={1} - {2} thr={3}: {4:+.4f} +/- {5:.4f} ({6} {7} runs), unpaired +/- {8:.4f}'.format(
+                    algorithm,
+                    otfThreshold,
+                    refAlgorithm,
+                    refThreshold,
+                    m,
+                    confint,
+                    numPairs,
+                    'paired' if paired else 'independent',
+                    (refConfint**2+varConfint**2)**0.5,
+                )]
+
+    for line in output:
+        print line
+    saveReport(os.path.join(DATADIR,'paired_differences.txt'),output)
+
 #============================ main ============================================
 
+def parseCliOptions():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument( '--numProcs',
+        dest       = 'numProcs',
+        type       = int,
+        default    = multiprocessing.cpu_count(),
+        help       = 'Number of figures rendered in parallel.',
+    )
+    parser.add_argument( '--force',
+        dest       = 'force',
+        action     = 'store_true',
+        default    = False,
+        help       = 'Re-render figures even if their data did not change.',
+    )
+
+    options        = parser.parse_args()
+
+    return options.__dict__
+
 def main():
 
+    options  = parseCliOptions()
+
     dataBins = binDataFiles()
+    inputs   = [f for filepaths in dataBins.values() for f in filepaths]+[__file__]
+
+    tasks    = [(func.__name__,func,(dataBins,)) for func in [
+        plot_time_all_reached_vs_threshold,
+        plot_max_latency_vs_threshold,
+        plot_latency_vs_threshold,
+        plot_latency_vs_time, ### Good for 25,1
+
+        plot_numRxCells_vs_time,
 
-    plot_time_all_reached_vs_threshold(dataBins)
-    plot_max_latency_vs_threshold(dataBins)
-    plot_latency_vs_threshold(dataBins)
-    plot_latency_vs_time(dataBins) ### Good for 25,1
+        plot_chargeConsumed_vs_threshold,
+        plot_chargeConsumed_vs_time,
 
-    plot_numRxCells_vs_time(dataBins)
 
-    plot_chargeConsumed_vs_threshold(dataBins)
-    plot_chargeConsumed_vs_time(dataBins)
+        plot_reliability_vs_threshold,
+        plot_reliability_vs_time,
+        plot_txQueueFill_vs_threshold,
+        plot_max_txQueueFill_vs_threshold,
 
+        report_paired_differences,
+    ]]
 
-    plot_reliability_vs_threshold(dataBins)
-    plot_reliability_vs_time(dataBins)
-    plot_txQueueFill_vs_threshold(dataBins)
-    plot_max_txQueueFill_vs_threshold(dataBins)
+    renderFigures(tasks,inputs,numProcs=options['numProcs'],force=options['force'])
 
     ### need to rerun scenario for these, it gives sum of avg, instead of
     ### avg of avg due multiple motes
@@ -1,61 +1,293 @@
 #!/usr/bin/env python
 '''
 \brief Start batch of simulations concurrently.
-Workload is distributed equally among CPU cores.
+Each (parameter combination, run) is a separate task on a pool of processes,
+one per CPU core. Extra command-line arguments are passed to runSimOneCPU.
 \author Thomas Watteyne <watteyne@eecs.berkeley.edu>
 '''
 
+#============================ adjust path =====================================
+
 import os
+import sys
+if __name__=='__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
 import time
 import math
+import Queue
+import argparse
+import traceback
 import multiprocessing
 import fileinput
+import logging.config
+
+try:
+    import plotStuff
+except ImportError:
+    plotStuff = None # only needed for --targetCi (numpy, scipy, matplotlib)
+
+import runSimOneCPU
+from SimEngine import RunRegistry
+
+#============================ defines =========================================
 
 MIN_TOTAL_RUNRUNS = 10 # 500 # 94 # 500
 
-def runOneSim(params):
-    (cpuID,numRuns) = params
-    command     = []
-    # command     = ['ssh {0} "cd $PWD;'.format(host)]
-    command    = ['python runSimOneCPU.py']
-    command    += ['--numRuns {0}'.format(numRuns)]
-    command    += ['--cpuID {0}'.format(cpuID)]
-    # command    += ['--numPacketsBurst {0}'.format(1)]
-    # command    += ['--parents {0}'.format(3)]
-    command    += ['--burstTimestamp {0}'.format(20)]
-    command    += ['--pkPeriod {0}'.format(16)]
-    command    += ['--buffer {0}'.format(100)]
-    command    += ['--algorithm {0}'.format('otf')] # otf,local_voting
-    # command    += ['--otfThreshold {0}'.format(0)]
-    command    += ['--scheduler {0}'.format('deBras')] # deBras, none
-    # command    += ['--numChans {0}'.format(1)]
-    # command    += ['"']
-    #command    += ['&']
-    command     = ' '.join(command)
-    print "Executing command '{0}'".format(command)
-    os.system(command)
-
-def printProgress(num_cpus):
-    while True:
-        time.sleep(1)
-        output     = []
-        for cpu in range(num_cpus):
-            with open('cpu{0}.templog'.format(cpu),'r') as f:
-                output += ['[cpu {0}] {1}'.format(cpu,f.read())]
-        allDone = True
-        for line in output:
-            if line.count('ended')==0:
-                allDone = False
-        output = '\n'.join(output)
-        # os.system('clear')
-        # print output
-        with open('progress.txt', 'w') as f:
-            f.write(output)
-
-        if allDone:
-            break
-    for cpu in range(num_cpus):
-        os.remove('cpu{0}.templog'.format(cpu))
+SIM_ARGS          = [
+    '--numRuns',         str(MIN_TOTAL_RUNRUNS),
+    # '--numPacketsBurst', '1',
+    # '--parents',         '3',
+    '--burstTimestamp',  '20',
+    '--pkPeriod',        '16',
+    '--buffer',          '100',
+    '--algorithm',       'otf', # otf,local_voting
+    # '--otfThreshold',    '0',
+    '--scheduler',       'deBras', # deBras, none
+    # '--numChans',        '1',
+]
+
+#============================ helpers =========================================
+
+def expectedCost(simParam):
+    '''
+    rough relative duration of one run of simParam, used to start the longest
+    runs first. Slots simulated, times the work per slot, which grows with the
+    number of packets in flight (offered load and queue size).
+    '''
+    numSlots   = simParam['numCyclesPerRun']*simParam['slotframeLength']
+    load       = simParam['numMotes']*simParam['slotDuration']/simParam['pkPeriod']
+    return numSlots*simParam['numMotes']*(1.0+load)*(1.0+math.log(1+float(simParam['buffer'])))
+
+def readRunMetrics(outputFile,metricNames):
+    '''
+    per-run value of each metric, read from the .dat file of a single run.
+    
+    'reliability' is the fraction of generated packets reaching the root and
+    'latency' the average latency of those packets (in slots), as in
+    plotStuff. Any other name is a column of the file, averaged over cycles.
+    '''
+    if not metricNames:
+        return {}
+    
+    columns    = plotStuff.loadDataFile(outputFile)['columns']
+    
+    metrics    = {}
+    for metricName in metricNames:
+        if metricName=='reliability':
+            metrics[metricName] = float(columns['appReachesDagroot'].sum()/max(columns['appGenerated'].sum(),1.0))
+        elif metricName=='latency':
+            numReached          = columns['appReachesDagroot'].sum()
+            totalLatency        = (columns['aveLatency']*columns['appReachesDagroot']).sum()
+            metrics[metricName] = float(totalLatency/max(numReached,1.0))
+        else:
+            metrics[metricName] = float(columns[metricName].sum()/max(len(columns[metricName]),1))
+    return metrics
+
+def relativeHalfWidth(vals):
+    (m,confint) = plotStuff.calcMeanConfInt(vals)
+    if confint==0:
+        return 0.0
+    if m==0:
+        return float('inf')
+    return abs(confint/m)
+
+def runTask(task):
+    '''
+    run one (simParam,runNum) task in a pool worker, and record it as
+    finished in the registry.
+    
+    Each task writes its own output_cpu<runNum>.dat (and .columns) file, so
+    tasks of the same combination never share a file.
+    '''
+    (simParamNum,simParam,combinationKeys,runNum,metricNames) = task
+    
+    try:
+        runStartTime  = time.time()
+        outputFile    = runSimOneCPU.runOneRun(simParam,combinationKeys,runNum,runStartTime,newFile=True)
+        duration      = time.time()-runStartTime
+        metrics       = readRunMetrics(outputFile,metricNames)
+        
+        registry      = RunRegistry.RunRegistry(simParam['simDataDir'])
+        registry.markDone(registry.getRunKey(simParam,runNum),simParam,runNum,outputFile,duration,metrics)
+    except Exception:
+        # apply_async callbacks never see exceptions, hand them over
+        return (simParamNum,runNum,None,None,traceback.format_exc())
+    
+    return (simParamNum,runNum,duration,metrics,None)
+
+def runSims(options,batchOptions):
+    '''
+    run all (simParam,runNum) tasks of the sweep on a pool sized to the
+    machine, longest expected first.
+    
+    With batchOptions['targetCi'] set, numRuns is only the initial number of
+    runs per combination: more runs are scheduled for a combination until the
+    relative CI half-width of each of batchOptions['ciMetrics'] is below
+    targetCi, or it has batchOptions['maxRuns'] runs.
+    '''
+    simStartTime     = time.time()
+    
+    targetCi         = batchOptions['targetCi']
+    metricNames      = batchOptions['ciMetrics'] if targetCi else []
+    if targetCi and not plotStuff:
+        raise EnvironmentError('--targetCi needs numpy, scipy and matplotlib.')
+    if targetCi:
+        # parse cache of the run outputs where plotStuff looks for it
+        plotStuff.DATADIR = options['simDataDir']
+    
+    (combinationKeys,simParams) = runSimOneCPU.getSimParams(options)
+    
+    registry         = RunRegistry.RunRegistry(options['simDataDir'])
+    pool             = multiprocessing.Pool(multiprocessing.cpu_count())
+    results          = Queue.Queue()
+    
+    # per combination: metrics of finished runs, number of runs started
+    runMetrics       = [{} for simParam in simParams]
+    numStarted       = [0  for simParam in simParams]
+    numPending       = [0  for simParam in simParams]
+    
+    def startRuns(simParamNums,numRuns):
+        tasks        = []
+        for (simParamNum,numNewRuns) in zip(simParamNums,numRuns):
+            simParam = simParams[simParamNum]
+            for runNum in xrange(numStarted[simParamNum],numStarted[simParamNum]+numNewRuns):
+                taskParam          = dict(simParam)
+                taskParam['cpuID'] = runNum
+                numStarted[simParamNum] += 1
+                # skip the runs finished by an earlier, interrupted, batch
+                entry    = None
+                if not options['noResume']:
+                    entry = registry.get(registry.getRunKey(taskParam,runNum),taskParam)
+                if entry:
+                    if entry.get('results')!=None and set(metricNames)<=set(entry['results']):
+                        runMetrics[simParamNum][runNum] = entry['results']
+                    else:
+                        runMetrics[simParamNum][runNum] = readRunMetrics(entry['outputs'].keys()[0],metricNames)
+                    continue
+                tasks   += [(simParamNum,taskParam,combinationKeys,runNum,metricNames)]
+        tasks.sort(key=lambda task: expectedCost(task[1]), reverse=True)
+        for task in tasks:
+            numPending[task[0]] += 1
+            pool.apply_async(runTask,(task,),callback=results.put)
+        return len(tasks)
+    
+    def numMoreRuns(simParamNum):
+        # how many more runs simParamNum needs, 0 when it is done
+        numRuns      = len(runMetrics[simParamNum])
+        if not targetCi or numRuns>=batchOptions['maxRuns']:
+            return 0
+        if numRuns<2:
+            return 2-numRuns
+        worst        = max([
+            relativeHalfWidth([m[metricName] for m in runMetrics[simParamNum].values()])
+            for metricName in metricNames
+        ])
+        if worst<=targetCi:
+            return 0
+        # the CI half-width shrinks as 1/sqrt(numRuns), at most double at once
+        needed       = int(math.ceil(numRuns*min((worst/targetCi)**2,2.0)))
+        return max(1,min(needed-numRuns,batchOptions['maxRuns']-numRuns))
+    
+    def reportDone(simParamNum):
+        output       = 'parameters {0}/{1} done after {2} runs'.format(
+            simParamNum+1,
+            len(simParams),
+            len(runMetrics[simParamNum]),
+        )
+        if targetCi and len(runMetrics[simParamNum])>=2:
+            stats    = []
+            for metricName in metricNames:
+                vals       = [m[metricName] for m in runMetrics[simParamNum].values()]
+                (m,confint) = plotStuff.calcMeanConfInt(vals)
+                stats += ['{0} {1:.4g}+-{2:.2g} ({3:.1%})'.format(metricName,m,confint,relativeHalfWidth(vals))]
+            output  += ': '+', '.join(stats)
+        print output
+    
+    startRuns(range(len(simParams)),[simParam['numRuns'] for simParam in simParams])
+    numSkipped       = sum([len(m) for m in runMetrics])
+    if numSkipped:
+        print 'skipping {0} finished runs.'.format(numSkipped)
+    
+    # combinations fully skipped may already need more runs
+    idle             = [n for n in range(len(simParams)) if numPending[n]==0]
+    while idle:
+        more         = [numMoreRuns(n) for n in idle]
+        for (n,m) in zip(idle,more):
+            if m==0:
+                reportDone(n)
+        startRuns(idle,more)
+        idle         = [n for (n,m) in zip(idle,more) if m and numPending[n]==0]
+    
+    numDone          = 0
+    try:
+        while sum(numPending):
+            # (a timeout keeps Ctrl-C working while blocked)
+            (simParamNum,runNum,duration,metrics,error) = results.get(timeout=1e6)
+            if error:
+                raise RuntimeError('parameters {0}/{1}, run {2} failed:\n{3}'.format(simParamNum+1,len(simParams),runNum+1,error))
+            numPending[simParamNum]         -= 1
+            runMetrics[simParamNum][runNum]  = metrics
+            numDone                         += 1
+            
+            output   = 'parameters {0}/{1}, run {2} done in {3:.0f}s ({4} runs done, {5} pending, {6:.0f}s elapsed)'.format(
+                simParamNum+1,
+                len(simParams),
+                runNum+1,
+                duration,
+                numDone,
+                sum(numPending),
+                time.time()-simStartTime,
+            )
+            print output
+            with open('progress.txt', 'w') as f:
+                f.write(output)
+            
+            # once all its runs are in, decide whether simParamNum needs more
+            while numPending[simParamNum]==0:
+                more = numMoreRuns(simParamNum)
+                if more==0:
+                    reportDone(simParamNum)
+                    break
+                startRuns([simParamNum],[more])
+    finally:
+        pool.terminate()
+        pool.join()
+    
+    print 'simulation ended after {0:.0f}s.'.format(time.time()-simStartTime)
+
+def parseCliOptions():
+    '''
+    options of the batch itself, all others are passed to runSimOneCPU.
+    '''
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument( '--targetCi',
+        dest       = 'targetCi',
+        type       = float,
+        default    = None,
+        help       = '[batch] Keep adding runs to a combination until the CI half-width of each ciMetrics is below this fraction of its mean (e.g. 0.05). numRuns is then the initial number of runs.',
+    )
+    parser.add_argument( '--ciMetrics',
+        dest       = 'ciMetrics',
+        nargs      = '+',
+        type       = str,
+        default    = ['reliability','latency'],
+        help       = '[batch] Metrics checked by --targetCi: reliability, latency, or any column of the output files.',
+    )
+    parser.add_argument( '--maxRuns',
+        dest       = 'maxRuns',
+        type       = int,
+        default    = 100,
+        help       = '[batch] Maximum number of runs per combination with --targetCi.',
+    )
+    
+    (options,simArgs) = parser.parse_known_args()
+    
+    return (options.__dict__,simArgs)
 
 def buildSshParams():
     result = []
@@ -69,14 +301,14 @@ def buildSshParams():
     return result
 
 
+#============================ main ============================================
+
 if __name__ == '__main__':
     multiprocessing.freeze_support()
     # ssh_params = buildSshParams()
     # print "The ssh params are {0}".format(ssh_params)
-    # num_cpus = len(ssh_params) # multiprocessing.cpu_count()
-    num_cpus = multiprocessing.cpu_count()
-    runsPerCpu = int(math.ceil(float(MIN_TOTAL_RUNRUNS)/float(num_cpus)))
-    pool = multiprocessing.Pool(num_cpus)
-    pool.map_async(runOneSim,[(i,runsPerCpu) for i in range(num_cpus)])
-    printProgress(num_cpus)
+    logging.config.fileConfig('logging.conf')
+    (batchOptions,simArgs) = parseCliOptions()
+    options            = runSimOneCPU.parseCliOptions(SIM_ARGS+simArgs)
+    runSims(options,batchOptions)
     raw_input("Done. Press Enter to close.")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+'''
+\brief Run variants of a scenario from a shared warm-up.
+
+The parameter combinations which differ only in the branch keys (e.g.
+algorithm, otfThreshold, buffer) are variants of the same scenario. For each
+run, the first variant is simulated up to branchAtCycle (topology, RPL
+convergence); the process then forks one child per other variant, which
+changes its branch settings and finishes the run, writing to the output file
+of its combination. All variants thus start from the same network, and the
+warm-up is simulated once. Extra command-line arguments are passed to
+runSimOneCPU.
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+if __name__=='__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
+import time
+import argparse
+import traceback
+import logging.config
+
+import runSimOneCPU
+from SimEngine     import SimEngine,   \
+                          SimSettings, \
+                          SimStats
+
+#============================ defines =========================================
+
+# settings the motes read on each use, which can change in the middle of a run
+BRANCHABLE_SETTINGS = ['algorithm','otfThreshold','buffer','parents']
+
+# type of each, as the motes compare it (runSimOneCPU parses some as strings)
+BRANCH_TYPES        = {
+    'algorithm':         str,
+    'otfThreshold':      int,
+    'buffer':            int,
+    'parents':           int,
+}
+
+#============================ helpers =========================================
+
+def getVariantGroups(simParams,combinationKeys,branchKeys):
+    '''
+    group the parameter combinations which differ only in branchKeys.
+
+    Returns a list of lists of simParams, in the order of simParams.
+    '''
+    groups       = []
+    groupKeys    = []
+    for simParam in simParams:
+        key = tuple([simParam[k] for k in combinationKeys if k not in branchKeys])
+        if key not in groupKeys:
+            groupKeys += [key]
+            groups    += [[]]
+        groups[groupKeys.index(key)] += [simParam]
+    return groups
+
+def runBranchedRun(variants,combinationKeys,branchKeys,branchAtCycle,runNum,runStartTime):
+    '''
+    run runNum of all variants, branching off the first one at branchAtCycle.
+
+    Each variant continues with a copy of the random state at the branch
+    point, i.e. common random numbers. The algorithm of a variant applies from
+    the next housekeeping of each mote.
+    '''
+
+    isChild          = []
+    children         = []
+
+    # create singletons, with the settings of the first variant
+    settings         = SimSettings.SimSettings(**variants[0])
+    settings.setStartTime(runStartTime)
+    settings.setCombinationKeys(combinationKeys)
+    simengine        = SimEngine.SimEngine(runNum)
+    simstats         = SimStats.SimStats(runNum)
+
+    def branch():
+        sys.stdout.flush()
+        for variant in variants[1:]:
+            pid = os.fork()
+            if pid==0:
+                isChild.append(True)
+                for k in branchKeys:
+                    setattr(settings,k,variant[k])
+                simstats.branch(newFile=(runNum==0))
+                return
+            children.append(pid)
+
+    simengine.scheduleAtAsn(
+        asn         = branchAtCycle*settings.slotframeLength,
+        cb          = branch,
+        uniqueTag   = ('runSimBranches','branch'),
+        priority    = 1000,
+    )
+
+    # run in this thread, a forked child only keeps the thread which forked
+    try:
+        simengine.run()
+
+        # destroy singletons
+        simstats.destroy()
+        simengine.destroy()
+        settings.destroy()
+    except:
+        if isChild:
+            traceback.print_exc()
+            sys.stdout.flush()
+            os._exit(1)
+        raise
+
+    if isChild:
+        sys.stdout.flush()
+        os._exit(0)
+
+    # wait for the other variants
+    for pid in children:
+        (_,status) = os.waitpid(pid,0)
+        if status!=0:
+            raise RuntimeError('variant process {0} failed with status {1}'.format(pid,status))
+
+def runSims(options,branchOptions):
+
+    # record simulation start time
+    simStartTime     = time.time()
+
+    # compute all the simulation parameter combinations
+    (combinationKeys,simParams) = runSimOneCPU.getSimParams(options)
+    branchKeys       = [k for k in branchOptions['branchKeys'] if k in combinationKeys]
+    for simParam in simParams:
+        simParam['branchAtCycle'] = branchOptions['branchAtCycle']
+        for k in branchKeys:
+            simParam[k] = BRANCH_TYPES[k](simParam[k])
+    groups           = getVariantGroups(simParams,combinationKeys,branchKeys)
+
+    for (groupNum,variants) in enumerate(groups):
+
+        # record run start time
+        runStartTime = time.time()
+
+        for runNum in xrange(options['numRuns']):
+
+            output = 'scenario {0}/{1} ({2} variants), run {3}/{4}'.format(
+                groupNum+1,
+                len(groups),
+                len(variants),
+                runNum+1,
+                options['numRuns'],
+            )
+            runSimOneCPU.printOrLog(variants[0],output)
+
+            runBranchedRun(variants,combinationKeys,branchKeys,branchOptions['branchAtCycle'],runNum,runStartTime)
+
+    print 'simulation ended after {0:.0f}s.'.format(time.time()-simStartTime)
+
+def parseCliOptions():
+    '''
+    options of the branching itself, all others are passed to runSimOneCPU.
+    '''
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument( '--branchAtCycle',
+        dest       = 'branchAtCycle',
+        type       = int,
+        default    = 20,
+        help       = '[branch] Cycle at which the variants branch off the shared warm-up.',
+    )
+    parser.add_argument( '--branchKeys',
+        dest       = 'branchKeys',
+        nargs      = '+',
+        type       = str,
+        default    = ['algorithm','otfThreshold','buffer'],
+        help       = '[branch] Settings which make up a variant, among {0}.'.format(', '.join(BRANCHABLE_SETTINGS)),
+    )
+
+    (options,simArgs) = parser.parse_known_args()
+
+    for k in options.branchKeys:
+        if k not in BRANCHABLE_SETTINGS:
+            parser.error('cannot branch on {0}, only on {1}'.format(k,', '.join(BRANCHABLE_SETTINGS)))
+    if options.branchAtCycle<1:
+        parser.error('--branchAtCycle must be at least 1')
+
+    return (options.__dict__,simArgs)
+
+#============================ main ============================================
+
+if __name__ == '__main__':
+    logging.config.fileConfig('logging.conf')
+    (branchOptions,simArgs) = parseCliOptions()
+    options                 = runSimOneCPU.parseCliOptions(simArgs)
+    runSims(options,branchOptions)
@@ -36,17 +36,24 @@ import itertools
 import logging.config
 import argparse
 import threading
+import cProfile
 
 from SimEngine     import SimEngine,   \
                           SimSettings, \
-                          SimStats
+                          SimStats,    \
+                          RunRegistry, \
+                          Checkpoint,  \
+                          RandomStreams
 # from SimGui        import SimGui # nogui
 
 #============================ defines =========================================
 
+# options taken from the command line rather than the checkpoint on restore
+RESTORE_RUN_OPTIONS = ['gui','cpuID','simDataDir','binaryStats','noResume','checkpointAt','restoreFrom','dispatchProfile','profile']
+
 #============================ helpers =========================================
 
-def parseCliOptions():
+def parseCliOptions(args=None):
     
     parser = argparse.ArgumentParser()
     # sim
@@ -62,12 +69,66 @@ def parseCliOptions():
         default    = None,
         help       = '[sim] id of the CPU running this simulation (for batch).',
     )
+    parser.add_argument( '--seed',
+        dest       = 'seed',
+        type       = int,
+        default    = None,
+        help       = '[sim] Master seed of the random streams, drawn at random (and kept in simDataDir for the next invocations) if not given.',
+    )
+    parser.add_argument( '--paired',
+        dest       = 'paired',
+        action     = 'store_true',
+        default    = False,
+        help       = '[sim] Paired sweep: run N of every parameter combination shares its topology, traffic and channel random streams.',
+    )
     parser.add_argument( '--numRuns',
         dest       = 'numRuns',
         type       = int,
         default    = 2,
         help       = '[sim] Number of simulation runs.',
     )
+    parser.add_argument('--binaryStats',
+        dest       = 'binaryStats',
+        action     = 'store_true',
+        default    = False,
+        help       = '[sim] Also write the statistics as one binary file per column (needs numpy).',
+    )
+    parser.add_argument('--noResume',
+        dest       = 'noResume',
+        action     = 'store_true',
+        default    = False,
+        help       = '[sim] Rerun the runs already recorded as finished in simDataDir.',
+    )
+    parser.add_argument( '--checkpointAt',
+        dest       = 'checkpointAt',
+        type       = int,
+        default    = None,
+        help       = '[sim] Save the state of each run at this ASN, next to its output file.',
+    )
+    parser.add_argument('--dispatchProfile',
+        dest       = 'dispatchProfile',
+        action     = 'store_true',
+        default    = False,
+        help       = '[sim] Time the events dispatched, per kind, and write a summary next to the output file at the end of each run.',
+    )
+    parser.add_argument('--profile',
+        dest       = 'profile',
+        action     = 'store_true',
+        default    = False,
+        help       = '[sim] Profile each run with cProfile, into a .pstats file next to its output file (see mergeProfiles.py).',
+    )
+    parser.add_argument('--hopTrace',
+        dest       = 'hopTrace',
+        action     = 'store_true',
+        default    = False,
+        help       = '[sim] Log the enqueue, first TX and RX ASNs and retries of each hop of the packets reaching the DAG root, into a .hoptrace file next to the output file (see summarizeHopTrace.py).',
+    )
+    parser.add_argument('--restoreFrom',
+        dest       = 'restoreFrom',
+        type       = str,
+        default    = None,
+        help       = '[sim] Resume the run saved in this checkpoint file, with its settings. The output is written to --simDataDir (mind overwriting the original run).',
+    )
     parser.add_argument( '--numCyclesPerRun',
         dest       = 'numCyclesPerRun',
         type       = int,
@@ -123,6 +184,13 @@ def parseCliOptions():
         default    = [1, 5, 25],
         help       = '[app] Number of packets in a burst, per node.',
     )
+    parser.add_argument( '--trafficSource',
+        dest       = 'trafficSource',
+        type       = str,
+        default    = 'events',
+        choices    = ['events','periodic','poisson'],
+        help       = '[app] Packet arrivals: scheduled one by one (events), or precomputed periodic/Poisson (needs numpy).',
+    )
     # rpl
     parser.add_argument( '--dioPeriod',
         dest       = 'dioPeriod',
@@ -130,6 +198,18 @@ def parseCliOptions():
         default    = 1.0,
         help       = '[rpl] DIO period (s).',
     )
+    parser.add_argument('--rplIncremental',
+        dest       = 'rplIncremental',
+        action     = 'store_true',
+        default    = False,
+        help       = '[rpl] Run RPL housekeeping only when its inputs changed, at most once per mote per ASN, with loop checks on a cached ancestor index.',
+    )
+    parser.add_argument('--dioTrickle',
+        dest       = 'dioTrickle',
+        action     = 'store_true',
+        default    = False,
+        help       = '[rpl] Send DIOs on a Trickle timer (RFC 6206), not every dioPeriod.',
+    )
     # otf
     parser.add_argument( '--otfThreshold',
         dest       = 'otfThreshold',
@@ -263,7 +343,16 @@ def parseCliOptions():
         help       = '[debug] add individual summarys per node for Throughput.',
     )
     
-    options        = parser.parse_args()
+    options        = parser.parse_args(args)
+    
+    # one master seed for all runs, recorded in the output header; reused
+    # from simDataDir, so that a restarted batch resumes its runs
+    if options.seed==None:
+        if options.restoreFrom:
+            options.seed = RandomStreams.newMasterSeed() # replaced by the checkpoint's
+        else:
+            registry     = RunRegistry.RunRegistry(options.simDataDir)
+            options.seed = registry.getMasterSeed(RandomStreams.newMasterSeed())
     
     return options.__dict__
 
@@ -275,11 +364,12 @@ def printOrLog(simParam,output):
     else:
         print output
 
-def runSims(options):
-    # record simulation start time
-    simStartTime   = time.time()
+def getSimParams(options):
+    '''
+    compute all the simulation parameter combinations.
     
-    # compute all the simulation parameter combinations
+    Returns (combinationKeys,simParams).
+    '''
     combinationKeys     = sorted([k for (k,v) in options.items() if type(v)==list])
     simParams           = []
     for p in itertools.product(*[options[k] for k in combinationKeys]):
@@ -291,15 +381,130 @@ def runSims(options):
                 simParam[k] = v
         simParams      += [simParam]
     
+    return (combinationKeys,simParams)
+
+def runOneRun(simParam,combinationKeys,runNum,runStartTime,newFile=None):
+    '''
+    run a single simulation run, in this process.
+    
+    Returns the output file the run wrote to, raises RuntimeError when the
+    run did not complete.
+    '''
+    
+    # profile the whole run, set-up included
+    if simParam.get('profile'):
+        profiler     = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler     = None
+    
+    # create singletons
+    settings         = SimSettings.SimSettings(**simParam)
+    settings.setStartTime(runStartTime)
+    settings.setCombinationKeys(combinationKeys)
+    simengine        = SimEngine.SimEngine(runNum,restoreFrom=simParam.get('restoreFrom'))
+    simstats         = SimStats.SimStats(runNum,newFile)
+    
+    # save the state at checkpointAt, see --restoreFrom
+    if simParam.get('checkpointAt'):
+        simengine.checkpointAtAsn(
+            simParam['checkpointAt'],
+            settings.getCheckpointFile(runNum,simParam['checkpointAt']),
+        )
+    
+    if profiler:
+        # cProfile only sees this thread, run the simulation in it
+        simengine.run()
+    else:
+        # start simulation run
+        simengine.start()
+        
+        # wait for simulation run to end
+        simengine.join()
+    
+    outputFile       = settings.getOutputFile()
+    completed        = simengine.completed
+    
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(settings.getProfileFile(runNum))
+    
+    # destroy singletons
+    simstats.destroy()
+    simengine.destroy()
+    settings.destroy()
+    
+    # a callback raised in the simulation thread (its traceback is printed)
+    if not completed:
+        raise RuntimeError('run {0} did not complete'.format(runNum))
+    
+    return outputFile
+
+def restoreSim(options):
+    '''
+    resume the run saved in the options['restoreFrom'] checkpoint.
+    '''
+    header         = Checkpoint.readHeader(options['restoreFrom'])
+    
+    simParam       = dict(header['settings'])
+    for k in RESTORE_RUN_OPTIONS:
+        simParam[k] = options[k]
+    
+    printOrLog(simParam,'restoring run {0} from {1}, at ASN {2}'.format(
+        header['runNum'],
+        options['restoreFrom'],
+        header['asn'],
+    ))
+    
+    runOneRun(simParam,simParam['combinationKeys'],header['runNum'],time.time(),newFile=True)
+
+def runSims(options):
+    # resume a single run from its checkpoint
+    if options['restoreFrom']:
+        restoreSim(options)
+        return
+    
+    # record simulation start time
+    simStartTime   = time.time()
+    
+    # compute all the simulation parameter combinations
+    (combinationKeys,simParams) = getSimParams(options)
+    
     print simParams
+    
+    # runs finished by earlier (interrupted) invocations
+    registry       = RunRegistry.RunRegistry(options['simDataDir'])
+    
     # run a simulation for each set of simParams
     for (simParamNum,simParam) in enumerate(simParams):
         
         # record run start time
         runStartTime = time.time()
         
+        # skip the runs already finished, they were appended in order
+        firstRunNum  = 0
+        lastEntry    = None
+        while firstRunNum<simParam['numRuns'] and not options['noResume']:
+            entry    = registry.get(registry.getRunKey(simParam,firstRunNum),simParam)
+            if entry==None:
+                break
+            lastEntry    = entry
+            firstRunNum += 1
+        if lastEntry:
+            # drop what an interrupted run appended after the last finished one
+            for (outputFile,size) in lastEntry['outputs'].items():
+                with open(outputFile,'r+') as f:
+                    f.truncate(size)
+            for (columnsDir,numRows) in lastEntry.get('columns',{}).items():
+                SimStats.StatsColumnWriter.truncate(columnsDir,numRows)
+            printOrLog(simParam,'parameters {0}/{1}, skipping {2} finished runs'.format(
+               simParamNum+1,
+               len(simParams),
+               firstRunNum,
+            ))
+        
         # run the simulation runs
-        for runNum in xrange(simParam['numRuns']):
+        for runNum in xrange(firstRunNum,simParam['numRuns']):
             
             # print
             output  = 'parameters {0}/{1}, run {2}/{3}'.format(
@@ -311,23 +516,20 @@ def runSims(options):
 
             printOrLog(simParam,output)
             
-            # create singletons
-            settings         = SimSettings.SimSettings(**simParam)
-            settings.setStartTime(runStartTime)
-            settings.setCombinationKeys(combinationKeys)
-            simengine        = SimEngine.SimEngine(runNum)
-            simstats         = SimStats.SimStats(runNum)
-            
-            # start simulation run
-            simengine.start()
-            
-            # wait for simulation run to end
-            simengine.join()
-            
-            # destroy singletons
-            simstats.destroy()
-            simengine.destroy()
-            settings.destroy()
+            startTime    = time.time()
+            try:
+                outputFile = runOneRun(simParam,combinationKeys,runNum,runStartTime)
+            except RuntimeError as err:
+                # not recorded as finished, run again on resume
+                printOrLog(simParam,str(err))
+                continue
+            registry.markDone(
+                registry.getRunKey(simParam,runNum),
+                simParam,
+                runNum,
+                outputFile,
+                time.time()-startTime,
+            )
         
         # print
         output  = 'simulation ended after {0:.0f}s.'.format(time.time()-simStartTime)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+'''
+\brief Attribute the latency of the packets to hop depth and cause.
+
+Collects the .hoptrace files written by runSimOneCPU --hopTrace under the
+given directories, and splits the time each packet spent at each hop into:
+- queue:   from its enqueue to the head of the TX queue, behind other packets;
+- cell:    from the head of the TX queue to its first transmission, waiting
+           for a TX cell to the parent;
+- retries: from its first transmission to its reception by the parent.
+
+The depth of a hop is the number of hops from its transmitter to the DAG root
+(1 for the transmissions to the DAG root), whatever the source of the packet.
+The report gives, per depth and overall, the mean and percentiles (in slots)
+of each cause, and its share of the total latency.
+'''
+
+#============================ adjust path =====================================
+
+import os
+import sys
+if __name__=='__main__':
+    here = sys.path[0]
+    sys.path.insert(0, os.path.join(here, '..'))
+
+#============================ imports =========================================
+
+import argparse
+
+from SimEngine     import HopTrace,    \
+                          Histogram
+
+#============================ defines =========================================
+
+CAUSES            = ['queue','cell','retries']
+PERCENTILES       = [50,95,99]
+
+#============================ helpers =========================================
+
+def findTraces(paths):
+    ''' the .hoptrace files in paths (files or directories, searched recursively) '''
+    traceFiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (dirpath,_,filenames) in os.walk(path):
+                traceFiles += [os.path.join(dirpath,f) for f in filenames if f.endswith('.hoptrace')]
+        else:
+            traceFiles += [path]
+    return sorted(traceFiles)
+
+def newDepthStats():
+    stats = dict([(cause,Histogram.Histogram()) for cause in CAUSES+['total']])
+    stats['numRetries'] = 0
+    return stats
+
+def summarize(traceFiles):
+    '''
+    the per depth statistics of the hops in traceFiles, as a dict of depth to
+    a dict of cause (and 'total') to Histogram, and the Histogram of the
+    end-to-end latency.
+    '''
+    depthStats   = {}
+    latency      = Histogram.Histogram()
+    for traceFile in traceFiles:
+        for (srcId,genAsn,deliveryAsn,hops) in HopTrace.readTrace(traceFile):
+            latency.add(deliveryAsn-genAsn)
+            for (i,(enqueueAsn,headAsn,firstTxAsn,rxAsn,numRetries)) in enumerate(hops):
+                depth = len(hops)-i
+                stats = depthStats.get(depth)
+                if stats==None:
+                    stats = depthStats[depth] = newDepthStats()
+                stats['queue'].add(headAsn-enqueueAsn)
+                stats['cell'].add(firstTxAsn-headAsn)
+                stats['retries'].add(rxAsn-firstTxAsn)
+                stats['total'].add(rxAsn-enqueueAsn)
+                stats['numRetries'] += numRetries
+    return (depthStats,latency)
+
+def formatRow(label,stats):
+    total  = stats['total'].sum
+    cols   = ['{0:>5} {1:>8}'.format(label,stats['total'].count)]
+    for cause in CAUSES+['total']:
+        hist  = stats[cause]
+        share = 100.0*hist.sum/total if total else 0
+        cols += ['{0:>11.1f} {1}'.format(
+            hist.getMean(),
+            ' '.join(['{0:>6}'.format(hist.getPercentile(p)) for p in PERCENTILES]),
+        )]
+        if cause!='total':
+            cols += ['{0:>5.1f}%'.format(share)]
+    cols  += ['{0:>7.2f}'.format(float(stats['numRetries'])/stats['total'].count if stats['total'].count else 0)]
+    return ' | '.join(cols)
+
+def writeReport(depthStats,latency,traceFiles,f):
+    f.write('hop latency (slots) of {0} packet(s) in {1} trace(s):\n'.format(latency.count,len(traceFiles)))
+    for traceFile in traceFiles:
+        f.write('    {0}\n'.format(traceFile))
+    f.write('\n')
+
+    header = ['depth     hops']
+    for cause in CAUSES+['total']:
+        header += ['{0:>11} {1}'.format(
+            cause+' avg',
+            ' '.join(['{0:>6}'.format('p{0}'.format(p)) for p in PERCENTILES]),
+        )]
+        if cause!='total':
+            header += [' share']
+    header += ['retries']
+    f.write(' | '.join(header)+'\n')
+
+    allStats = newDepthStats()
+    for depth in sorted(depthStats.keys()):
+        stats = depthStats[depth]
+        f.write(formatRow(depth,stats)+'\n')
+        for cause in CAUSES+['total']:
+            allStats[cause] += stats[cause]
+        allStats['numRetries'] += stats['numRetries']
+    f.write(formatRow('all',allStats)+'\n')
+
+    f.write('\nend-to-end latency (slots): avg {0:.1f} {1} max {2}\n'.format(
+        latency.getMean(),
+        ' '.join(['p{0} {1}'.format(p,latency.getPercentile(p)) for p in PERCENTILES]),
+        latency.max,
+    ))
+
+#============================ main ============================================
+
+def parseCliOptions():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument( 'paths',
+        nargs      = '*',
+        type       = str,
+        default    = ['simData'],
+        help       = '.hoptrace files, or directories to search for them.',
+    )
+    parser.add_argument( '--report',
+        dest       = 'report',
+        type       = str,
+        default    = None,
+        help       = 'Report file, instead of the standard output.',
+    )
+
+    options        = parser.parse_args()
+
+    return options.__dict__
+
+def main():
+
+    options      = parseCliOptions()
+
+    traceFiles   = findTraces(options['paths'])
+    if not traceFiles:
+        print 'no .hoptrace file found in {0}'.format(', '.join(options['paths']))
+        sys.exit(1)
+
+    (depthStats,latency) = summarize(traceFiles)
+
+    if options['report']:
+        with open(options['report'],'w') as f:
+            writeReport(depthStats,latency,traceFiles,f)
+        print 'summarized {0} trace(s) into {1}'.format(len(traceFiles),options['report'])
+    else:
+        writeReport(depthStats,latency,traceFiles,sys.stdout)
+
+if __name__=='__main__':
+    main()